@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  auto_timezone.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Detects user's timezone (in its own process) while Cnchi shows its
+    first screens. Kept out of the timezone page so it can be started
+    without loading the page """
+
+import hashlib
+import http.client
+import logging
+import multiprocessing
+import os
+import time
+import urllib.request
+import urllib.error
+
+import misc.extra as misc
+import startup_prefetch
+
+# When testing, no _() is available
+try:
+    _("")
+except NameError as err:
+    def _(message):
+        return message
+
+# Queue where the autotimezone process stores detected coords
+_AUTO_TIMEZONE_COORDS = None
+
+
+def start_auto_timezone_process(settings):
+    """ Starts the process that tries to determine our timezone (only
+        once). Returns the queue where it will store detected coords """
+    global _AUTO_TIMEZONE_COORDS
+    if _AUTO_TIMEZONE_COORDS is None:
+        _AUTO_TIMEZONE_COORDS = multiprocessing.Queue()
+        proc = AutoTimezoneProcess(_AUTO_TIMEZONE_COORDS, settings)
+        proc.daemon = True
+        proc.name = "timezone"
+        proc.start()
+    return _AUTO_TIMEZONE_COORDS
+
+
+class AutoTimezoneProcess(multiprocessing.Process):
+    """ Thread that asks our server for user's location """
+
+    def __init__(self, coords_queue, settings):
+        super(AutoTimezoneProcess, self).__init__()
+        self.coords_queue = coords_queue
+        self.settings = settings
+
+    def run(self):
+        """ main thread method """
+        # Do not start looking for our timezone until we've reached the
+        # language screen (welcome.py sets timezone_start to true when
+        # next is clicked)
+        while not self.settings.get('timezone_start'):
+            time.sleep(2)
+
+        coords = self.use_geoip()
+        if not coords:
+            msg = "Could not detect your timezone using GeoIP database. Let's use another method."
+            logging.warning(msg)
+            coords = self.use_geo_antergos()
+
+        # If latitude and longitude are zero it means something bad has happened
+        if not coords or (float(coords[0]) == 0 and float(coords[1]) == 0):
+            logging.warning(
+                "Could not detect your timezone. Are you behind a firewall?")
+            return
+
+        logging.debug(
+            _("Timezone (latitude %s, longitude %s) detected."),
+            coords[0], coords[1])
+        self.coords_queue.put(coords)
+
+    @staticmethod
+    def use_geoip():
+        """ Determine our location using GeoIP database """
+        logging.debug("Getting your location using GeoIP database")
+        geo = startup_prefetch.get_service().wait(startup_prefetch.GEOIP)
+        if geo is None or not geo.get_location():
+            import geoip
+            geo = geoip.GeoIP()
+        location = geo.get_location()
+        if location:
+            return [location.latitude, location.longitude]
+        return None
+
+    @staticmethod
+    def maybe_wait_for_network():
+        """ Waits until there is an Internet connection available """
+        misc.wait_for_connection()
+
+
+    def use_geo_antergos(self):
+        """ Determine our location using geo.antergos.com """
+        # Calculate logo hash
+        logo = "data/images/antergos/antergos-logo-mini2.png"
+        logo_path = os.path.join(self.settings.get("cnchi"), logo)
+        with open(logo_path, "rb") as logo_file:
+            logo_bytes = logo_file.read()
+        logo_hasher = hashlib.sha1()
+        logo_hasher.update(logo_bytes)
+        logo_digest = logo_hasher.digest()
+
+        # Wait until there is an Internet connection available
+        self.maybe_wait_for_network()
+
+        # OK, now get our timezone
+        logging.debug("We have connection. Let's get our timezone")
+
+        try:
+            url = urllib.request.Request(
+                url="http://geo.antergos.com",
+                data=logo_digest,
+                headers={"User-Agent": "Antergos Installer", "Connection": "close"})
+            with urllib.request.urlopen(url) as conn:
+                coords = conn.read().decode('utf-8').strip()
+            if coords == "0 0":
+                # Sometimes server returns 0 0, we treat it as an error
+                coords = None
+            else:
+                coords = coords.split()
+        except (OSError, urllib.error.HTTPError, http.client.HTTPException) as err:
+            template = "Error getting timezone coordinates. " \
+                "An exception of type {0} occured. Arguments:\n{1!r}"
+            message = template.format(type(err).__name__, err.args)
+            logging.error(message)
+            coords = None
+        return coords
@@ -33,6 +33,9 @@ import os
 import re
 import tempfile
 import logging
+import mmap
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from misc.run_cmd import call
 
@@ -41,6 +44,8 @@ try:
 except ImportError:
     import extra as misc
 
+import parted3.block_devices as block_devices
+
 # When testing, no _() is available
 try:
     _("")
@@ -69,6 +74,17 @@ OS_RELEASE_PATHS = ["usr/lib/os-release", "etc/os-release"]
 
 UNKNOWN = "unknown"
 
+# Maximum number of partitions probed at the same time
+MAX_PROBES = 4
+
+# Used when /sys/class/block is not available
+PARTITION_RE = re.compile(
+    r'^((sd|hd|vd|xvd)[a-z]+\d+|(nvme\d+n\d+|mmcblk\d+)p\d+)$')
+
+# (partition, uuid, fstype, size) -> detected os
+_OS_CACHE = {}
+_OS_CACHE_LOCK = threading.Lock()
+
 
 def _check_windows(mount_name):
     """ Checks for a Microsoft Windows installed """
@@ -96,11 +112,12 @@ def _search_for_marks(path, marks):
     """ Search for specific string (mark) in path file """
     if os.path.exists(path):
         with open(path, "rb") as system_file:
-            lines = system_file.readlines()
-        for line in lines:
-            for mark in marks:
-                if mark.encode('utf-8') in line:
-                    return True
+            if os.fstat(system_file.fileno()).st_size == 0:
+                return False
+            with mmap.mmap(system_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for mark in marks:
+                    if data.find(mark.encode('utf-8')) != -1:
+                        return True
     return False
 
 def _check_vista(system_path):
@@ -130,17 +147,24 @@ def _check_winxp(system_path):
     return False
 
 
-@misc.raise_privileges
-def _hexdump8081(partition):
-    """ Runs hexdump on partition to try to identify the boot sector """
-    cmd = ["/usr/bin/hexdump", "-v", "-n", "2", "-s", "0x80", "-e", '2/1 "%02x"', partition]
-    hexdump = call(cmd)
-    return hexdump
+def _read8081(partition):
+    """ Reads bytes 0x80-0x81 of partition (as an hex string) to try to
+        identify the boot sector """
+    try:
+        fd = os.open(partition, os.O_RDONLY)
+        try:
+            data = os.pread(fd, 2, 0x80)
+        finally:
+            os.close(fd)
+    except OSError as err:
+        logging.debug("Can't read %s boot sector: %s", partition, err)
+        return ""
+    return data.hex()
 
 
 def _get_partition_info(partition):
     """ Get bytes 0x80-0x81 of VBR to identify Boot sectors. """
-    bytes80_to_81 = _hexdump8081(partition)
+    bytes80_to_81 = _read8081(partition)
 
     bst = {
         '0000': 'Data or Swap',  # Data or swap partition
@@ -266,31 +290,77 @@ def _get_os(mount_name):
     return detected_os
 
 
-def get_os_dict():
-    """ Returns all detected OSes in a dict """
-    oses = {}
-
-    tmp_dir = tempfile.mkdtemp()
-
+def _get_partitions():
+    """ Returns all partitions (of any kind of disk) in /proc/partitions """
+    partitions = []
     with open("/proc/partitions", 'r') as partitions_file:
         for line in partitions_file:
             line_split = line.split()
-            if line_split:
-                device = line_split[3]
-                if "sd" in device and re.search(r'\d+$', device):
-                    # ok, it has sd and ends with a number
-                    device = "/dev/" + device
-                    call(["/usr/bin/mount", device, tmp_dir])
-                    oses[device] = _get_os(tmp_dir)
-                    call(["/usr/bin/umount", "-l", tmp_dir])
-                    if oses[device] == UNKNOWN:
-                        # As a last resort, try reading partition info
-                        # with hexdump
-                        oses[device] = _get_partition_info(device)
+            if len(line_split) < 4 or line_split[0] == "major":
+                continue
+            blocks, device = line_split[2], line_split[3]
+            if blocks == '1':
+                # Extended partition, it can't be mounted
+                continue
+            sys_path = os.path.join("/sys/class/block", device)
+            if os.path.exists(sys_path):
+                is_partition = os.path.exists(os.path.join(sys_path, "partition"))
+            else:
+                is_partition = bool(PARTITION_RE.match(device))
+            if is_partition:
+                partitions.append("/dev/" + device)
+    return partitions
+
+
+def _get_cache_key(device):
+    """ Returns the key that identifies the file system in device """
+    return (
+        device,
+        block_devices.get_uuid(device),
+        block_devices.get_fstype(device),
+        block_devices.get_size(device))
+
+
+def _probe(device):
+    """ Mounts (read only) device and tries to detect its OS """
+    key = _get_cache_key(device)
+    with _OS_CACHE_LOCK:
+        if key in _OS_CACHE:
+            return _OS_CACHE[key]
+
+    tmp_dir = tempfile.mkdtemp(prefix="cnchi-probe-")
     try:
-        os.rmdir(tmp_dir)
-    except OSError:
-        pass
+        detected_os = UNKNOWN
+        if call(["/usr/bin/mount", "-o", "ro", device, tmp_dir]) is not False:
+            try:
+                detected_os = _get_os(tmp_dir)
+            finally:
+                call(["/usr/bin/umount", "-l", tmp_dir])
+        if detected_os == UNKNOWN:
+            # As a last resort, try reading partition boot sector
+            detected_os = _get_partition_info(device)
+    finally:
+        try:
+            os.rmdir(tmp_dir)
+        except OSError:
+            pass
+
+    with _OS_CACHE_LOCK:
+        _OS_CACHE[key] = detected_os
+    return detected_os
+
+
+def get_os_dict():
+    """ Returns all detected OSes in a dict """
+    partitions = _get_partitions()
+    if not partitions:
+        return {}
+
+    # Privileges are process wide, raise them once for all probes
+    with misc.raised_privileges():
+        with ThreadPoolExecutor(max_workers=MAX_PROBES) as executor:
+            results = executor.map(_probe, partitions)
+            oses = dict(zip(partitions, results))
 
     return oses
 
@@ -57,8 +57,10 @@ import misc.extra as misc
 from misc.run_cmd import call
 import show_message as show
 import info
+import startup_prefetch
 
-from logging_utils import ContextFilter
+from logging_utils import (
+    ContextFilter, QueueLogHandler, SubsystemFilter, parse_subsystem_levels)
 import logging_color
 
 #try:
@@ -215,6 +217,10 @@ class CnchiInit():
         # Setup our logging framework
         self.setup_logging()
 
+        # Start checking our connection, location, Cnchi version and
+        # packages list while we initialize everything else
+        startup_prefetch.start()
+
         # Enables needed repositories only if it's not enabled
         self.enable_repositories()
 
@@ -281,10 +287,13 @@ class CnchiInit():
         else:
             log_level = logging.INFO
 
+        # Subsystems may use their own log level
+        subsystem_filter = SubsystemFilter(log_level, self.cmd_line.loglevels)
+        log_level = subsystem_filter.get_min_level()
+
         logger.setLevel(log_level)
 
         context_filter = ContextFilter()
-        logger.addFilter(context_filter.filter)
 
         datefmt = "%Y-%m-%d %H:%M:%S"
 
@@ -296,6 +305,9 @@ class CnchiInit():
             "($BOLD%(filename)s$RESET:%(lineno)d)")
         color_formatter = logging_color.ColoredFormatter(color_fmt, datefmt)
 
+        # All these handlers are fed by a QueueLogHandler (in its thread)
+        handlers = []
+
         try:
             # File logger
             log_path = os.path.join(CnchiInit.LOG_FOLDER, 'cnchi.log')
@@ -303,7 +315,7 @@ class CnchiInit():
                 file_handler = logging.FileHandler(log_path, mode='w')
             file_handler.setLevel(log_level)
             file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+            handlers.append(file_handler)
 
             # Resources log (debugging purposes)
             if self.cmd_line.logresources:
@@ -315,7 +327,7 @@ class CnchiInit():
                 resources_formatter = logging_resources.ResourcesFormatter(
                     fmt, datefmt)
                 resources_handler.setFormatter(resources_formatter)
-                logger.addHandler(resources_handler)
+                handlers.append(resources_handler)
         except PermissionError as permission_error:
             print("Cannot open ", log_path, " : ", permission_error)
                 
@@ -326,9 +338,11 @@ class CnchiInit():
             stream_handler = logging.StreamHandler()
             stream_handler.setLevel(log_level)
             stream_handler.setFormatter(color_formatter)
-            logger.addHandler(stream_handler)
+            handlers.append(stream_handler)
        
 
+        # (level, message) to log once our handlers are ready
+        bugsnag_log = None
         if not BUGSNAG_ERROR:
             # Bugsnag logger
             bugsnag_api = context_filter.api_key
@@ -344,14 +358,23 @@ class CnchiInit():
                 bugsnag_handler.addFilter(context_filter.filter)
                 bugsnag.before_notify(
                     context_filter.bugsnag_before_notify_callback)
-                logger.addHandler(bugsnag_handler)
-                logging.info(
+                handlers.append(bugsnag_handler)
+                bugsnag_log = (
+                    logging.INFO,
                     "Sending Cnchi log messages to bugsnag server (using python-bugsnag).")
             else:
-                logging.warning(
+                bugsnag_log = (
+                    logging.WARNING,
                     "Cannot read the bugsnag api key, logging to bugsnag is not possible.")
         else:
-            logging.warning(BUGSNAG_ERROR)
+            bugsnag_log = (logging.WARNING, BUGSNAG_ERROR)
+
+        queue_handler = QueueLogHandler(handlers)
+        queue_handler.setLevel(log_level)
+        queue_handler.addFilter(subsystem_filter)
+        logger.addHandler(queue_handler)
+
+        logging.log(*bugsnag_log)
 
     @staticmethod
     def check_gtk_version():
@@ -459,6 +482,15 @@ class CnchiInit():
         parser.add_argument(
             "-f", "--force", help=_("Runs cnchi even when another instance is running"),
             action="store_true")
+        parser.add_argument(
+            "-i", "--pipelined-install",
+            help=_("Install packages while the rest are still being downloaded"),
+            action="store_true")
+        parser.add_argument(
+            "-l", "--loglevels",
+            help=_("Sets the log level of a subsystem (download, alpm or partitioning). "
+                   "Example: download=info,alpm=warning"),
+            nargs='?', type=parse_subsystem_levels)
         parser.add_argument(
             "-n", "--no-check", help=_("Makes checks optional in check screen"),
             action="store_true")
@@ -29,11 +29,23 @@
 
 """ Configuration module for Cnchi """
 
+import copy
 import multiprocessing
 
+# Values of these types are copied before returning them, so callers can't
+# change our local copy. Anything else (pipes, processes...) is returned as is
+COPIED_TYPES = (list, dict, set)
+
 
 class Settings():
-    """ Store all Cnchi setup options here """
+    """ Store all Cnchi setup options here
+
+        All settings live in a one element queue served by a manager process,
+        so they are shared between Cnchi processes (Process, RankMirrors...).
+        Each process keeps a local copy that is used to read settings. A
+        version counter (in shared memory) is increased every time a setting
+        changes, so a process only asks the manager for the settings again
+        when its local copy is outdated. """
 
     def __init__(self):
         """ Initialize default configuration """
@@ -42,6 +54,13 @@ class Settings():
         # Creates a one element size queue
         self._settings = self._manager.Queue(1)
 
+        # Shared version counter (increased each time settings change)
+        self._version = multiprocessing.RawValue('L', 0)
+
+        # Local (per process) copy of settings and its version
+        self._local_settings = None
+        self._local_version = -1
+
         self._set_defaults()
 
     def _set_defaults(self):
@@ -99,6 +118,7 @@ class Settings():
             'network_manager': 'NetworkManager',
             'pacman_config_file': '/etc/pacman.conf',
             'partition_mode': 'automatic',
+            'pipelined_install': False,
             'proxies': None,
             'rankmirrors_done': False,
             'rankmirrors_pipe': None,
@@ -138,32 +158,50 @@ class Settings():
     def _get_settings(self):
         """ Get a copy of our settings """
         settings = self._settings.get()
-        copy = settings.copy()
+        settings_copy = settings.copy()
         self._settings.put(settings)
-        return copy
+        return settings_copy
 
-    def _update_settings(self, new_settings):
-        """ Updates global settings """
-        settings = self._settings.get()
-        try:
-            settings.update(new_settings)
-        finally:
-            self._settings.put(settings)
+    def _get_local_settings(self):
+        """ Returns our local copy of settings, asking the manager for them
+            only if they have changed since we last got them """
+        # Read version before getting settings: if they change meanwhile,
+        # we will get them again next time
+        version = self._version.value
+        if self._local_settings is None or version != self._local_version:
+            self._local_settings = self._get_settings()
+            self._local_version = version
+        return self._local_settings
+
+    def sync(self):
+        """ Forget local copy of settings (next get will ask for them again) """
+        self._local_settings = None
 
     def get(self, key):
         """ Get one setting value """
-        settings = self._get_settings()
-        return settings.get(key, None)
+        value = self._get_local_settings().get(key, None)
+        if isinstance(value, COPIED_TYPES):
+            # Callers may modify the value, do not let them change our local copy
+            return copy.deepcopy(value)
+        return value
 
     def set(self, key, value):
-        """ Set one setting value """
-        settings = self._get_settings()
-        current = settings.get(key, 'keyerror')
-        exists = current != 'keyerror'
+        """ Set one setting value (and publish it to all processes) """
+        # Getting the settings from the queue locks them until we put them back
+        settings = self._settings.get()
+        try:
+            current = settings.get(key, 'keyerror')
+            exists = current != 'keyerror'
 
-        if exists and current and isinstance(current, list) and not isinstance(value, list):
-            settings[key].append(value)
-        else:
-            settings[key] = value
+            if exists and current and isinstance(current, list) and not isinstance(value, list):
+                settings[key].append(value)
+            else:
+                settings[key] = value
+
+            self._version.value += 1
+            version = self._version.value
+        finally:
+            self._settings.put(settings)
 
-        self._update_settings(settings)
+        self._local_settings = settings
+        self._local_version = version
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache_copy.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Copies package files between cache directories, avoiding copying
+    data when possible (hard links and reflinks) """
+
+import fcntl
+import logging
+import os
+import queue
+import shutil
+import threading
+
+# ioctl to clone (reflink) a file in btrfs, xfs...
+FICLONE = 0x40049409
+
+# Copy methods (in order of preference)
+METHOD_LINK = 'link'
+METHOD_REFLINK = 'reflink'
+METHOD_KERNEL = 'kernel'
+METHOD_COPY = 'copy'
+
+# Methods that do not copy any data
+NO_COPY_METHODS = [METHOD_LINK, METHOD_REFLINK]
+
+
+def _link(src, dst):
+    """ Creates a hard link """
+    os.link(src, dst)
+
+
+def _reflink(src, dst):
+    """ Clones src into dst (only works in filesystems with reflink support) """
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+
+def _kernel_copy(src, dst):
+    """ Copies file without passing data through user space """
+    size = os.path.getsize(src)
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        src_fd = src_file.fileno()
+        dst_fd = dst_file.fileno()
+        copied = 0
+        copy_file_range = getattr(os, 'copy_file_range', None)
+        while copied < size:
+            if copy_file_range:
+                count = copy_file_range(src_fd, dst_fd, size - copied)
+            else:
+                count = os.sendfile(dst_fd, src_fd, copied, size - copied)
+            if count == 0:
+                break
+            copied += count
+    if copied != size:
+        raise OSError("Short copy of {0} ({1} of {2} bytes)".format(src, copied, size))
+
+
+def _copy(src, dst):
+    """ Plain byte copy """
+    shutil.copyfile(src, dst)
+
+
+COPY_FUNCTIONS = [
+    (METHOD_LINK, _link),
+    (METHOD_REFLINK, _reflink),
+    (METHOD_KERNEL, _kernel_copy),
+    (METHOD_COPY, _copy)]
+
+
+def copy_file(src, dst):
+    """ Copies src to dst trying (in this order) a hard link, a reflink,
+        an in-kernel copy and, finally, a byte copy.
+        dst is replaced atomically. Returns the method used.
+        Raises OSError if the file can't be copied """
+    tmp_dst = dst + '.cnchi-tmp'
+    last_error = None
+    for method, copy_function in COPY_FUNCTIONS:
+        try:
+            if os.path.lexists(tmp_dst):
+                os.remove(tmp_dst)
+            copy_function(src, tmp_dst)
+            if method != METHOD_LINK:
+                shutil.copymode(src, tmp_dst)
+            os.replace(tmp_dst, dst)
+            return method
+        except OSError as err:
+            last_error = err
+    try:
+        os.remove(tmp_dst)
+    except OSError:
+        pass
+    raise last_error
+
+
+class CachePopulator():
+    """ Copies files to cache directories in the background using a single
+        worker thread and a bounded queue. Keeps count of how many bytes
+        have been copied and how many have been avoided (links/reflinks) """
+
+    # Maximum number of pending copies
+    MAX_PENDING = 64
+
+    def __init__(self):
+        self.jobs = queue.Queue(CachePopulator.MAX_PENDING)
+        self.worker = None
+        self.lock = threading.Lock()
+        self.bytes_copied = 0
+        self.bytes_avoided = 0
+
+    def copy(self, src, dst):
+        """ Copies src to dst now (in the calling thread) and updates stats.
+            Raises OSError if the file can't be copied """
+        method = copy_file(src, dst)
+        size = os.path.getsize(dst)
+        with self.lock:
+            if method in NO_COPY_METHODS:
+                self.bytes_avoided += size
+            else:
+                self.bytes_copied += size
+        logging.debug("%s copied to %s (%s)", src, dst, method)
+        return method
+
+    def add(self, src, dst):
+        """ Queues a copy of src to dst. Blocks if there are too many
+            pending copies """
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+        self.jobs.put((src, dst))
+
+    def run(self):
+        """ Worker thread """
+        while True:
+            src, dst = self.jobs.get()
+            try:
+                self.copy(src, dst)
+            except OSError as err:
+                # Do not worry if it's not possible
+                logging.debug("Can't copy %s to %s: %s", src, dst, err)
+            finally:
+                self.jobs.task_done()
+
+    def join(self):
+        """ Waits until all queued copies are done """
+        self.jobs.join()
+        logging.debug(
+            "Cache population: %d bytes copied, %d bytes not copied (links/reflinks)",
+            self.bytes_copied,
+            self.bytes_avoided)
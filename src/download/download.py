@@ -30,11 +30,12 @@
 
 import os
 import logging
+import urllib.parse
 
 import pyalpm
 
 try:
-    import pacman.pac as pac
+    import pacman.pac_pool as pac_pool
     import download.metalink as ml
     import download.download_requests as download_requests
 except ModuleNotFoundError:
@@ -42,7 +43,7 @@ except ModuleNotFoundError:
     CNCHI_PATH = "/usr/share/cnchi"
     sys.path.append(CNCHI_PATH)
     sys.path.append(os.path.join(CNCHI_PATH, "src"))
-    import pacman.pac as pac
+    import pacman.pac_pool as pac_pool
     import metalink as ml
     import download_requests
 
@@ -56,6 +57,36 @@ except NameError as err:
     def _(message):
         return message
 
+class MirrorRank():
+    """ Index of the ranked mirror list (mirror -> position) so finding
+        the priority of an url does not need to scan the whole list """
+
+    # Rank given to urls whose mirror is not in the ranked list
+    NOT_RANKED = 9999
+
+    def __init__(self, ranked):
+        self.ranks = {}
+        for position, mirror_url in enumerate(ranked or []):
+            key = self.get_key(mirror_url)
+            if key and key not in self.ranks:
+                self.ranks[key] = position
+
+    @staticmethod
+    def get_key(url):
+        """ Normalised mirror part (scheme and host) of an url """
+        if not url:
+            return None
+        parts = urllib.parse.urlsplit(url.strip())
+        return parts.scheme.lower(), parts.netloc.lower()
+
+    def get_rank(self, url):
+        """ Returns the position of the url's mirror in the ranked list """
+        key = self.get_key(url)
+        if key is None:
+            return MirrorRank.NOT_RANKED
+        return self.ranks.get(key, MirrorRank.NOT_RANKED)
+
+
 class DownloadPackages():
     """ Class to download packages. This class tries to previously download
         all necessary packages for  Antergos installation using requests. """
@@ -86,8 +117,17 @@ class DownloadPackages():
         # List of packages' metalinks
         self.metalinks = None
 
-    def start_download(self, metalinks=None):
-        """ Begin download """
+        # Position of each mirror in the ranked mirrorlist
+        self.mirror_rank = None
+
+        # Sorted url order for each list of repository servers
+        self.url_orders = {}
+
+    def start_download(self, metalinks=None, ready_callback=None):
+        """ Begin download
+            ready_callback(element) is called each time a package is ready
+            (downloaded and verified) in the pacman cache dir.
+            Returns True or raises InstallError """
         if metalinks:
             self.metalinks = metalinks
 
@@ -108,37 +148,51 @@ class DownloadPackages():
             self.events.queue,
             proxies)
 
-        if not download.start(self.metalinks):
+        if not download.start(self.metalinks, ready_callback):
             # When we can't download (even one package), we stop right here
             txt = _("Can't download needed packages. Cnchi can't continue.")
             raise misc.InstallError(txt)
 
+        return True
+
+    def get_mirror_rank(self):
+        """ Returns the mirror rank index (it is created only once) """
+        if self.mirror_rank is None:
+            # Use the mirrorlist we created earlier to determine a url's priority
+            self.mirror_rank = MirrorRank(self.settings.get('rankmirrors_result'))
+        return self.mirror_rank
+
     def url_sort_helper(self, url):
         """ helper method for sorting mirror urls """
-        if not url:
-            return 9999
-        # Use the mirrorlist we created earlier to determine a url's priority
-        ranked = self.settings.get('rankmirrors_result')
-        # Use the first part of the URL to find its position in the ranked mirror list
-        partial = '/'.join(url.split('/')[:3])
-        position = [i for i, s in enumerate(ranked) if partial in s] or [9999]
-        return position[0]
+        return self.get_mirror_rank().get_rank(url)
+
+    def sort_urls(self, urls):
+        """ Sorts urls based on the rankmirrors mirrorlist.
+            All packages from the same repository have the same list of
+            servers, so the order is computed once per repository """
+        servers = tuple(os.path.dirname(url) if url else url for url in urls)
+        order = self.url_orders.get(servers)
+        if order is None:
+            order = sorted(
+                range(len(urls)), key=lambda index: self.url_sort_helper(urls[index]))
+            self.url_orders[servers] = order
+        return [urls[index] for index in order]
 
     def add_metalink_info(self, metalink):
         """ Adds metalink info to metalinks list """
         # Get metalink info
-        metalink_info = ml.get_info(metalink)
+        self.add_download_info(ml.get_info(metalink))
 
-        # Update downloads list with the new info from
-        # the processed metalink
-        for key in metalink_info:
+    def add_download_info(self, download_info):
+        """ Adds download info (a dict of elements) to metalinks list """
+        # Update downloads list with the new info
+        for key in download_info:
             if key not in self.metalinks:
-                self.metalinks[key] = metalink_info[key]
-                urls = metalink_info[key]['urls']
+                self.metalinks[key] = download_info[key]
+                urls = download_info[key]['urls']
                 if self.settings:
                     # Sort urls based on the rankmirrors mirrorlist
-                    sorted_urls = sorted(urls, key=self.url_sort_helper)
-                    self.metalinks[key]['urls'] = sorted_urls
+                    self.metalinks[key]['urls'] = self.sort_urls(urls)
                 else:
                     # When testing, settings is not available
                     self.metalinks[key]['urls'] = urls
@@ -150,45 +204,22 @@ class DownloadPackages():
         self.events.add('percent', 0)
         self.events.add(
             'info', _('Creating the list of packages to download...'))
-        processed_packages = 0
-        total_packages = len(self.package_names)
-
         self.metalinks = {}
 
         try:
-            pacman = pac.Pac(
-                conf_path=self.pacman_conf_file,
-                callback_queue=self.events.queue)
-            if pacman is None:
-                return False
-        except pyalpm.error as ex:
-            self.metalinks = None
-            template = "Can't initialize pyalpm. " \
-                "An exception of type {0} occured. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            logging.error(message)
-            return False
-
-        try:
-            for package_name in self.package_names:
-                metalink = ml.create(pacman, package_name,
-                                     self.pacman_conf_file)
-                if metalink is None:
-                    txt = "Error creating metalink for package %s. Installation will stop"
-                    logging.error(txt, package_name)
-                    txt = _("Error creating metalink for package {}. "
-                            "Installation will stop").format(package_name)
-                    raise misc.InstallError(txt)
-
-                self.add_metalink_info(metalink)
-
-                # Show progress to the user
-                processed_packages += 1
-                percent = round(float(processed_packages / total_packages), 2)
-                self.events.add('percent', percent)
-
-            pacman.release()
-            del pacman
+            # The alpm handle is shared with the other installation stages
+            with pac_pool.handle(self.pacman_conf_file, self.events.queue) as pacman:
+                # Resolve all packages (and their dependencies) at once
+                download_info = ml.create_download_info(pacman, self.package_names)
+            if download_info is None:
+                txt = "Error creating the download list for packages %s. Installation will stop"
+                logging.error(txt, ' '.join(self.package_names))
+                txt = _("Error creating the list of packages to download. "
+                        "Installation will stop")
+                raise misc.InstallError(txt)
+
+            self.add_download_info(download_info)
+            self.events.add('percent', 1)
         except (KeyError, pyalpm.error) as ex:
             template = "Can't create download set. " \
                 "An exception of type {0} occured. Arguments:\n{1!r}"
@@ -32,9 +32,28 @@
 import hashlib
 import logging
 import os
+import threading
 
-def check_hash(path, element, queue_event=None):
-    """ Checks file hash (sha256 or md5) """
+try:
+    import download.hash_index as hash_index
+except ModuleNotFoundError:
+    import hash_index
+
+# Files are hashed in blocks of this size (1 MiB)
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Hash types we can check, in order of preference
+HASH_TYPES = ['sha256', 'md5']
+
+# Each thread reuses its own read buffer
+_LOCAL = threading.local()
+
+
+def check_hash(path, element, queue_event=None, file_hashes=None):
+    """ Checks file hash (sha256 or md5)
+        file_hashes is an optional dict (hash type -> hex digest) with the
+        hashes already computed (while downloading the file, for instance).
+        When a needed hash is there, the file is not read again. """
     # Note: path must exist!
 
     identity = element['identity']
@@ -43,9 +62,12 @@ def check_hash(path, element, queue_event=None):
     sha256 = get_element_hash(element, 'sha256')
     md5 = get_element_hash(element, 'md5')
 
+    if file_hashes is None:
+        file_hashes = {}
+
     # Check sha256 if available
     if sha256:
-        if sha256 != get_file_hash(path, 'sha256'):
+        if not check_file_hash(path, 'sha256', sha256, file_hashes):
             logging.warning("SHA256 hash of file %s does not match!", filename)
             return False
         logging.debug("SHA256 hash of %s is OK.", path)
@@ -56,7 +78,7 @@ def check_hash(path, element, queue_event=None):
 
     # sha256 not available let's check md5
     if md5:
-        if md5 != get_file_hash(path, 'md5'):
+        if not check_file_hash(path, 'md5', md5, file_hashes):
             logging.warning("MD5 hash of file %s does not match!", filename)
             return False
         logging.debug("MD5 hash of %s is OK.", path)
@@ -71,22 +93,82 @@ def check_hash(path, element, queue_event=None):
         queue_event('cache_pkgs_md5_check_failed', identity)
     return True
 
-def get_file_hash(path, hash_type):
-    """ Gets md5 or sha256 hash from a file """
+
+def check_file_hash(path, hash_type, expected, file_hashes):
+    """ Checks that path has the expected hash. Files already verified are
+        looked up in the hash index, so they're not hashed again. Files that
+        match are stored in the index """
+    # Take file info before hashing, so we notice if it changes meanwhile
+    file_stat = hash_index.get_stat(path)
+
+    file_hash = file_hashes.get(hash_type)
+    if not file_hash:
+        file_hash = hash_index.lookup(path, hash_type, file_stat)
+        if file_hash == expected:
+            logging.debug("%s hash of %s found in hash index", hash_type, path)
+            return True
+        file_hash = get_file_hash(path, hash_type)
+
+    if file_hash != expected:
+        return False
+
+    hash_index.store(path, {hash_type: file_hash}, file_stat)
+    return True
+
+
+def _get_buffer():
+    """ Returns this thread's read buffer """
+    buf = getattr(_LOCAL, 'buffer', None)
+    if buf is None:
+        buf = bytearray(HASH_BLOCK_SIZE)
+        _LOCAL.buffer = buf
+    return buf
+
+
+def update_from_file(path, hashes, size=None):
+    """ Feeds hashes (a list of hashlib objects) with the contents of a file.
+        If size is given, only the first size bytes are read.
+        Returns how many bytes have been read. """
+    buf = _get_buffer()
+    view = memoryview(buf)
+    total = 0
+    with open(path, 'rb', buffering=0) as myfile:
+        while size is None or total < size:
+            if size is None:
+                nbytes = myfile.readinto(buf)
+            else:
+                nbytes = myfile.readinto(view[:min(size - total, len(buf))])
+            if not nbytes:
+                break
+            for myhash in hashes:
+                myhash.update(view[:nbytes])
+            total += nbytes
+    return total
+
+
+def get_file_hashes(path, hash_types):
+    """ Gets several hashes (md5, sha256...) from a file reading it once
+        Returns a dict (hash type -> hex digest) """
 
     if not os.path.exists(path):
         return None
 
-    if hash_type == 'md5':
-        myhash = hashlib.md5()
-    else:
-        myhash = hashlib.sha256()
+    hashes = {hash_type: hashlib.new(hash_type) for hash_type in hash_types}
+    update_from_file(path, list(hashes.values()))
+    return {hash_type: myhash.hexdigest() for hash_type, myhash in hashes.items()}
 
-    with open(path, 'rb') as myfile:
-        for line in myfile:
-            myhash.update(line)
 
-    return myhash.hexdigest()
+def get_file_hash(path, hash_type):
+    """ Gets md5 or sha256 hash from a file """
+
+    if hash_type != 'md5':
+        hash_type = 'sha256'
+
+    file_hashes = get_file_hashes(path, [hash_type])
+    if file_hashes is None:
+        return None
+    return file_hashes[hash_type]
+
 
 def get_element_hash(element, hash_type):
     """ Get hash from one metalink element """
@@ -95,3 +177,34 @@ def get_element_hash(element, hash_type):
     if hashes:
         hash_value = hashes.get(hash_type, None)
     return hash_value
+
+
+class StreamHash():
+    """ Computes the hash of a metalink element while it is being
+        downloaded, so the file does not have to be read again to check it """
+
+    def __init__(self, element):
+        self.hash_type = None
+        self.myhash = None
+        for hash_type in HASH_TYPES:
+            if get_element_hash(element, hash_type):
+                self.hash_type = hash_type
+                self.myhash = hashlib.new(hash_type)
+                break
+
+    def update(self, data):
+        """ Adds downloaded data to the hash """
+        if self.myhash:
+            self.myhash.update(data)
+
+    def update_from_file(self, path, size):
+        """ Adds the first size bytes of an already downloaded
+            (partial) file to the hash """
+        if self.myhash:
+            update_from_file(path, [self.myhash], size)
+
+    def get_hashes(self):
+        """ Returns computed hash as a dict (the one check_hash expects) """
+        if self.myhash:
+            return {self.hash_type: self.myhash.hexdigest()}
+        return {}
@@ -31,20 +31,26 @@
 
 import os
 import logging
-import shutil
-import time
 import socket
-import io
 import threading
+import queue
+import urllib.parse
+import json
+import random
 
 import requests
 
 from misc.events import Events
+import misc.speed_meter as speed_meter
 
 try:
     import download.download_hash as dhash
+    import download.cache_copy as cache_copy
+    import download.hash_index as hash_index
 except ModuleNotFoundError:
     import download_hash as dhash
+    import cache_copy
+    import hash_index
 
 # When testing, no _() is available
 try:
@@ -53,40 +59,60 @@ except NameError as err:
     def _(message):
         return message
 
-class CopyToCache(threading.Thread):
-    ''' Class thread to copy a xz file to the user's
-        provided cache directory '''
+class Download():
+    """ Class to download packages using requests
+        This class tries to previously download all necessary packages for
+        Antergos installation using requests.
+        Several packages are downloaded at the same time (from different
+        mirrors when possible) using a pool of worker threads """
+
+    # Number of packages that are downloaded at the same time
+    MAX_WORKERS = 4
 
+    # Maximum number of simultaneous connections to the same mirror
+    MAX_PER_MIRROR = 2
+
+    # Size of the chunks read from the network (in bytes)
+    CHUNK_SIZE = 64 * 1024
+
+    # Downloaded packages are not copied to the ISO cache
     PACMAN_ISO_CACHE = "/var/cache/pacman/pkg"
 
-    def __init__(self, origin, xz_cache_dirs):
-        threading.Thread.__init__(self)
-        self.origin = origin
-        self.xz_cache_dirs = xz_cache_dirs
+    # Packages bigger than this (in bytes) are downloaded in segments
+    # (using http range requests) from several mirrors at the same time
+    SEGMENT_THRESHOLD = 16 * 1024 * 1024
 
-    def run(self):
-        basename = os.path.basename(self.origin)
-        for xz_cache_dir in self.xz_cache_dirs:
-            # Avoid using the ISO itself
-            if xz_cache_dir != CopyToCache.PACMAN_ISO_CACHE:
-                dst = os.path.join(xz_cache_dir, basename)
-                # Try to copy the file, do not worry if it's not possible
-                try:
-                    shutil.copy(self.origin, dst)
-                except (FileNotFoundError, FileExistsError, OSError):
-                    pass
+    # Maximum number of mirrors used to download one segmented package
+    MAX_SEGMENT_MIRRORS = 4
 
+    # Size of each segment (in bytes)
+    SEGMENT_SIZE = 4 * 1024 * 1024
 
-class Download():
-    """ Class to download packages using requests
-        This class tries to previously download all necessary packages for
-        Antergos installation using requests """
+    # Files are downloaded to filename.part and the download
+    # state is stored in filename.part.journal
+    PART_SUFFIX = '.part'
+    JOURNAL_SUFFIX = '.journal'
+
+    # Update the journal every time this many bytes are downloaded
+    JOURNAL_INTERVAL = 1024 * 1024
 
-    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue, proxies=None):
+    # Exponential backoff between retries (in seconds)
+    RETRY_BASE_DELAY = 2
+    RETRY_MAX_DELAY = 30
+
+    # Times an url is retried if its connection drops after making progress
+    MAX_URL_RETRIES = 3
+
+    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue, proxies=None,
+                 max_workers=MAX_WORKERS, max_per_mirror=MAX_PER_MIRROR):
         """ Initialize Download class. Gets default configuration """
         self.pacman_cache_dir = pacman_cache_dir
         self.xz_cache_dirs = xz_cache_dirs
+        # Verified hashes of cached packages are kept with them
+        hash_index.add_cache_dirs(xz_cache_dirs)
         self.proxies = proxies
+        self.max_workers = max(1, max_workers)
+        self.max_per_mirror = max(1, max_per_mirror)
 
         self.events = Events(callback_queue)
 
@@ -99,105 +125,235 @@ class Download():
         # Stores last issued event (to prevent repeating events)
         self.last_event = {}
 
-        self.copy_to_cache_threads = []
-
-
-    def start(self, downloads):
-        """ Downloads using requests """
-        downloaded = 0
-        total_downloads = len(downloads)
+        # Copies packages to (and from) the user's cache directories
+        self.cache_populator = cache_copy.CachePopulator()
+
+        # Protects all shared state below (and the events object)
+        self.lock = threading.Lock()
+
+        # Set when a package can't be downloaded, so all workers stop
+        self.abort = threading.Event()
+
+        # One semaphore per mirror (host), limits connections to each mirror
+        self.mirror_slots = {}
+
+        # Packages being downloaded right now: dst_path -> [completed, total]
+        self.in_flight = {}
+
+        # Per thread requests session (so connections are reused)
+        self.local = threading.local()
+
+        # Mirrors that do not honour range requests
+        self.no_range_mirrors = set()
+
+        self.started = 0
+        self.downloaded = 0
+        self.total_downloads = 0
+        self.ready_callback = None
+        # Measures speed and remaining time of the whole download set
+        self.speed_meter = speed_meter.SpeedMeter()
+
+    def add_event(self, event_type, event_text=""):
+        """ Adds an event (can be called from any worker thread) """
+        with self.lock:
+            self.events.add(event_type, event_text)
+
+    def start(self, downloads, ready_callback=None):
+        """ Downloads using requests
+            Elements are downloaded in the same order they have in downloads
+            (more or less, as several are downloaded at the same time).
+            If given, ready_callback(element) is called (from a worker thread)
+            as soon as an element is verified in the pacman cache dir """
+        self.ready_callback = ready_callback
+        self.started = 0
+        self.downloaded = 0
+        self.total_downloads = len(downloads)
+        self.speed_meter = speed_meter.SpeedMeter(
+            total=sum(self.get_element_size(element) for element in downloads.values()))
+        self.in_flight = {}
+        self.abort.clear()
 
         self.events.add('downloads_progress_bar', 'show')
         self.events.add('downloads_percent', '0')
-
-        self.copy_to_cache_threads = []
+        self.events.add('percent', 0)
 
         logging.debug(
-            "Downloading packages to pacman cache dir '%s'",
-            self.pacman_cache_dir)
+            "Downloading packages to pacman cache dir '%s' using %d workers",
+            self.pacman_cache_dir,
+            self.max_workers)
 
-        while downloads:
-            needs_to_download = True
+        # Fill the queue with all elements to download
+        jobs = queue.Queue()
+        for element in downloads.values():
+            jobs.put(element)
+        downloads.clear()
 
-            # Get package to download from downloads list
-            _identity, element = downloads.popitem()
+        workers = []
+        for _index in range(min(self.max_workers, self.total_downloads)):
+            worker = threading.Thread(target=self.worker, args=(jobs,))
+            worker.start()
+            workers.append(worker)
 
-            self.events.add('percent', 0)
+        for worker in workers:
+            worker.join()
 
-            txt = _("Fetching {0} {1} ({2}/{3})...").format(
-                element['identity'],
-                element['version'],
-                downloaded + 1,
-                total_downloads)
-            self.events.add('info', txt)
+        # Wait until all xz packages are also copied to provided cache (if any)
+        self.cache_populator.join()
 
-            dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
-
-            if os.path.exists(dst_path):
-                # File already exists in destination pacman's cache
-                # (previous install?). We check the file hash.
-                if not dhash.check_hash(dst_path, element):
-                    # We're sure it's a wrong hash. Force to download it
-                    needs_to_download = True
-                else:
-                    needs_to_download = False
-                    logging.debug(
-                        "File %s found in %s cache, there is no need to download it",
-                        element['filename'],
-                        self.pacman_cache_dir)
-            else:
-                needs_to_download = True
-                # Check all cache directories
-                for xz_cache_dir in self.xz_cache_dirs:
-                    dst_xz_cache_path = os.path.join(
-                        xz_cache_dir,
-                        element['filename'])
-
-                    if (os.path.exists(dst_xz_cache_path) and
-                            dhash.check_hash(dst_xz_cache_path, element)):
-                        # We're lucky, the package is already downloaded
-                        # in the cache the user has given us
-                        # and its hash checks out
-                        try:
-                            shutil.copy(dst_xz_cache_path, dst_path)
-                            needs_to_download = False
-                            logging.debug(
-                                "%s found in %s cache, there is no need to download it",
-                                element['filename'],
-                                xz_cache_dir)
-                            # Get out of the cache for loop, as we managed
-                            # to find the package in this cache directory
-                            break
-                        except OSError as os_error:
-                            needs_to_download = True
-                            logging.debug(
-                                "Error copying %s to %s : %s",
-                                dst_xz_cache_path,
-                                dst_path,
-                                os_error)
-
-            if needs_to_download and not self.download_package(element, dst_path):
+        if self.abort.is_set():
+            return False
+
+        self.events.add('downloads_progress_bar', 'hide')
+        return True
+
+    @staticmethod
+    def get_element_size(element):
+        """ Returns element size (in bytes) as stated in its metalink """
+        try:
+            return int(element.get('size', 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def worker(self, jobs):
+        """ Worker thread. Gets elements from the jobs queue and
+            downloads them until the queue is empty """
+        while not self.abort.is_set():
+            try:
+                element = jobs.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                element_ok = self.get_element(element)
+            except Exception as err:
+                # Do not let this thread die silently (disk full, bad
+                # metalink element...), abort the whole download
+                logging.error(
+                    "Error downloading %s: %s", element.get('filename'), err)
+                self.abort.set()
+                break
+
+            if not element_ok:
                 # None of the mirror urls works.
                 # Stop right here, so the user does not have to wait
                 # to download the other packages.
                 logging.error(
                     "Can't download %s, even after trying all available mirrors",
                     element['filename'])
-                return False
+                self.abort.set()
+                break
 
-            downloaded += 1
+            if self.ready_callback:
+                try:
+                    self.ready_callback(element)
+                except Exception as err:
+                    # Whoever waits for this element won't get it
+                    logging.error(
+                        "Error handling downloaded %s: %s", element.get('filename'), err)
+                    self.abort.set()
+                    break
+
+            with self.lock:
+                self.downloaded += 1
+                downloads_percent = round(
+                    float(self.downloaded / self.total_downloads), 2)
+                self.events.add('downloads_percent', str(downloads_percent))
+
+    def get_element(self, element):
+        """ Gets one element, from a cache directory if it is already there
+            or from one of its mirror urls if it is not """
+
+        with self.lock:
+            self.started += 1
+            txt = _("Fetching {0} {1} ({2}/{3})...").format(
+                element['identity'],
+                element['version'],
+                self.started,
+                self.total_downloads)
+            self.events.add('info', txt)
 
-            self.events.add('progress_bar_show_text', '')
+        dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
 
-            downloads_percent = round(float(downloaded / total_downloads), 2)
-            self.events.add('downloads_percent', str(downloads_percent))
+        if os.path.exists(dst_path):
+            # File already exists in destination pacman's cache
+            # (previous install?). We check the file hash.
+            if dhash.check_hash(dst_path, element):
+                logging.debug(
+                    "File %s found in %s cache, there is no need to download it",
+                    element['filename'],
+                    self.pacman_cache_dir)
+                self.speed_meter.add_total(-self.get_element_size(element))
+                return True
+            # We're sure it's a wrong hash. Force to download it
+        else:
+            # Check all cache directories
+            for xz_cache_dir in self.xz_cache_dirs:
+                dst_xz_cache_path = os.path.join(
+                    xz_cache_dir,
+                    element['filename'])
 
-        # Wait until all xz packages are also copied to provided cache (if any)
-        for copy_to_cache_thread in self.copy_to_cache_threads:
-            copy_to_cache_thread.join()
+                if (os.path.exists(dst_xz_cache_path) and
+                        dhash.check_hash(dst_xz_cache_path, element)):
+                    # We're lucky, the package is already downloaded
+                    # in the cache the user has given us
+                    # and its hash checks out
+                    try:
+                        self.cache_populator.copy(dst_xz_cache_path, dst_path)
+                        logging.debug(
+                            "%s found in %s cache, there is no need to download it",
+                            element['filename'],
+                            xz_cache_dir)
+                        self.speed_meter.add_total(-self.get_element_size(element))
+                        return True
+                    except OSError as os_error:
+                        logging.debug(
+                            "Error copying %s to %s : %s",
+                            dst_xz_cache_path,
+                            dst_path,
+                            os_error)
+
+        return self.download_package(element, dst_path)
 
-        self.events.add('downloads_progress_bar', 'hide')
-        return True
+    @staticmethod
+    def get_mirror(url):
+        """ Returns the mirror (host) part of an url """
+        return urllib.parse.urlsplit(url).netloc
+
+    def acquire_mirror(self, urls):
+        """ Returns the first url (they're sorted by preference) whose mirror
+            has a free connection slot. If all mirrors are busy, waits for
+            the preferred one """
+        slots = []
+        with self.lock:
+            for url in urls:
+                mirror = self.get_mirror(url)
+                if mirror not in self.mirror_slots:
+                    self.mirror_slots[mirror] = threading.BoundedSemaphore(
+                        self.max_per_mirror)
+                slots.append(self.mirror_slots[mirror])
+
+        for url, slot in zip(urls, slots):
+            if slot.acquire(blocking=False):
+                return url
+
+        slots[0].acquire()
+        return urls[0]
+
+    def release_mirror(self, url):
+        """ Frees the connection slot used to download from url """
+        with self.lock:
+            slot = self.mirror_slots[self.get_mirror(url)]
+        slot.release()
+
+    def get_session(self):
+        """ Returns the requests session of the calling thread """
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            if self.proxies:
+                session.proxies.update(self.proxies)
+            self.local.session = session
+        return session
 
     def download_package(self, element, dst_path):
         """ Package wasn't previously downloaded or its md5 was wrong
@@ -211,112 +367,413 @@ class Download():
             element['version'],
             len(element['urls']))
 
-        for url in element['urls']:
-            # Let's catch empty values as well as None just to be safe
-            if not url:
-                # Something bad has happened, let's try another mirror
-                download_ok = False
-                logging.debug(
-                    "Package %s-%s has an empty url for this mirror",
-                    element['identity'],
-                    element['version'])
-            else:
-                download_ok = self.download_url(url, dst_path, element)
+        # Let's catch empty values as well as None just to be safe
+        urls = [url for url in element['urls'] if url]
+        if len(urls) != len(element['urls']):
+            logging.debug(
+                "Package %s-%s has an empty url for some mirror",
+                element['identity'],
+                element['version'])
+
+        download_ok = False
 
+        if self.use_segments(element, urls):
+            download_ok = self.download_segmented(urls, dst_path, element)
             if download_ok:
-                # Copy downloaded xz file to the cache the user has provided, too.
-                copy_to_cache_thread = CopyToCache(dst_path, self.xz_cache_dirs)
-                copy_to_cache_thread.start()
-                self.copy_to_cache_threads.append(copy_to_cache_thread)
+                self.copy_to_cache(dst_path)
+                return True
+            logging.debug(
+                "Segmented download of %s failed, downloading whole file instead",
+                element['filename'])
+
+        attempt = 0
+        retries = {}
+        while urls and not self.abort.is_set():
+            url = self.acquire_mirror(urls)
+            urls.remove(url)
+            partial_size = self.get_partial_size(dst_path)
+            try:
+                download_ok = self.download_url(url, dst_path, element)
+            finally:
+                self.release_mirror(url)
 
-                # Get out of the for loop, as we managed
-                # to download the package
+            if download_ok:
+                self.copy_to_cache(dst_path)
+                # Get out of the loop, as we managed to download the package
                 break
+
+            if (self.get_partial_size(dst_path) > partial_size and
+                    retries.get(url, 0) < Download.MAX_URL_RETRIES):
+                # Connection dropped but we made some progress. Resume it
+                # from the same mirror
+                retries[url] = retries.get(url, 0) + 1
+                urls.insert(0, url)
+                msg = "Download of %s was interrupted, Cnchi will resume it."
             else:
                 # requests failed to obtain the file. Wrong url?
                 msg = "Can't download %s, Cnchi will try another mirror."
-                logging.debug(msg, url)
-                # delays for 20 seconds
-                time.sleep(20)
+            logging.debug(msg, url)
+
+            if urls:
+                self.abort.wait(self.get_retry_delay(attempt))
+                attempt += 1
 
         return download_ok
 
+    def copy_to_cache(self, dst_path):
+        """ Copy downloaded xz file to the cache the user has provided, too """
+        basename = os.path.basename(dst_path)
+        for xz_cache_dir in self.xz_cache_dirs:
+            # Avoid using the ISO itself
+            if xz_cache_dir != Download.PACMAN_ISO_CACHE:
+                self.cache_populator.add(dst_path, os.path.join(xz_cache_dir, basename))
+
+    def get_segment_urls(self, urls):
+        """ Returns urls (one per mirror) that can be used to download
+            segments of a file """
+        segment_urls = []
+        mirrors = set()
+        for url in urls:
+            mirror = self.get_mirror(url)
+            if mirror not in mirrors and mirror not in self.no_range_mirrors:
+                mirrors.add(mirror)
+                segment_urls.append(url)
+                if len(segment_urls) == self.MAX_SEGMENT_MIRRORS:
+                    break
+        return segment_urls
+
+    def use_segments(self, element, urls):
+        """ Checks if element should be downloaded in segments """
+        try:
+            size = int(element.get('size', 0))
+        except (TypeError, ValueError):
+            return False
+        if self.get_partial_size(os.path.join(self.pacman_cache_dir, element['filename'])):
+            # There is a partial download, better resume it
+            return False
+        return size > self.SEGMENT_THRESHOLD and len(self.get_segment_urls(urls)) > 1
+
+    def download_segmented(self, urls, dst_path, element):
+        """ Downloads element splitting it in segments that are fetched
+            in parallel from several mirrors using http range requests.
+            Each mirror thread takes segments from a shared queue, so faster
+            mirrors download more segments. Segments that fail are given
+            back to the queue so another mirror can download them.
+            Segments are written to dst_path.part, which is only renamed
+            when all of them have been downloaded """
+
+        size = int(element['size'])
+        part_path = dst_path + Download.PART_SUFFIX
+        segment_urls = self.get_segment_urls(urls)
+
+        segments = queue.Queue()
+        for first in range(0, size, self.SEGMENT_SIZE):
+            last = min(first + self.SEGMENT_SIZE, size) - 1
+            segments.put((first, last))
+
+        logging.debug(
+            "Downloading %s in %d segments from %d mirrors",
+            element['filename'],
+            segments.qsize(),
+            len(segment_urls))
+
+        progress = {'completed': 0, 'done': 0}
+        progress_lock = threading.Lock()
+
+        def segment_progress(chunk_length):
+            """ Updates progress of the whole file """
+            with progress_lock:
+                progress['completed'] += chunk_length
+                completed = progress['completed']
+            self.update_progress(dst_path, completed, size, max(chunk_length, 0))
+
+        def mirror_thread(url, fd):
+            """ Downloads segments from one mirror until there are no more
+                segments or the mirror fails """
+            while not self.abort.is_set():
+                try:
+                    first, last = segments.get_nowait()
+                except queue.Empty:
+                    return
+                self.acquire_mirror([url])
+                try:
+                    written = self.download_range(url, fd, first, last, segment_progress)
+                finally:
+                    self.release_mirror(url)
+                if written is None:
+                    # This mirror failed, let another one try this segment
+                    segments.put((first, last))
+                    return
+                with progress_lock:
+                    progress['done'] += 1
+
+        # Segments can't be resumed, remove any previous partial download
+        self.remove_partial(part_path)
+
+        try:
+            with open(part_path, 'wb') as xz_file:
+                xz_file.truncate(size)
+                threads = []
+                for url in segment_urls:
+                    thread = threading.Thread(target=mirror_thread, args=(url, xz_file.fileno()))
+                    thread.start()
+                    threads.append(thread)
+                for thread in threads:
+                    thread.join()
+            if not segments.empty() or self.abort.is_set():
+                # All mirrors failed (or we have been told to stop) before
+                # downloading every segment
+                self.remove_partial(part_path)
+                return False
+            os.replace(part_path, dst_path)
+        except OSError as os_error:
+            logging.debug(os_error)
+            self.remove_partial(part_path)
+            return False
+        finally:
+            self.end_progress(dst_path)
+
+        # Check hash of the reassembled package
+        return dhash.check_hash(dst_path, element)
+
+    def download_range(self, url, fd, first, last, progress_cb):
+        """ Downloads bytes first-last from url and writes them in place into
+            file descriptor fd. Returns bytes written or None on failure """
+        written = 0
+        headers = {'Range': 'bytes={0}-{1}'.format(first, last)}
+        try:
+            req = self.get_session().get(url, stream=True, timeout=30, headers=headers)
+            content_range = req.headers.get('content-range', '')
+            expected_range = 'bytes {0}-{1}/'.format(first, last)
+            if (req.status_code != requests.codes.partial_content or
+                    not content_range.startswith(expected_range)):
+                # Mirror does not honour range requests (it's sending us the
+                # whole file or an error). Do not use it for segments again.
+                logging.debug("%s does not support range requests", url)
+                with self.lock:
+                    self.no_range_mirrors.add(self.get_mirror(url))
+                req.close()
+                return None
+            offset = first
+            for data in req.iter_content(Download.CHUNK_SIZE):
+                if not data:
+                    break
+                data = data[:last + 1 - offset]
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+                written += len(data)
+                progress_cb(len(data))
+                if offset > last or self.abort.is_set():
+                    break
+            req.close()
+            if offset <= last:
+                # Short read, another mirror will have to download this segment
+                progress_cb(-written)
+                return None
+        except (socket.timeout,
+                requests.exceptions.Timeout,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                OSError) as connection_error:
+            logging.debug(connection_error)
+            progress_cb(-written)
+            return None
+        return written
+
+    def update_progress(self, dst_path, completed_length, total_length, chunk_length):
+        """ Updates download progress of one file. Progress of all files
+            being downloaded right now (and the speed of the whole download
+            set) is only shown a few times per second """
+        with self.lock:
+            self.in_flight[dst_path] = [completed_length, total_length]
+
+        progress = self.speed_meter.add(chunk_length)
+        if progress is None:
+            return
+
+        with self.lock:
+            completed = sum(item[0] for item in self.in_flight.values())
+            total = sum(item[1] for item in self.in_flight.values())
+            if total > 0:
+                percent = round(float(min(completed, total) / total), 2)
+                self.events.add('percent', percent)
+            self.events.add('download_progress', tuple(progress))
+
+    def end_progress(self, dst_path):
+        """ File dst_path is no longer being downloaded """
+        with self.lock:
+            self.in_flight.pop(dst_path, None)
+            if not self.in_flight:
+                # The text has been changed by download_progress events
+                # since the last time we cleared it
+                self.events.forget('progress_bar_show_text')
+                self.events.add('progress_bar_show_text', '')
+
+    @staticmethod
+    def read_journal(part_path):
+        """ Reads the journal of a partially downloaded file """
+        journal_path = part_path + Download.JOURNAL_SUFFIX
+        if not os.path.exists(part_path):
+            return None
+        try:
+            with open(journal_path, 'r') as journal_file:
+                journal = json.load(journal_file)
+            if isinstance(journal, dict):
+                return journal
+        except (OSError, ValueError) as err:
+            logging.debug("Can't read download journal %s: %s", journal_path, err)
+        return None
+
+    @staticmethod
+    def write_journal(part_path, url, etag, size):
+        """ Stores url, etag and bytes written of a partially downloaded file """
+        journal_path = part_path + Download.JOURNAL_SUFFIX
+        tmp_path = journal_path + '.tmp'
+        journal = {'url': url, 'etag': etag, 'bytes': size}
+        try:
+            with open(tmp_path, 'w') as journal_file:
+                json.dump(journal, journal_file)
+            os.replace(tmp_path, journal_path)
+        except OSError as err:
+            logging.debug("Can't write download journal %s: %s", journal_path, err)
+
+    @staticmethod
+    def remove_partial(part_path):
+        """ Removes partial file and its journal """
+        for path in [part_path, part_path + Download.JOURNAL_SUFFIX]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as err:
+                logging.debug(err)
+
+    @staticmethod
+    def get_partial_size(dst_path):
+        """ Returns how many bytes of dst_path have already been downloaded """
+        part_path = dst_path + Download.PART_SUFFIX
+        journal = Download.read_journal(part_path)
+        if not journal:
+            return 0
+        try:
+            return min(os.path.getsize(part_path), int(journal.get('bytes', 0)))
+        except (OSError, TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def get_retry_delay(attempt):
+        """ Exponential backoff with jitter (returns seconds to wait) """
+        delay = min(Download.RETRY_MAX_DELAY, Download.RETRY_BASE_DELAY * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
     def download_url(self, url, dst_path, element=None):
-        """ Downloads file from url to dst_path and checks its md5 hash """
-        percent = 0
+        """ Downloads file from url to dst_path and checks its md5 hash
+            File is downloaded to dst_path.part first. A journal stores
+            how much of it has been downloaded, so a failed download can be
+            resumed (even after restarting Cnchi) using a range request """
+        part_path = dst_path + Download.PART_SUFFIX
+
+        headers = {}
+        offset = self.get_partial_size(dst_path)
+        if offset > 0:
+            headers['Range'] = 'bytes={0}-'.format(offset)
+            journal = self.read_journal(part_path)
+            if journal.get('url') == url and journal.get('etag'):
+                # Only resume if the file has not changed in the server
+                headers['If-Range'] = journal['etag']
+
         completed_length = 0
-        start = time.perf_counter()
+        etag = None
+        completed = False
+        req = None
         try:
             # By default, get waits five minutes before
             # issuing a timeout, which is too much.
-            if self.proxies:
-                req = requests.get(
-                    url,
-                    stream=True,
-                    timeout=30,
-                    proxies=self.proxies)
+            req = self.get_session().get(
+                url, stream=True, timeout=30, headers=headers)
+
+            content_range = req.headers.get('content-range', '')
+            if (offset > 0 and req.status_code == requests.codes.partial_content and
+                    content_range.startswith('bytes {0}-'.format(offset))):
+                logging.debug("Resuming download of %s from byte %d", url, offset)
+                completed_length = offset
+                # These bytes are not going to be downloaded again
+                self.speed_meter.add_total(-offset)
+            elif req.status_code == requests.codes.ok:
+                # Server sends us the whole file
+                completed_length = 0
+            elif offset > 0:
+                # Range not satisfiable (416) or an error answer to our
+                # range request: our partial file is of no use
+                logging.debug(
+                    "%s can't resume from byte %d (status code %d), "
+                    "downloading it again", url, offset, req.status_code)
+                req.close()
+                req = None
+                self.remove_partial(part_path)
+                return self.download_url(url, dst_path, element)
             else:
-                req = requests.get(
-                    url,
-                    stream=True,
-                    timeout=30)
+                # Do not accept error pages (404 and friends) as packages
+                logging.debug("%s returned status code %d", url, req.status_code)
+                return False
 
-            if req.status_code == requests.codes.ok:
-                # Get total file length
-                try:
-                    total_length = int(req.headers.get('content-length'))
-                except TypeError:
-                    total_length = 0
-                    logging.debug(
-                        "Metalink for package %s has no size info", url)
-
-                with open(dst_path, 'wb') as xz_file:
-                    for data in req.iter_content(io.DEFAULT_BUFFER_SIZE):
-                        if not data:
-                            break
-                        xz_file.write(data)
-                        completed_length += len(data)
-                        old_percent = percent
-                        if total_length > 0:
-                            percent = float(completed_length / total_length)
-                            percent = round(percent, 2)
-                        else:
-                            percent += 0.1
-                        if old_percent != percent:
-                            self.events.add('percent', percent)
-                        bps = completed_length // (time.perf_counter() - start)
-                        msg = self.format_progress_message(percent, bps)
-                        self.events.add('progress_bar_show_text', msg)
-
-                # Check hash of downloaded package
-                if element and not dhash.check_hash(dst_path, element):
-                    # Wrong hash! Force to download the file again
-                    return False
+            # Get total file length
+            try:
+                total_length = completed_length + int(req.headers.get('content-length'))
+            except TypeError:
+                total_length = 0
+                logging.debug(
+                    "Metalink for package %s has no size info", url)
+
+            # Hash the file while it is downloaded (no need to read it again)
+            stream_hash = dhash.StreamHash(element) if element else None
+            if stream_hash and completed_length > 0:
+                stream_hash.update_from_file(part_path, completed_length)
+
+            etag = req.headers.get('etag')
+            self.write_journal(part_path, url, etag, completed_length)
+            journal_length = completed_length
+
+            mode = 'r+b' if completed_length > 0 else 'wb'
+            with open(part_path, mode) as xz_file:
+                xz_file.seek(completed_length)
+                xz_file.truncate()
+                for data in req.iter_content(Download.CHUNK_SIZE):
+                    if not data:
+                        break
+                    xz_file.write(data)
+                    if stream_hash:
+                        stream_hash.update(data)
+                    completed_length += len(data)
+                    self.update_progress(
+                        dst_path, completed_length, total_length, len(data))
+                    if completed_length - journal_length >= Download.JOURNAL_INTERVAL:
+                        xz_file.flush()
+                        self.write_journal(part_path, url, etag, completed_length)
+                        journal_length = completed_length
+
+            completed = True
+            os.replace(part_path, dst_path)
+            self.remove_partial(part_path)
+
+            # Check hash of downloaded package
+            if element and not dhash.check_hash(
+                    dst_path, element, file_hashes=stream_hash.get_hashes()):
+                # Wrong hash! Force to download the file again
+                return False
         except (socket.timeout,
                 requests.exceptions.Timeout,
                 requests.exceptions.ConnectionError,
                 requests.exceptions.ChunkedEncodingError) as connection_error:
             logging.debug(connection_error)
             return False
+        finally:
+            if req is not None:
+                # Give its connection back to our session pool
+                req.close()
+            if not completed and completed_length > 0:
+                # Store how much we have, so we can resume it later
+                self.write_journal(part_path, url, etag, completed_length)
+            self.end_progress(dst_path)
 
         return True
-
-    @staticmethod
-    def format_progress_message(percent, bps):
-        """ Formats speed message information """
-        if percent <= 1:
-            percent = int(percent * 100)
-
-        if percent > 100:
-            percent = 100
-
-        # 1024 * 1024 = 1048576
-        if bps >= 1048576:
-            mbps = bps / 1048576
-            msg = "{0}%   {1:.2f} Mbps".format(percent, mbps)
-        elif bps >= 1024:
-            kbps = bps / 1024
-            msg = "{0}%   {1:.2f} Kbps".format(percent, kbps)
-        else:
-            msg = "{0}%   {1:.2f} bps".format(percent, bps)
-        return msg
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# hash_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Persistent index of already verified package files.
+    Stores the hashes of files that have been checked, keyed by path, size,
+    modification time and inode, so they don't have to be hashed again """
+
+import logging
+import os
+import sqlite3
+import threading
+
+# Package cache directories (see add_cache_dirs) keep their own index, so
+# it lasts as long as the packages it describes (a cache in an USB stick can
+# be used again after rebooting, even if it is mounted somewhere else).
+# Their files are keyed by name.
+CACHE_INDEX_NAME = '.cnchi-hash-index.db'
+
+# Index of all other files (keyed by their absolute path). It is in the
+# live system's tmpfs, so it only lasts this session
+INDEX_DIR = '/var/tmp/cnchi'
+INDEX_NAME = 'hash_index.db'
+
+HASH_TYPES = ['sha256', 'md5']
+
+# Real paths of the cache directories with their own index
+_CACHE_DIRS = set()
+
+# Indexes shared by all threads (of this process), by database path
+_INDEXES = {}
+_INDEX_PID = None
+_INDEX_LOCK = threading.Lock()
+
+
+class HashIndex():
+    """ sqlite database that stores verified hashes of files """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = None
+        try:
+            self.conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS files ("
+                    "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+                    "inode INTEGER, sha256 TEXT, md5 TEXT)")
+        except sqlite3.Error as err:
+            logging.debug("Can't use hash index %s: %s", db_path, err)
+            self.close()
+
+    def close(self):
+        """ Closes database connection """
+        if self.conn:
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+        self.conn = None
+
+    def lookup(self, path, file_stat):
+        """ Returns stored hashes (dict hash type -> digest) of path if
+            the file has not changed since they were stored """
+        if not self.conn:
+            return {}
+        with self.lock:
+            try:
+                row = self.conn.execute(
+                    "SELECT size, mtime, inode, sha256, md5 FROM files WHERE path=?",
+                    (path,)).fetchone()
+            except sqlite3.Error as err:
+                logging.debug(err)
+                return {}
+        if not row or tuple(row[:3]) != get_key(file_stat):
+            return {}
+        return {hash_type: digest
+                for hash_type, digest in zip(HASH_TYPES, row[3:]) if digest}
+
+    def store(self, path, hashes, file_stat):
+        """ Stores verified hashes of path (in one transaction) """
+        if not self.conn:
+            return
+        key = get_key(file_stat)
+        with self.lock:
+            try:
+                with self.conn:
+                    row = self.conn.execute(
+                        "SELECT size, mtime, inode, sha256, md5 FROM files WHERE path=?",
+                        (path,)).fetchone()
+                    new_hashes = {}
+                    if row and tuple(row[:3]) == key:
+                        # Same file, keep the hashes we already had
+                        new_hashes = dict(zip(HASH_TYPES, row[3:]))
+                    new_hashes.update(hashes)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO files "
+                        "(path, size, mtime, inode, sha256, md5) VALUES (?, ?, ?, ?, ?, ?)",
+                        (path,) + key + (new_hashes.get('sha256'), new_hashes.get('md5')))
+            except sqlite3.Error as err:
+                logging.debug(err)
+
+
+def get_key(file_stat):
+    """ Returns the values that identify a version of a file """
+    return (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+
+def get_stat(path):
+    """ Returns stat info of path or None if it does not exist """
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def add_cache_dirs(cache_dirs):
+    """ Files in cache_dirs will be indexed in an index stored in the same
+        directory (if it can be written) """
+    for cache_dir in cache_dirs:
+        _CACHE_DIRS.add(os.path.realpath(cache_dir))
+
+
+def _open_index(db_path):
+    """ Returns the index stored in db_path (opening it if needed).
+        Its connection is None if it can't be used """
+    global _INDEX_PID
+    with _INDEX_LOCK:
+        if _INDEX_PID != os.getpid():
+            # sqlite connections can't be shared with a forked process
+            _INDEXES.clear()
+            _INDEX_PID = os.getpid()
+        index = _INDEXES.get(db_path)
+        if index is None:
+            if db_path != ':memory:':
+                try:
+                    os.makedirs(os.path.dirname(db_path), mode=0o755, exist_ok=True)
+                except OSError as err:
+                    logging.debug(err)
+            index = HashIndex(db_path)
+            _INDEXES[db_path] = index
+        return index
+
+
+def get_index(path):
+    """ Returns the index used to store the hashes of file path and the
+        key of path in it """
+    path = os.path.abspath(path)
+    directory = os.path.dirname(os.path.realpath(path))
+    if directory in _CACHE_DIRS:
+        index = _open_index(os.path.join(directory, CACHE_INDEX_NAME))
+        if index.conn:
+            return index, os.path.basename(path)
+
+    index = _open_index(os.path.join(INDEX_DIR, INDEX_NAME))
+    if not index.conn:
+        index = _open_index(':memory:')
+    return index, path
+
+
+def lookup(path, hash_type, file_stat):
+    """ Returns stored hash_type hash of path (None if not known) """
+    if file_stat is None:
+        return None
+    index, key = get_index(path)
+    return index.lookup(key, file_stat).get(hash_type)
+
+
+def store(path, hashes, file_stat):
+    """ Stores verified hashes (dict hash type -> digest) of path.
+        file_stat must be taken before the file was hashed. If the file has
+        changed since then, nothing is stored """
+    if file_stat is None or get_key(file_stat) != get_key_or_none(path):
+        return
+    index, key = get_index(path)
+    index.store(key, hashes, file_stat)
+
+
+def get_key_or_none(path):
+    """ Returns the key of path or None if it does not exist """
+    file_stat = get_stat(path)
+    if file_stat is None:
+        return None
+    return get_key(file_stat)
@@ -34,7 +34,6 @@ import logging
 import tempfile
 import os
 
-import hashlib
 import re
 import argparse
 
@@ -43,7 +42,12 @@ from collections import deque
 from xml.dom.minidom import getDOMImplementation
 import xml.etree.cElementTree as elementTree
 
-import pyalpm
+try:
+    import download.download_hash as dhash
+    import download.hash_index as hash_index
+except ModuleNotFoundError:
+    import download_hash as dhash
+    import hash_index
 
 MAX_URLS = 15
 
@@ -125,6 +129,58 @@ def create(alpm, package_name, pacman_conf_file):
     logging.error("Unable to create download queue for package %s", package_name)
     return None
 
+def create_download_info(alpm, package_names):
+    """ Creates download info to download all package_names and their
+        dependencies. Dependencies are resolved once for the whole list.
+        Returns a dict (package identity -> element) with the same format
+        get_info returns, without creating (and parsing) a metalink xml.
+        Use create() to get a metalink for debugging purposes. """
+
+    options = ["--noconfirm", "--all-deps"]
+    options.extend(package_names)
+
+    download_queue, not_found, missing_deps = build_download_queue(
+        alpm, args=options)
+
+    if not_found:
+        not_found = sorted(not_found)
+        msg = "Can't find these packages: " + ' '.join(not_found)
+        logging.error(msg)
+        return None
+
+    if missing_deps:
+        missing_deps = sorted(set(missing_deps))
+        msg = "Can't resolve these dependencies: " + ' '.join(missing_deps)
+        logging.error(msg)
+        return None
+
+    if download_queue:
+        return download_queue_to_dict(download_queue)
+
+    logging.error("Unable to create download queue for packages %s", package_names)
+    return None
+
+
+def download_queue_to_dict(download_queue):
+    """ Converts a download_queue object to a dict of elements
+        (the same get_info returns when reading a metalink) """
+    download_info = {}
+    for pkg, urls, _sigs in download_queue.sync_pkgs:
+        element = {
+            'filename': pkg.filename,
+            'identity': str(pkg.name),
+            'size': str(pkg.size),
+            'version': str(pkg.version),
+            'description': str(pkg.desc),
+            'hash': {
+                'sha256': str(pkg.sha256sum),
+                'md5': str(pkg.md5sum)},
+            'urls': list(urls)[:MAX_URLS]}
+        if element['identity'] not in download_info:
+            download_info[element['identity']] = element
+    return download_info
+
+
 # From here comes modified code from pm2ml
 # pm2ml is Copyright (C) 2012-2013 Xyne
 # More info: http://xyne.archlinux.ca/projects/pm2ml
@@ -308,85 +364,47 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
-def get_antergos_repo_pkgs(alpm_handle):
-    """ Returns pkgs from Antergos groups (mate, mate-extra) and
-        the antergos db info """
+def get_antergos_repo_pkgs(index):
+    """ Returns names of pkgs from Antergos groups (mate, mate-extra) """
 
-    antdb = None
-    for database in alpm_handle.get_syncdbs():
-        if database.name == 'antergos':
-            antdb = database
-            break
-
-    if not antdb:
+    if 'antergos' not in index.repos:
         logging.error("Cannot sync Antergos repository database!")
-        return {}, None
-
-    group_names = ['mate', 'mate-extra']
-    groups = []
-    for group_name in group_names:
-        group = antdb.read_grp(group_name)
-        if not group:
-            # Group does not exist
-            group = ['None', []]
-        groups.append(group)
+        return set()
 
-    repo_pkgs = {
-        pkg for group in groups
-        for pkg in group[1] if group}
+    return index.get_group_pkg_names('antergos', ['mate', 'mate-extra'])
 
-    return repo_pkgs, antdb
 
-
-def resolve_deps(alpm_handle, other, alldeps):
-    """ Resolve dependencies """
+def resolve_deps(index, local_index, other, alldeps):
+    """ Resolve dependencies. local_index (installed packages) is only
+        used if alldeps is False, it may be None otherwise """
     missing_deps = []
     queue = deque(other)
-    local_cache = alpm_handle.get_localdb().pkgcache
-    syncdbs = alpm_handle.get_syncdbs()
-    seen = set(queue)
+    seen = set(pkg.name for pkg in queue)
     while queue:
         pkg = queue.popleft()
         for dep in pkg.depends:
-            if pyalpm.find_satisfier(local_cache, dep) is None or alldeps:
-                for database in syncdbs:
-                    prov = pyalpm.find_satisfier(database.pkgcache, dep)
-                    if prov:
-                        other.add(prov)
-                        if prov.name not in seen:
-                            seen.add(prov.name)
-                            queue.append(prov)
-                        break
+            if alldeps or local_index.find_satisfier(dep) is None:
+                prov = index.find_satisfier(dep)
+                if prov:
+                    other.add(prov)
+                    if prov.name not in seen:
+                        seen.add(prov.name)
+                        queue.append(prov)
                 else:
                     missing_deps.append(dep)
     return other, missing_deps
 
 
-def create_package_set(requested, ant_repo_pkgs, antdb, alpm_handle):
+def create_package_set(requested, ant_repo_pkgs, index):
     """ Create package set from requested set """
 
-    found = set()
-    other = PkgSet()
-
-    for pkg in requested:
-        for database in alpm_handle.get_syncdbs():
-            # if pkg is in antergos repo, fetch it from it (instead of another repo)
-            # pkg should be sourced from the antergos repo only.
-            if antdb and pkg in ant_repo_pkgs and database.name != 'antergos':
-                database = antdb
+    # if pkg is in antergos groups, fetch it from the antergos repo
+    # (instead of another repo)
+    resolution = index.resolve(requested, repo_only_names=ant_repo_pkgs, repo='antergos')
 
-            syncpkg = database.get_pkg(pkg)
-
-            if syncpkg:
-                other.add(syncpkg)
-                break
-            else:
-                syncgrp = database.read_grp(pkg)
-                if syncgrp:
-                    found.add(pkg)
-                    #other_grp |= PkgSet(syncgrp[1])
-                    other |= PkgSet(syncgrp[1])
-                    break
+    # Groups found
+    found = resolution.groups
+    other = PkgSet(resolution.pkgs.values())
 
     return found, other
 
@@ -403,19 +421,25 @@ def build_download_queue(alpm, args=None):
 
     missing_deps = list()
 
-    ant_repo_pkgs, antdb = get_antergos_repo_pkgs(handle)
+    # Name, group and provides lookup tables (shared with other users of alpm)
+    index = alpm.get_index()
 
-    if not antdb:
+    if 'antergos' not in index.repos:
         logging.error("Cannot load antergos repository database")
         return None, None, None
 
-    found, other = create_package_set(requested, ant_repo_pkgs, antdb, handle)
+    ant_repo_pkgs = get_antergos_repo_pkgs(index)
+
+    found, other = create_package_set(requested, ant_repo_pkgs, index)
 
     # foreign_names = requested - set(x.name for x in other)
 
     # Resolve dependencies.
     if other and not pargs.nodeps:
-        other, missing_deps = resolve_deps(handle, other, pargs.alldeps)
+        # Installed packages are not checked when all deps are wanted
+        local_index = None if pargs.alldeps else alpm.get_local_index()
+        other, missing_deps = resolve_deps(
+            index, local_index, other, pargs.alldeps)
 
     found |= set(other.pkgs)
     not_found = requested - found
@@ -460,16 +484,10 @@ def build_download_queue(alpm, args=None):
 
 def get_checksum(path, typ):
     """ Returns checksum of a file """
-    new_hash = hashlib.new(typ)
-    block_size = new_hash.block_size
     try:
-        with open(path, 'rb') as myfile:
-            buf = myfile.read(block_size)
-            while buf:
-                new_hash.update(buf)
-                buf = myfile.read(block_size)
-        return new_hash.hexdigest()
-    except FileNotFoundError:
+        return dhash.get_file_hashes(path, [typ])[typ]
+    except TypeError:
+        # File not found
         return -1
     except IOError as io_error:
         logging.error(io_error)
@@ -480,15 +498,26 @@ def check_cache(conf, pkgs):
     for pkg in pkgs:
         for cache in conf.options['CacheDir']:
             fpath = os.path.join(cache, pkg.filename)
-            for checksum in ('sha256', 'md5'):
-                real_checksum = get_checksum(fpath, checksum)
-                correct_checksum = getattr(pkg, checksum + 'sum')
-                if real_checksum is None or real_checksum != correct_checksum:
-                    yield pkg
-                    break
-            else:
-                continue
-            break
+            file_stat = hash_index.get_stat(fpath)
+            if file_stat is None:
+                yield pkg
+                break
+            correct_checksums = {
+                checksum: getattr(pkg, checksum + 'sum') for checksum in ('sha256', 'md5')}
+            real_checksums = {
+                checksum: hash_index.lookup(fpath, checksum, file_stat)
+                for checksum in correct_checksums}
+            if real_checksums != correct_checksums:
+                try:
+                    # Read the file only once to get both checksums
+                    real_checksums = dhash.get_file_hashes(fpath, ['sha256', 'md5'])
+                except IOError as io_error:
+                    logging.error(io_error)
+                    real_checksums = None
+            if real_checksums != correct_checksums:
+                yield pkg
+                break
+            hash_index.store(fpath, real_checksums, file_stat)
 
 
 def needs_sig(siglevel, insistence, prefix):
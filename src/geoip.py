@@ -32,7 +32,6 @@
 import json
 import logging
 import os
-import time
 import requests
 
 import maxminddb
@@ -47,21 +46,16 @@ class GeoIP():
 
     SERVERS = ["moc.tsetnosj.pi", "pi/0003:kt.ateb-sogretna"]
 
-    def __init__(self):
+    def __init__(self, wait_for_network=True):
         self.record = None
-        self._maybe_wait_for_network()
+        if wait_for_network:
+            self._maybe_wait_for_network()
         self._load_data_and_ip()
 
     @staticmethod
     def _maybe_wait_for_network():
         # Wait until there is an Internet connection available
-        if not misc.has_connection():
-            logging.warning(
-                "Can't get network status. Cnchi will try again in a moment")
-            while not misc.has_connection():
-                time.sleep(4)  # Wait 4 seconds and try again
-
-        logging.debug("A working network connection has been detected.")
+        misc.wait_for_connection()
 
     def _load_data_and_ip(self):
         """ Gets public IP and loads GeoIP2 database """
@@ -88,11 +82,11 @@ class GeoIP():
         for srv in GeoIP.SERVERS:
             srv = "http://" + srv[::-1]
             try:
-                json_text = requests.get(srv).text
+                json_text = requests.get(srv, timeout=10).text
                 if not "503 Over Quota" in json_text:
                     data = json.loads(json_text)
                     return data['ip']
-            except (requests.ConnectionError, json.decoder.JSONDecodeError) as err:
+            except (requests.RequestException, json.decoder.JSONDecodeError) as err:
                 logging.warning(
                     "Error getting external IP from %s: %s", srv, err)
         return None
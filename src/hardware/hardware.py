@@ -29,9 +29,108 @@
 
 """ Hardware related packages installation """
 
+import glob
 import logging
 import os
 import subprocess
+import threading
+
+SYS_PCI_DEVICES = "/sys/bus/pci/devices"
+SYS_USB_DEVICES = "/sys/bus/usb/devices"
+
+# Devices found (they do not change during the session)
+_DEVICES = None
+_DEVICES_LOCK = threading.Lock()
+
+# Driver objects and their match table for each modules path
+_DRIVERS = {}
+
+
+def read_sysfs_id(path):
+    """ Reads an id from a sysfs file, always as 0x1234 """
+    with open(path, 'r') as id_file:
+        value = id_file.read().strip().lower()
+    if not value.startswith("0x"):
+        value = "0x" + value
+    return value
+
+
+def get_sysfs_devices():
+    """ Gets a list of all pci/usb devices reading sysfs
+        (returns None if sysfs is not available) """
+    if not os.path.isdir(SYS_PCI_DEVICES):
+        return None
+
+    devices = []
+
+    # Get PCI devices
+    for path in sorted(glob.glob(os.path.join(SYS_PCI_DEVICES, "*"))):
+        try:
+            # Class is 0xCCSSPP (class, subclass, programming interface)
+            class_id = read_sysfs_id(os.path.join(path, "class"))[0:4]
+            vendor_id = read_sysfs_id(os.path.join(path, "vendor"))
+            product_id = read_sysfs_id(os.path.join(path, "device"))
+        except OSError as err:
+            logging.debug(err)
+            continue
+        devices.append((class_id, vendor_id, product_id))
+
+    # Get USB devices (interfaces do not have idVendor)
+    for path in sorted(glob.glob(os.path.join(SYS_USB_DEVICES, "*"))):
+        vendor_path = os.path.join(path, "idVendor")
+        if not os.path.exists(vendor_path):
+            continue
+        try:
+            vendor_id = read_sysfs_id(vendor_path)
+            product_id = read_sysfs_id(os.path.join(path, "idProduct"))
+        except OSError as err:
+            logging.debug(err)
+            continue
+        devices.append(("0", vendor_id, product_id))
+
+    return devices
+
+
+def get_command_devices():
+    """ Gets a list of all pci/usb devices using lspci and lsusb """
+    devices = []
+
+    # Get PCI devices
+    cmd = ["/usr/bin/lspci", "-n"]
+    lines = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    lines = lines.decode().split("\n")
+
+    for line in lines:
+        if line:
+            class_id = line.split()[1].rstrip(":")[0:2]
+            dev = line.split()[2].split(":")
+            devices.append(("0x" + class_id, "0x" + dev[0], "0x" + dev[1]))
+
+    # Get USB devices
+    cmd = ["/usr/bin/lsusb"]
+    lines = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    lines = lines.decode().split("\n")
+
+    for line in lines:
+        if line:
+            dev = line.split()[5].split(":")
+            devices.append(("0", "0x" + dev[0], "0x" + dev[1]))
+
+    return devices
+
+
+def get_devices():
+    """ Gets a list of all pci/usb devices (class_id, vendor_id, product_id).
+        Devices are only scanned once per session """
+    global _DEVICES
+    with _DEVICES_LOCK:
+        if _DEVICES is None:
+            devices = get_sysfs_devices()
+            if devices is None:
+                devices = get_command_devices()
+            _DEVICES = devices
+        return list(_DEVICES)
+
 
 class Hardware():
     """ This is an abstract class. You need to use this as base """
@@ -43,7 +142,7 @@ class Hardware():
         self.class_name = class_name
         self.class_id = class_id
         self.vendor_id = vendor_id
-        self.devices = []
+        self.devices = set()
         self.priority = priority
         self.enabled = enabled
 
@@ -57,22 +156,12 @@ class Hardware():
             else:
                 logging.error("Cannot find %s file", path)
         else:
-            self.devices = pci_file_or_devices
+            self.devices = set(pci_file_or_devices)
 
     def load_pci_file(self, path):
         """ Load pci file with all pci ids """
         with open(path, 'r') as ids_file:
-            lines = ids_file.readlines()
-
-        for index, line in enumerate(lines):
-            lines[index] = line.lower()
-
-        self.devices = []
-        for line in lines:
-            self.devices.extend(line.split())
-
-        for index, pci_id in enumerate(self.devices):
-            self.devices[index] = "0x" + pci_id
+            self.devices = {"0x" + pci_id for pci_id in ids_file.read().lower().split()}
 
     def get_packages(self):
         """ Returns all necessary packages to install """
@@ -115,25 +204,16 @@ class Hardware():
         if not self.enabled:
             return False
 
-        # Get PCI devices
         try:
-            cmd = ["lspci", "-n"]
-            lines = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-            lines = lines.decode().split("\n")
+            devices = get_devices()
         except subprocess.CalledProcessError as err:
             logging.warning(
                 "Cannot detect hardware components : %s", err.output.decode())
             return False
 
-        for line in lines:
-            if line:
-                class_id = "0x{0}".format(line.split()[1].rstrip(":")[0:2])
-                if class_id == self.class_id:
-                    dev = line.split()[2].split(":")
-                    vendor_id = "0x{0}".format(dev[0])
-                    product_id = "0x{0}".format(dev[1])
-                    if vendor_id == self.vendor_id and product_id in self.devices:
-                        return True
+        for class_id, vendor_id, product_id in devices:
+            if self.check_device(class_id, vendor_id, product_id):
+                return True
         return False
 
     @staticmethod
@@ -226,7 +306,18 @@ class HardwareInstall():
         # All objects that are really used
         self.objects_used = []
 
-        self.scan_driver_modules()
+        # (class_id, vendor_id, product_id) -> objects that may support it
+        # ('' matches any id)
+        self.match_table = {}
+
+        # Driver modules are only loaded once per session
+        if self.modules_path in _DRIVERS:
+            self.all_objects, self.match_table = _DRIVERS[self.modules_path]
+        else:
+            self.scan_driver_modules()
+            self.create_match_table()
+            _DRIVERS[self.modules_path] = (self.all_objects, self.match_table)
+
         self.detect_devices()
 
     def scan_driver_modules(self):
@@ -266,6 +357,29 @@ class HardwareInstall():
                     message = template.format(type(ex).__name__, ex.args)
                     logging.error(message)
 
+    def create_match_table(self):
+        """ Indexes all driver objects by the ids they support """
+        self.match_table = {}
+        for index, obj in enumerate(self.all_objects):
+            if not obj.enabled:
+                continue
+            products = obj.devices or ['']
+            for product_id in products:
+                key = (obj.class_id or '', obj.vendor_id or '', product_id)
+                self.match_table.setdefault(key, []).append((index, obj))
+
+    def get_candidates(self, device):
+        """ Returns driver objects that may support device (in the same
+            order they have in all_objects) """
+        class_id, vendor_id, product_id = device
+        candidates = {}
+        for key_class in (class_id, ''):
+            for key_vendor in (vendor_id, ''):
+                for key_product in (product_id, ''):
+                    key = (key_class, key_vendor, key_product)
+                    candidates.update(self.match_table.get(key, []))
+        return [candidates[index] for index in sorted(candidates)]
+
     def detect_devices(self):
         """ Detect devices """
         try:
@@ -283,8 +397,8 @@ class HardwareInstall():
 
         # Find modules (objects) that support the devices we've found.
         self.objects_found = {}
-        for obj in self.all_objects:
-            for device in devices:
+        for device in devices:
+            for obj in self.get_candidates(device):
                 (class_id, vendor_id, product_id) = device
                 check = obj.check_device(
                     class_id=class_id,
@@ -351,30 +465,7 @@ class HardwareInstall():
     @staticmethod
     def get_devices():
         """ Gets a list of all pci/usb devices """
-        devices = []
-
-        # Get PCI devices
-        cmd = ["/usr/bin/lspci", "-n"]
-        lines = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-        lines = lines.decode().split("\n")
-
-        for line in lines:
-            if line:
-                class_id = line.split()[1].rstrip(":")[0:2]
-                dev = line.split()[2].split(":")
-                devices.append(("0x" + class_id, "0x" + dev[0], "0x" + dev[1]))
-
-        # Get USB devices
-        cmd = ["/usr/bin/lsusb"]
-        lines = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-        lines = lines.decode().split("\n")
-
-        for line in lines:
-            if line:
-                dev = line.split()[5].split(":")
-                devices.append(("0", "0x" + dev[0], "0x" + dev[1]))
-
-        return devices
+        return get_devices()
 
     def get_packages(self):
         """ Get pacman package list for all detected devices """
@@ -36,6 +36,7 @@ from misc.extra import InstallError
 from misc.run_cmd import call
 import misc.events as events
 import parted3.fs_module as fs
+import parted3.block_devices as block_devices
 
 from installation import luks
 from installation import mount
@@ -177,6 +178,9 @@ class AutoPartition():
                 mode = 0o755
             os.chmod(path, mode)
 
+        # Device has a new file system, its info has changed
+        block_devices.invalidate()
+
         fs_uuid = fs.get_uuid(device)
         fs_label = fs.get_label(device)
         msg = "Device details: %s UUID=%s LABEL=%s"
@@ -456,6 +460,7 @@ class AutoPartition():
         # Needed if the hard disk had a MBR partition table.
         err_msg = "Error informing the kernel of the partition change."
         call(["partprobe", device], msg=err_msg, fatal=True)
+        block_devices.invalidate()
 
         part_num = 1
 
@@ -612,6 +617,9 @@ class AutoPartition():
             cmd = ["lvcreate", "--name", "AntergosHome", "--extents", "100%FREE", "AntergosVG"]
             call(cmd, msg=err_msg, fatal=True)
 
+        # There are new physical and logical volumes
+        block_devices.invalidate()
+
     def create_filesystems(self, devices):
         """ Create filesystems in newly created partitions """
         mount_points = {
@@ -702,6 +710,8 @@ class AutoPartition():
                 if device in pvolume:
                     cmd = ["/usr/bin/pvremove", "-ff", "-y", pvolume]
                     call(cmd, msg=err_msg)
+
+        block_devices.invalidate()
     @staticmethod
     def printk(enable):
         """ Enables / disables printing kernel messages to console """
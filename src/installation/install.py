@@ -30,19 +30,20 @@ import os
 import shutil
 import sys
 
-from mako.template import Template
-
 from download import download
 
 from installation import special_dirs
 from installation import post_install
 from installation import mount
+from installation import pipeline
+from installation import prefetch
 
 import misc.extra as misc
 from misc.extra import InstallError
 from misc.run_cmd import call
 from misc.events import Events
 import pacman.pac as pac
+import pacman.pac_pool as pac_pool
 
 import hardware.hardware as hardware
 
@@ -292,14 +293,22 @@ class Installation():
             message = template.format(type(ex).__name__, ex.args)
             logging.error(message)
 
-        logging.debug("Downloading packages...")
-        self.download_packages()
+        if self.settings.get('pipelined_install'):
+            # Packages are installed while downloading, so special dirs
+            # must be mounted before the first transaction
+            special_dirs.mount(DEST_DIR)
 
-        # This mounts (binds) /dev and others to /DEST_DIR/dev and others
-        special_dirs.mount(DEST_DIR)
+            logging.debug("Downloading and installing packages...")
+            self.pipelined_install()
+        else:
+            logging.debug("Downloading packages...")
+            self.download_packages()
 
-        logging.debug("Installing packages...")
-        self.install_packages()
+            # This mounts (binds) /dev and others to /DEST_DIR/dev and others
+            special_dirs.mount(DEST_DIR)
+
+            logging.debug("Installing packages...")
+            self.install_packages()
 
         logging.debug("Configuring system...")
         post = post_install.PostInstallation(
@@ -335,8 +344,8 @@ class Installation():
         self.error = False
         return True
 
-    def download_packages(self):
-        """ Downloads necessary packages """
+    def get_download_packages(self):
+        """ Creates the DownloadPackages object """
 
         self.pacman_cache_dir = os.path.join(DEST_DIR, 'var/cache/pacman/pkg')
 
@@ -344,50 +353,81 @@ class Installation():
         pacman_conf['file'] = Installation.TMP_PACMAN_CONF
         pacman_conf['cache'] = self.pacman_cache_dir
 
-        download_packages = download.DownloadPackages(
+        return download.DownloadPackages(
             package_names=self.packages,
             pacman_conf=pacman_conf,
             settings=self.settings,
             callback_queue=self.events.queue)
 
+    def download_packages(self):
+        """ Downloads necessary packages """
+
+        download_packages = self.get_download_packages()
+
         # Metalinks have already been calculated before,
         # When downloadpackages class has been called in process.py to test
         # that Cnchi was able to create it before partitioning/formatting
         download_packages.start_download(self.metalinks)
 
+    def pipelined_install(self):
+        """ Installs packages in dependency ordered batches while the rest
+            are still being downloaded. If a transaction fails, falls back
+            to install all remaining packages in one transaction (download
+            errors abort the installation, as in download_packages) """
+
+        download_packages = self.get_download_packages()
+
+        if not self.metalinks:
+            download_packages.create_metalinks_list()
+            self.metalinks = download_packages.metalinks
+
+        for cache_dir in self.settings.get('xz_cache'):
+            self.pacman.handle.add_cachedir(cache_dir)
+
+        def download_function(metalinks, ready_callback):
+            """ Downloads packages, calling ready_callback for each one """
+            return download_packages.start_download(metalinks, ready_callback)
+
+        install_pipeline = pipeline.InstallPipeline(
+            self.pacman, self.packages, self.metalinks)
+
+        if install_pipeline.run(download_function):
+            # All downloading and installing has been done, so we hide progress bar
+            self.events.add('progress_bar', 'hide')
+        else:
+            logging.warning(
+                "Pipelined install failed. Installing remaining packages the usual way.")
+            self.install_packages()
+
     def create_pacman_conf_file(self):
         """ Creates a temporary pacman.conf """
-        myarch = os.uname()[-1]
-        msg = _("Creating a temporary pacman.conf for {0} architecture").format(
-            myarch)
-        logging.debug(msg)
-
-        # Template functionality. Needs Mako (see http://www.makotemplates.org/)
-        template_file_name = os.path.join(
-            self.settings.get('data'), 'pacman.tmpl')
-        file_template = Template(filename=template_file_name)
-        file_rendered = file_template.render(
-            destDir=DEST_DIR,
-            arch=myarch,
-            desktop=self.desktop)
-        filename = Installation.TMP_PACMAN_CONF
-        dirname = os.path.dirname(filename)
-        os.makedirs(dirname, mode=0o755, exist_ok=True)
-        with open(filename, "w") as my_file:
-            my_file.write(file_rendered)
+        prefetch.write_pacman_conf(
+            Installation.TMP_PACMAN_CONF,
+            self.settings.get('data'),
+            DEST_DIR,
+            self.desktop)
 
     def prepare_pacman(self):
         """ Configures pacman and syncs db on destination system """
 
         self.create_pacman_conf_file()
 
-        msg = _("Updating package manager security. Please wait...")
-        self.events.add('info', msg)
-        self.prepare_pacman_keyring()
+        # Keyring and databases may have been prepared while formatting
+        keyring_ok = False
+        databases_ok = False
+        pacman_prefetch = prefetch.get_prefetch()
+        if pacman_prefetch:
+            logging.debug("Waiting for pacman prefetch...")
+            keyring_ok, databases_ok = pacman_prefetch.install(DEST_DIR)
+
+        if not keyring_ok:
+            msg = _("Updating package manager security. Please wait...")
+            self.events.add('info', msg)
+            self.prepare_pacman_keyring()
 
         # Init pyalpm
         try:
-            self.pacman = pac.Pac(
+            self.pacman = pac_pool.get_pac(
                 Installation.TMP_PACMAN_CONF, self.events.queue)
         except Exception as ex:
             self.pacman = None
@@ -397,8 +437,9 @@ class Installation():
             logging.error(message)
             raise InstallError(message)
 
-        # Refresh pacman databases
-        if not self.pacman.refresh():
+        # Refresh pacman databases (prefetched ones are only checked
+        # again if they are too old)
+        if not pac_pool.refresh(self.pacman, force=not databases_ok):
             logging.error("Can't refresh pacman databases.")
             raise InstallError(_("Can't refresh pacman databases."))
 
@@ -411,39 +452,7 @@ class Installation():
             mydir = os.path.join(DEST_DIR, pacman_dir)
             os.makedirs(mydir, mode=0o755, exist_ok=True)
 
-        # Be sure that haveged is running (liveCD)
-        # haveged is a daemon that generates system entropy; this speeds up
-        # critical operations in cryptographic programs such as gnupg
-        # (including the generation of new keyrings)
-        cmd = ["systemctl", "start", "haveged"]
-        call(cmd)
-
-        # Delete old gnupg files
-        dest_path = os.path.join(DEST_DIR, "etc/pacman.d/gnupg")
-        cmd = ["rm", "-rf", dest_path]
-        call(cmd)
-        os.mkdir(dest_path)
-
-        # Tell pacman-key to regenerate gnupg files
-        # Initialize the pacman keyring
-        cmd = ["pacman-key", "--init", "--gpgdir", dest_path]
-        call(cmd)
-
-        # Load the signature keys
-        cmd = ["pacman-key", "--populate", "--gpgdir",
-               dest_path, "archlinux", "antergos"]
-        call(cmd)
-
-        # path = os.path.join(DEST_DIR, "root/.gnupg/dirmngr_ldapservers.conf")
-        # Run dirmngr
-        # https://bbs.archlinux.org/viewtopic.php?id=190380
-        with open(os.devnull, 'r') as dev_null:
-            cmd = ["dirmngr"]
-            call(cmd, stdin=dev_null)
-
-        # Refresh and update the signature keys
-        # cmd = ["pacman-key", "--refresh-keys", "--gpgdir", dest_path]
-        # call(cmd)
+        prefetch.create_keyring(os.path.join(DEST_DIR, prefetch.GNUPG_DIR))
 
     def delete_stale_pkgs(self, stale_pkgs):
         """ Failure might be due to stale cached packages. Delete them. """
@@ -33,6 +33,7 @@ import os
 
 from installation import wrapper
 from misc.run_cmd import call, popen
+import parted3.block_devices as block_devices
 
 
 def close_antergos_devices():
@@ -47,6 +48,7 @@ def close_antergos_devices():
         if os.path.exists(volume):
             cmd = ["/usr/bin/cryptsetup", "luksClose", volume]
             call(cmd, msg=err_msg)
+            block_devices.invalidate()
 
 
 def setup(luks_device, luks_name, luks_options):
@@ -102,3 +104,6 @@ def setup(luks_device, luks_name, luks_options):
         cmd = ["/usr/bin/cryptsetup", "luksOpen", luks_device, luks_name, "-q", "--key-file=-"]
         proc = popen(cmd, msg=err_msg, fatal=True)
         proc.communicate(input=luks_pass_bytes)
+
+    # There is a new LUKS header and a new mapped device
+    block_devices.invalidate()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# pipeline.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Pipelined installation: installs packages in dependency ordered batches
+    while the rest of packages are still being downloaded """
+
+from collections import OrderedDict
+import logging
+import threading
+
+import pyalpm
+
+from misc.extra import InstallError
+import pacman.alpm_hooks as alpm_hooks
+
+# When testing, no _() is available
+try:
+    _("")
+except NameError as err:
+    def _(message):
+        return message
+
+
+class InstallPipeline():
+    """ Splits the packages to install in dependency ordered batches.
+        Each batch is installed (in its own alpm transaction) as soon as all
+        its packages are downloaded and verified, while the download of the
+        following batches continues.
+        Batches are installed without resolving dependencies (so alpm only
+        uses the files we have already verified) and without running alpm
+        hooks. Hooks are run only once, after the last batch """
+
+    # Maximum number of packages installed in each alpm transaction
+    BATCH_SIZE = 64
+
+    def __init__(self, pacman, packages, metalinks):
+        """ pacman is an initialised Pac object, packages the list of
+            package (or group) names to install and metalinks the
+            download list (all packages and their dependencies) """
+        self.pacman = pacman
+        self.packages = packages
+        self.metalinks = metalinks
+
+        self.condition = threading.Condition()
+        # Names of packages already downloaded and verified
+        self.ready = set()
+        self.download_done = False
+        self.download_ok = False
+        self.download_error = None
+
+    def get_sync_pkgs(self):
+        """ Returns the sync packages (dict name -> pkg) that match the
+            downloaded files """
+        index = self.pacman.get_index()
+        pkgs = {}
+        for name, element in self.metalinks.items():
+            pkg = index.get_pkg(name)
+            if pkg is None or pkg.filename != element['filename']:
+                # Not the first repo one (antergos only packages)
+                pkg = next(
+                    (repo_pkg for repo_pkg in index.providers.get(name, [])
+                     if repo_pkg.filename == element['filename']), None)
+            if pkg is not None:
+                pkgs[name] = pkg
+        return pkgs
+
+    @staticmethod
+    def get_depends(pkgs):
+        """ Returns a dict package name -> names of the packages (in pkgs)
+            it depends on """
+        pkg_list = list(pkgs.values())
+        depends = {}
+        for name, pkg in pkgs.items():
+            depends[name] = set()
+            for dep in pkg.depends:
+                provider = pyalpm.find_satisfier(pkg_list, dep)
+                if provider is not None and provider.name != name:
+                    depends[name].add(provider.name)
+        return depends
+
+    @staticmethod
+    def sort_pkgs(pkgs):
+        """ Sorts packages so all dependencies of a package come before it.
+            Returns a list of lists of names: packages in a dependency cycle
+            (strongly connected component) are kept together """
+        depends = InstallPipeline.get_depends(pkgs)
+
+        # Tarjan's algorithm (without recursion). Components are found
+        # after the ones they depend on, which is our install order
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        for root in sorted(depends):
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(sorted(depends[root])))]
+            while work:
+                name, deps = work[-1]
+                for dep in deps:
+                    if dep not in index:
+                        index[dep] = lowlink[dep] = len(index)
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(sorted(depends[dep]))))
+                        break
+                    if dep in on_stack:
+                        lowlink[name] = min(lowlink[name], index[dep])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[name])
+                    if lowlink[name] == index[name]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == name:
+                                break
+                        components.append(sorted(component))
+        return components
+
+    def create_batches(self, pkgs):
+        """ Splits sorted packages in batches. A dependency cycle is never
+            split (its batch may be bigger than BATCH_SIZE) """
+        batches = []
+        batch = []
+        for component in self.sort_pkgs(pkgs):
+            if batch and len(batch) + len(component) > InstallPipeline.BATCH_SIZE:
+                batches.append(batch)
+                batch = []
+            batch.extend(component)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def disable_hooks(self):
+        """ Stops alpm from running hooks. Returns the hook directories it
+            was using (None if they can't be changed) """
+        handle = self.pacman.handle
+        try:
+            hookdirs = list(handle.hookdirs)
+            handle.hookdirs = []
+        except (AttributeError, TypeError, pyalpm.error) as err:
+            logging.warning("Can't disable alpm hooks, they will be run in each batch: %s", err)
+            return None
+        return hookdirs
+
+    def element_ready(self, element):
+        """ Called by the downloader when a package is ready """
+        with self.condition:
+            self.ready.add(element['identity'])
+            self.condition.notify_all()
+
+    def wait_for_batch(self, batch):
+        """ Waits until all packages in batch are ready.
+            Returns False if downloads have finished and some are missing """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.download_done or self.ready.issuperset(batch))
+            return self.ready.issuperset(batch)
+
+    def run(self, download_function):
+        """ Runs the pipeline. download_function(metalinks, ready_callback)
+            downloads all packages (it is run in its own thread).
+            Returns True if all packages have been installed and False if
+            a transaction fails. Raises InstallError if packages can't be
+            downloaded """
+
+        if not self.metalinks:
+            logging.warning("There is no package download list")
+            return False
+
+        pkgs = self.get_sync_pkgs()
+        missing = set(self.metalinks) - set(pkgs)
+        if missing:
+            logging.warning(
+                "Can't find these packages in the sync databases: %s", ' '.join(sorted(missing)))
+            return False
+
+        batches = self.create_batches(pkgs)
+        logging.debug("Installing %d packages in %d batches", len(pkgs), len(batches))
+
+        # Download packages in the same order they will be installed
+        ordered_metalinks = OrderedDict()
+        for batch in batches:
+            for name in batch:
+                ordered_metalinks[name] = self.metalinks[name]
+
+        def download_thread():
+            """ Downloads all packages """
+            download_ok = False
+            try:
+                download_ok = download_function(ordered_metalinks, self.element_ready)
+            except Exception as ex:
+                # It will be raised again in our thread
+                logging.error("Error downloading packages: %s", ex)
+                self.download_error = ex
+            finally:
+                with self.condition:
+                    self.download_ok = download_ok
+                    self.download_done = True
+                    self.condition.notify_all()
+
+        downloader = threading.Thread(target=download_thread)
+        downloader.start()
+
+        # Operation (install or upgrade) of each installed package
+        pkg_ops = OrderedDict()
+        localdb = self.pacman.handle.get_localdb()
+        hookdirs = self.disable_hooks()
+
+        result = True
+        for index, batch in enumerate(batches):
+            if not self.wait_for_batch(batch):
+                logging.error("Packages for batch %d could not be downloaded", index + 1)
+                result = False
+                break
+            logging.debug(
+                "Installing batch %d of %d (%d packages)", index + 1, len(batches), len(batch))
+            batch_pkgs = [pkgs[name] for name in batch]
+            for name in batch:
+                if localdb.get_pkg(name) is None:
+                    pkg_ops[name] = alpm_hooks.INSTALL
+                else:
+                    pkg_ops[name] = alpm_hooks.UPGRADE
+            try:
+                # Dependencies are in this batch or in a previous one,
+                # alpm must not resolve (and download) them by itself
+                if not self.pacman.install_pkgs(batch_pkgs, {'nodeps': True}):
+                    result = False
+                    break
+            except pyalpm.error as err:
+                logging.error(err)
+                result = False
+                break
+
+        downloader.join()
+
+        if hookdirs is not None:
+            self.pacman.handle.hookdirs = hookdirs
+            if result and pkg_ops:
+                logging.debug("Running alpm hooks of all batches")
+                alpm_hooks.run_post_transaction_hooks(
+                    self.pacman.handle, hookdirs, pkg_ops)
+
+        # Download errors are not fixed installing the usual way
+        if self.download_error is not None:
+            raise self.download_error
+        if not self.download_ok:
+            txt = _("Can't download needed packages. Cnchi can't continue.")
+            raise InstallError(txt)
+
+        if result:
+            # Packages that were not explicitly asked for must be
+            # marked as installed as dependencies
+            explicit = set(self.pacman.resolve_targets(self.packages))
+            dependencies = [name for name in pkgs if name not in explicit]
+            self.pacman.set_pkgs_reason(dependencies, pyalpm.PKG_REASON_DEPEND)
+
+        return result
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# prefetch.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Prepares pacman's keyring and sync databases in a staging directory
+    (while disks are being formatted) so they can be moved to the
+    destination system once it is mounted """
+
+import logging
+import multiprocessing
+import os
+import shutil
+
+from mako.template import Template
+
+from misc.run_cmd import call
+import pacman.pac as pac
+
+# Staging root directory (/tmp is a tmpfs in the live system)
+STAGING_DIR = "/tmp/cnchi-prefetch"
+
+# Paths (relative to the root directory) of the files we prepare
+GNUPG_DIR = "etc/pacman.d/gnupg"
+SYNC_DIR = "var/lib/pacman/sync"
+
+_PREFETCH = None
+
+
+def write_pacman_conf(filename, data_dir, dest_dir, desktop):
+    """ Creates a pacman.conf file that uses dest_dir as root directory """
+    myarch = os.uname()[-1]
+    msg = "Creating {0} for {1} architecture".format(filename, myarch)
+    logging.debug(msg)
+
+    # Template functionality. Needs Mako (see http://www.makotemplates.org/)
+    template_file_name = os.path.join(data_dir, 'pacman.tmpl')
+    file_template = Template(filename=template_file_name)
+    file_rendered = file_template.render(
+        destDir=dest_dir,
+        arch=myarch,
+        desktop=desktop)
+    dirname = os.path.dirname(filename)
+    os.makedirs(dirname, mode=0o755, exist_ok=True)
+    with open(filename, "w") as my_file:
+        my_file.write(file_rendered)
+
+
+def create_keyring(gpg_dir):
+    """ Creates a new pacman keyring in gpg_dir. Returns False on error """
+
+    # Be sure that haveged is running (liveCD)
+    # haveged is a daemon that generates system entropy; this speeds up
+    # critical operations in cryptographic programs such as gnupg
+    # (including the generation of new keyrings)
+    cmd = ["systemctl", "start", "haveged"]
+    call(cmd)
+
+    # Delete old gnupg files
+    if os.path.exists(gpg_dir):
+        shutil.rmtree(gpg_dir)
+    os.makedirs(gpg_dir, mode=0o755)
+
+    # Tell pacman-key to regenerate gnupg files
+    # Initialize the pacman keyring
+    cmd = ["pacman-key", "--init", "--gpgdir", gpg_dir]
+    if call(cmd) is False:
+        return False
+
+    # Load the signature keys
+    cmd = ["pacman-key", "--populate", "--gpgdir",
+           gpg_dir, "archlinux", "antergos"]
+    if call(cmd) is False:
+        return False
+
+    # path = os.path.join(DEST_DIR, "root/.gnupg/dirmngr_ldapservers.conf")
+    # Run dirmngr
+    # https://bbs.archlinux.org/viewtopic.php?id=190380
+    with open(os.devnull, 'r') as dev_null:
+        cmd = ["dirmngr"]
+        call(cmd, stdin=dev_null)
+
+    # Refresh and update the signature keys
+    # cmd = ["pacman-key", "--refresh-keys", "--gpgdir", gpg_dir]
+    # call(cmd)
+    return True
+
+
+def replace_dir(src, dst):
+    """ Copies src directory to dst, replacing it (src and dst may be in
+        different filesystems, so the copy is made next to dst and then
+        renamed) """
+    tmp_dst = dst + '.cnchi-tmp'
+    old_dst = dst + '.cnchi-old'
+    for path in [tmp_dst, old_dst]:
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    os.makedirs(os.path.dirname(dst), mode=0o755, exist_ok=True)
+    shutil.copytree(src, tmp_dst, symlinks=True)
+    if os.path.exists(dst):
+        os.rename(dst, old_dst)
+    os.rename(tmp_dst, dst)
+    if os.path.exists(old_dst):
+        shutil.rmtree(old_dst)
+
+
+class PacmanPrefetch(multiprocessing.Process):
+    """ Creates the pacman keyring and downloads the sync databases into
+        STAGING_DIR. It runs in its own process, so it keeps its privileges
+        while the main process drops them """
+
+    def __init__(self, data_dir, desktop, staging_dir=STAGING_DIR):
+        super(PacmanPrefetch, self).__init__()
+        self.daemon = True
+        self.data_dir = data_dir
+        self.desktop = desktop
+        self.staging_dir = staging_dir
+        self.pacman_conf = os.path.join(staging_dir, 'pacman.conf')
+        self.keyring_ok = multiprocessing.Value('b', False)
+        self.databases_ok = multiprocessing.Value('b', False)
+
+    def run(self):
+        """ Prepares keyring and sync databases """
+        try:
+            self.keyring_ok.value = create_keyring(
+                os.path.join(self.staging_dir, GNUPG_DIR))
+        except OSError as err:
+            logging.warning("Can't prepare pacman keyring: %s", err)
+
+        try:
+            self.databases_ok.value = self.sync_databases()
+        except (OSError, pac.pyalpm.error) as err:
+            logging.warning("Can't prefetch pacman databases: %s", err)
+
+        logging.debug(
+            "Pacman prefetch finished (keyring: %s, databases: %s)",
+            bool(self.keyring_ok.value), bool(self.databases_ok.value))
+
+    def sync_databases(self):
+        """ Downloads sync databases to the staging DBPath """
+        os.makedirs(os.path.join(self.staging_dir, SYNC_DIR), mode=0o755, exist_ok=True)
+        os.makedirs(
+            os.path.join(self.staging_dir, 'var/cache/pacman/pkg'), mode=0o755, exist_ok=True)
+        write_pacman_conf(
+            self.pacman_conf, self.data_dir, self.staging_dir, self.desktop)
+        pacman = pac.Pac(self.pacman_conf)
+        try:
+            return pacman.refresh()
+        finally:
+            pacman.release()
+
+    def install(self, dest_dir):
+        """ Waits until the prefetch has finished and moves its results to
+            dest_dir. Returns a tuple (keyring_ok, databases_ok) """
+        self.join()
+
+        keyring_ok = bool(self.keyring_ok.value)
+        databases_ok = bool(self.databases_ok.value)
+
+        for is_ok, path in [(keyring_ok, GNUPG_DIR), (databases_ok, SYNC_DIR)]:
+            if not is_ok:
+                continue
+            try:
+                replace_dir(
+                    os.path.join(self.staging_dir, path),
+                    os.path.join(dest_dir, path))
+                logging.debug("Prefetched %s moved to %s", path, dest_dir)
+            except (OSError, shutil.Error) as err:
+                logging.warning("Can't move prefetched %s: %s", path, err)
+                if path == GNUPG_DIR:
+                    keyring_ok = False
+                else:
+                    databases_ok = False
+
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        return keyring_ok, databases_ok
+
+
+def start(settings):
+    """ Starts preparing the keyring and databases in the background """
+    global _PREFETCH
+    if _PREFETCH is None:
+        _PREFETCH = PacmanPrefetch(
+            settings.get('data'), settings.get('desktop').lower())
+        _PREFETCH.start()
+    return _PREFETCH
+
+
+def get_prefetch():
+    """ Returns the running prefetch (None if it has not been started) """
+    return _PREFETCH
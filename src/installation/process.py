@@ -42,8 +42,11 @@ from misc.events import Events
 import misc.extra as misc
 
 from download import download
+import pacman.pac_pool as pac_pool
 
 from installation import select_packages as pack
+from installation import prefetch
+import parted3.block_devices as block_devices
 
 # When testing, no _() is available
 try:
@@ -94,6 +97,9 @@ class Process(multiprocessing.Process):
             txt = _("Cannot create download package list (metalinks).")
             raise misc.InstallError(txt)
 
+        # Installation uses its own pacman.conf, we don't need this handle anymore
+        pac_pool.release(pacman_conf['file'])
+
     def init_lembrame(self):
         """ Initializes lembrame, loading its settings """
         if self.settings.get("feature_lembrame"):
@@ -132,6 +138,14 @@ class Process(multiprocessing.Process):
         run_install. Takes care of the exceptions, too. """
 
         try:
+            # We are forked from Cnchi's Gtk process, do not use its (maybe
+            # outdated) block devices inventory
+            block_devices.invalidate()
+
+            # Prepare pacman keyring and databases while disks are formatted
+            with misc.raised_privileges():
+                prefetch.start(self.settings)
+
             # Initialize Lembrame
             self.init_lembrame()
 
@@ -190,3 +204,6 @@ class Process(multiprocessing.Process):
             for line in trace:
                 logging.error(line.rstrip())
             self.events.add_fatal(install_error)
+        finally:
+            # Nobody else uses alpm handles of this process
+            pac_pool.release_all()
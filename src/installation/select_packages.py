@@ -27,14 +27,12 @@
 import logging
 import os
 import subprocess
-import requests
-from requests.exceptions import RequestException
-
 import xml.etree.cElementTree as elementTree
 
 import desktop_info
+import startup_prefetch
 
-import pacman.pac as pac
+import pacman.pac_pool as pac_pool
 
 from misc.events import Events
 import misc.extra as misc
@@ -55,7 +53,7 @@ except NameError as err:
 class SelectPackages():
     """ Package list creation class """
 
-    PKGLIST_URL = 'https://raw.githubusercontent.com/Antergos/Cnchi/master/data/packages.xml'
+    PKGLIST_URL = startup_prefetch.PKGLIST_URL
 
     def __init__(self, settings, callback_queue):
         """ Initialize package class """
@@ -105,9 +103,9 @@ class SelectPackages():
     @misc.raise_privileges
     def refresh_pacman_databases(self):
         """ Updates pacman databases """
-        # Init pyalpm
+        # Init pyalpm (the handle is shared with the other installation stages)
         try:
-            pacman = pac.Pac(self.settings.get('pacman_config_file'), self.events.queue)
+            pacman = pac_pool.get_pac(self.settings.get('pacman_config_file'), self.events.queue)
         except Exception as ex:
             template = (
                 "Can't initialize pyalpm. An exception of type {0} occured. Arguments:\n{1!r}")
@@ -115,22 +113,12 @@ class SelectPackages():
             logging.error(message)
             raise InstallError(message)
 
-        # Refresh pacman databases
-        if not pacman.refresh():
+        # Refresh pacman databases (if they have not been refreshed just now)
+        if not pac_pool.refresh(pacman):
             logging.error("Can't refresh pacman databases.")
             txt = _("Can't refresh pacman databases.")
             raise InstallError(txt)
 
-        try:
-            pacman.release()
-            del pacman
-        except Exception as ex:
-            template = (
-                "Can't release pyalpm. An exception of type {0} occured. Arguments:\n{1!r}")
-            message = template.format(type(ex).__name__, ex.args)
-            logging.error(message)
-            raise InstallError(message)
-
     def add_package(self, pkg):
         """ Adds xml node text to our package list
             returns TRUE if the package is added """
@@ -182,15 +170,15 @@ class SelectPackages():
     def load_xml_remote(self):
         """ Load xml packages list from url """
         self.events.add('info', _("Getting online package list..."))
-        url = SelectPackages.PKGLIST_URL
-        logging.debug("Getting url %s...", url)
-        try:
-            req = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
-            self.xml_root = elementTree.fromstring(req.content)
-        except RequestException as url_error:
-            msg = "Can't retrieve remote package list: {}".format(
-                url_error)
-            logging.warning(msg)
+        # It has probably been downloaded while the user was answering
+        content = startup_prefetch.get_service().wait(startup_prefetch.PACKAGES_XML)
+        if content is None:
+            content = startup_prefetch.get_packages_xml()
+        if content is not None:
+            try:
+                self.xml_root = elementTree.fromstring(content)
+            except elementTree.ParseError as err:
+                logging.warning("Can't parse remote package list: %s", err)
 
     def load_xml_root_node(self):
         """ Loads xml data, storing the root node """
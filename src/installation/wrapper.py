@@ -33,6 +33,7 @@ import logging
 
 from misc.extra import InstallError
 from misc.run_cmd import call
+import parted3.block_devices as block_devices
 
 # When testing, no _() is available
 try:
@@ -46,7 +47,10 @@ def wipefs(device, fatal=True):
     """ Wipe fs from device """
     err_msg = "Cannot wipe the filesystem of device {0}".format(device)
     cmd = ["wipefs", "-a", device]
-    call(cmd, msg=err_msg, fatal=fatal)
+    try:
+        call(cmd, msg=err_msg, fatal=fatal)
+    finally:
+        block_devices.invalidate()
 
 
 def run_dd(input_device, output_device, bytes_block=512, count=2048, seek=0):
@@ -72,6 +76,8 @@ def partprobe():
         subprocess.check_output('/usr/bin/partprobe', stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError as err:
         logging.error("Command %s failed: %s", err.cmd, err.output.decode())
+    finally:
+        block_devices.invalidate()
 
 
 def sgdisk(command, device):
@@ -88,6 +94,8 @@ def sgdisk(command, device):
         logging.error("Command %s failed: %s", err.cmd, err.output.decode())
         txt = _("Command {0} failed: {1}").format(err.cmd, err.output.decode())
         raise InstallError(txt)
+    finally:
+        block_devices.invalidate()
 
 
 def sgdisk_new(device, part_num, label, size, hex_code):
@@ -125,6 +133,8 @@ def parted_set(device, number, flag, state):
         txt = "Cannot set flag {0} on device {1}. Command {2} has failed: {3}"
         txt = txt.format(flag, device, err.cmd, err.output.decode())
         logging.error(txt)
+    finally:
+        block_devices.invalidate()
 
 
 def parted_mkpart(device, ptype, start, end, filesystem=""):
@@ -162,6 +172,8 @@ def _create_partition_cmd(device, cmd):
             "Cannot create a new partition on device {0}. Command {1} has failed: {2}")
         txt = txt.format(device, err.cmd, err.output.decode())
         raise InstallError(txt)
+    finally:
+        block_devices.invalidate()
 
 
 def parted_mklabel(device, label_type="msdos"):
@@ -182,3 +194,5 @@ def parted_mklabel(device, label_type="msdos"):
                 "Command {1} failed: {2}")
         txt = txt.format(device, err.cmd, err.output.decode())
         raise InstallError(txt)
+    finally:
+        block_devices.invalidate()
@@ -34,6 +34,8 @@ import zipfile
 
 import requests
 
+import misc.speed_meter as speed_meter
+
 
 class GnomeExtensionsDownloader():
     """ Class used to download gnome extensions """
@@ -43,6 +45,9 @@ class GnomeExtensionsDownloader():
     extension_latest_shell = False
     extension_download_link = False
 
+    # Size of the chunks read from the network (in bytes)
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self, install_user_home, config):
         self.config = config
         self.install_user_home = install_user_home
@@ -72,11 +77,21 @@ class GnomeExtensionsDownloader():
         if self.extension_download_link and self.extension_name:
             req = requests.get(self.extension_download_link, stream=True)
             if req.status_code == requests.codes.ok:
+                try:
+                    total_length = int(req.headers.get('content-length'))
+                except TypeError:
+                    total_length = 0
+                meter = speed_meter.SpeedMeter(total=total_length, max_updates=1)
                 with open(self.tmp_downloads + self.extension_name, 'wb') as extension_file:
-                    for data in req.iter_content(1024):
+                    for data in req.iter_content(GnomeExtensionsDownloader.CHUNK_SIZE):
                         if not data:
                             break
                         extension_file.write(data)
+                        progress = meter.add(len(data))
+                        if progress:
+                            logging.debug(
+                                "Downloading '%s': %s", self.extension_name,
+                                speed_meter.format_progress(progress))
                 self.extract_extension()
 
                 return True
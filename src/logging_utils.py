@@ -28,7 +28,11 @@
 
 """ Logging utils to ease log calls """
 
+from collections import deque
 import logging
+import logging.handlers
+import multiprocessing.util
+import queue
 import uuid
 import json
 import os
@@ -60,10 +64,139 @@ class Singleton(type):
         return obj
 
 
+class SubsystemFilter(logging.Filter):
+    """ Filters records using a different log level for each subsystem """
+
+    # Directory or file name -> subsystem
+    SUBSYSTEMS = {
+        'download': 'download',
+        'pacman': 'alpm',
+        'parted3': 'partitioning',
+        'auto_partition.py': 'partitioning',
+        'luks.py': 'partitioning'}
+
+    # subsystem -> log level of the last filter created (loggers that do
+    # not propagate to root use it, see get_subsystem_level)
+    configured_levels = {}
+
+    def __init__(self, default_level, levels=None):
+        super().__init__()
+        self.default_level = default_level
+        # subsystem -> log level
+        self.levels = levels or {}
+        SubsystemFilter.configured_levels = dict(self.levels)
+        # record pathname -> log level
+        self.path_levels = {}
+
+    def get_min_level(self):
+        """ Returns the lowest level that some subsystem logs """
+        return min([self.default_level] + list(self.levels.values()))
+
+    def get_level(self, pathname):
+        """ Returns the log level of the subsystem source file pathname is in """
+        level = self.path_levels.get(pathname)
+        if level is None:
+            level = self.default_level
+            dirname, filename = os.path.split(pathname)
+            for name in [filename, os.path.basename(dirname)]:
+                subsystem = SubsystemFilter.SUBSYSTEMS.get(name)
+                if subsystem in self.levels:
+                    level = self.levels[subsystem]
+                    break
+            self.path_levels[pathname] = level
+        return level
+
+    def filter(self, record):
+        return record.levelno >= self.get_level(record.pathname)
+
+
+def get_subsystem_level(subsystem, default):
+    """ Returns the log level set for subsystem (or default if none) """
+    return SubsystemFilter.configured_levels.get(subsystem, default)
+
+
+def parse_subsystem_levels(text):
+    """ Parses a "subsystem=level,..." string (download=info,alpm=warning)
+        Returns a dict (subsystem -> log level). Raises ValueError """
+    levels = {}
+    subsystems = set(SubsystemFilter.SUBSYSTEMS.values())
+    for item in text.split(','):
+        subsystem, _sep, level_name = [value.strip() for value in item.partition('=')]
+        level = logging.getLevelName(level_name.upper())
+        if subsystem not in subsystems or not isinstance(level, int):
+            raise ValueError("Wrong log level setting '{0}'".format(item))
+        levels[subsystem] = level
+    return levels
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """ Sends records to handlers in a listener thread, so threads that
+        log never wait for the disk. It is closed before the handlers it
+        feeds (as it is created after them), so logging.shutdown() writes
+        all pending records """
+
+    def __init__(self, handlers):
+        super().__init__(queue.Queue(-1))
+        self.handlers = handlers
+        self.listener = None
+        self.pid = None
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        """ The listener thread does not exist in a forked process, a new
+            one will be started the first time it logs something """
+        self.queue = queue.Queue(-1)
+        self.listener = None
+
+    def start_listener(self):
+        """ Starts the listener thread of this process """
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        if self.pid is not None:
+            # Forked process. Write pending records when it finishes
+            multiprocessing.util.Finalize(None, self.stop_listener, exitpriority=0)
+        self.pid = os.getpid()
+
+    def stop_listener(self):
+        """ Writes all pending records and stops the listener thread """
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+
+    def prepare(self, record):
+        """ Merges args into the message now (they may change later). As
+            our queue does not leave this process, exc_info is kept """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        """ Called from emit, with our lock acquired """
+        if self.listener is None:
+            self.start_listener()
+        super().enqueue(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            self.stop_listener()
+        finally:
+            self.release()
+        super().close()
+
+
 class ContextFilter(logging.Filter, metaclass=Singleton):
     """ Context filter for logging methods to send logs to bugsnag """
     LOG_FOLDER = '/var/log/cnchi'
 
+    # Lines shown before and after each warning or error
+    CONTEXT_LINES = 10
+    # Maximum number of cnchi.log lines sent (the last ones are kept)
+    MAX_EXCERPT_LINES = 500
+    # Only the end of other (big) logs is sent
+    TAIL_BYTES = 64 * 1024
+
     def __init__(self):
         super().__init__()
         self.api_key = self.get_bugsnag_api()
@@ -73,6 +206,8 @@ class ContextFilter(logging.Filter, metaclass=Singleton):
         self.ip_addr = '1.2.3.4'
 
     def filter(self, record):
+        """ Adds our context to record. Only add this filter to handlers
+            that need it (bugsnag), as creating the uuid is not cheap """
         uid = str(uuid.uuid1()).split("-")
         record.uuid = uid[3] + "-" + uid[1] + "-" + uid[2] + "-" + uid[4]
         record.ip_addr = self.ip_addr
@@ -148,29 +283,42 @@ class ContextFilter(logging.Filter, metaclass=Singleton):
         return build_server
 
     @staticmethod
-    def filter_log_lines(log):
-        """ Filter log lines """
-        keep_lines = []
+    def filter_log_lines(log, context=CONTEXT_LINES, max_lines=MAX_EXCERPT_LINES):
+        """ Returns the lines of log (a file object) around warnings and
+            errors. Reads log once, overlapping windows are merged and
+            only the last max_lines lines are kept """
         look_for = ['[WARNING]', '[ERROR]']
-        log_lines = log.readlines()
-
-        for i, log_line in enumerate(log_lines):
-            for pattern in look_for:
-                if pattern in log_line:
-                    try:
-                        if 10 < i < (len(log_lines) - 10):
-                            keep_lines.extend([log_lines[l]
-                                               for l in range(i - 10, i + 10)])
-                        elif i < 10:
-                            keep_lines.extend([log_lines[l]
-                                               for l in range(0, i)])
-                        elif i > (len(log_lines) - 10):
-                            keep_lines.extend([log_lines[l]
-                                               for l in range(i, len(log_lines))])
-                    except (IndexError, KeyError) as err:
-                        print(err)
-
-        return keep_lines
+        keep_lines = deque(maxlen=max_lines)
+        before = deque(maxlen=context)
+        after = 0
+
+        for log_line in log:
+            if any(pattern in log_line for pattern in look_for):
+                keep_lines.extend(before)
+                before.clear()
+                keep_lines.append(log_line)
+                after = context
+            elif after > 0:
+                keep_lines.append(log_line)
+                after -= 1
+            else:
+                before.append(log_line)
+
+        return list(keep_lines)
+
+    @staticmethod
+    def read_log_tail(path, max_bytes=TAIL_BYTES):
+        """ Returns the (stripped) lines in the last max_bytes of file path """
+        with open(path, 'rb') as log:
+            log.seek(0, os.SEEK_END)
+            size = log.tell()
+            log.seek(max(0, size - max_bytes))
+            data = log.read()
+        lines = data.decode('utf-8', errors='replace').splitlines()
+        if size > max_bytes and lines:
+            # First line is probably incomplete
+            lines = lines[1:]
+        return [line.strip() for line in lines]
 
     def bugsnag_before_notify_callback(self, notification=None):
         """ Filter unwanted notifications here """
@@ -187,25 +335,19 @@ class ContextFilter(logging.Filter, metaclass=Singleton):
                                  "name": self.install_id,
                                  "install_id": self.install_id}
 
-            logs = [
-                os.path.join(ContextFilter.LOG_FOLDER, '{0}.log'.format(n))
-                for n in ['cnchi', 'cnchi-alpm', 'pacman', 'postinstall']]
-            missing = [f for f in logs if not os.path.exists(f)]
-            if missing:
-                for log in missing:
-                    open(log, 'a').close()
-
-            with open(logs[0], 'r') as cnchi:
-                with open(logs[1], 'r') as pacman:
-                    with open(logs[2], 'r') as postinstall:
-                        log_dict = {'pacman': pacman,
-                                    'postinstall': postinstall}
-                        parse = {
-                            log: [line.strip() for line in log_dict[log]]
-                            for log in log_dict
-                        }
-                        parse['cnchi'] = self.filter_log_lines(cnchi)
-                        notification.add_tab('logs', parse)
+            logs = {
+                name: os.path.join(ContextFilter.LOG_FOLDER, '{0}.log'.format(name))
+                for name in ['cnchi', 'cnchi-alpm', 'pacman', 'postinstall']}
+            for path in logs.values():
+                if not os.path.exists(path):
+                    open(path, 'a').close()
+
+            parse = {
+                name: self.read_log_tail(logs[name])
+                for name in ['pacman', 'postinstall']}
+            with open(logs['cnchi'], 'r', errors='replace') as cnchi:
+                parse['cnchi'] = self.filter_log_lines(cnchi)
+            notification.add_tab('logs', parse)
 
             return notification
         return False
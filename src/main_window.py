@@ -32,34 +32,18 @@
 import os
 import multiprocessing
 import logging
+import importlib
+import time
 
+import auto_timezone
 import config
 import desktop_info
 import info
 import misc.extra as misc
 
-import pages.welcome
-import pages.language
-import pages.location
-import pages.cache
-import pages.check
-import pages.desktop
-import pages.features
-import pages.keymap
-import pages.timezone
-import pages.user_info
-import pages.slides
-import pages.summary
-import pages.mirrors
-import pages.ask
-import pages.automatic
-import pages.alongside
-import pages.advanced
-import pages.zfs
-
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GLib
 
 
 # When testing, no _() is available
@@ -85,10 +69,70 @@ def atk_set_object_description(widget, description):
         # atk_object_set_name
 
 
+class PageRegistry():
+    """ Installer pages, indexed by name. A page (and its module) is only
+        loaded when it is first needed """
+
+    def __init__(self, params):
+        self.params = params
+        # page name -> (module name, class name, kwargs, condition)
+        self.entries = {}
+        # page name -> page object (or None)
+        self.built = {}
+        # page name -> seconds spent importing its module and creating it
+        self.timings = {}
+
+    def register(self, name, module_name, class_name, condition=None, **kwargs):
+        """ Registers a page. If condition is given and it returns False when
+            the page is needed, the page will be None """
+        self.entries[name] = (module_name, class_name, kwargs, condition)
+
+    def build(self, name):
+        """ Creates page name (if it has not been created already) """
+        if name in self.built:
+            return self.built[name]
+
+        module_name, class_name, kwargs, condition = self.entries[name]
+        page = None
+        start = time.monotonic()
+        if condition is None or condition():
+            module = importlib.import_module(module_name)
+            page = getattr(module, class_name)(self.params, **kwargs)
+        self.timings[name] = time.monotonic() - start
+        self.built[name] = page
+        logging.debug("Page %s loaded in %.3f seconds", name, self.timings[name])
+        return page
+
+    def is_built(self, name):
+        """ Returns True if page name has already been created """
+        return name in self.built
+
+    def get_report(self):
+        """ Returns a list of (page name, seconds) of all loaded pages """
+        return list(self.timings.items())
+
+    def keys(self):
+        """ Returns registered page names """
+        return self.entries.keys()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, name):
+        if name not in self.entries:
+            raise KeyError(name)
+        return self.build(name)
+
+
 class MainWindow(Gtk.ApplicationWindow):
     """ Cnchi main window """
 
     def __init__(self, app, cmd_line):
+        self.start_time = time.monotonic()
+
         Gtk.ApplicationWindow.__init__(self, title="Cnchi", application=app)
 
         self._main_window_width = 875
@@ -135,6 +179,9 @@ class MainWindow(Gtk.ApplicationWindow):
         # a11y
         self.settings.set('a11y', cmd_line.a11y)
 
+        # Install packages while downloading
+        self.settings.set('pipelined_install', cmd_line.pipelined_install)
+
         # Set enabled desktops
         if self.settings.get('hidden'):
             self.settings.set('desktops', desktop_info.DESKTOPS_DEV)
@@ -230,15 +277,20 @@ class MainWindow(Gtk.ApplicationWindow):
         self.params['no_tryit'] = cmd_line.no_tryit
         self.params['a11y'] = cmd_line.a11y
 
-        # Just load the first two screens (the other ones will be loaded later)
-        # We do this so the user has not to wait for all the screens to be
-        # loaded
-        self.pages = dict()
-        self.pages["welcome"] = pages.welcome.Welcome(self.params)
+        # Pages are only loaded when needed (or while the user is looking at
+        # the previous one). We do this so the user has not to wait for all
+        # the screens to be loaded
+        self.pages = PageRegistry(self.params)
+        self.register_pages()
+        self.pages.build("welcome")
+
+        # Timezone detection takes a while, so start it now (it waits until
+        # the user leaves the welcome screen) instead of when its page is loaded
+        auto_timezone.start_auto_timezone_process(self.settings)
 
         if os.path.exists('/home/antergos/.config/openbox'):
             # In minimal iso, load language screen now
-            self.pages["language"] = pages.language.Language(self.params)
+            self.pages.build("language")
 
             # Fix bugy Gtk window size when using Openbox
             self._main_window_width = 750
@@ -297,6 +349,7 @@ class MainWindow(Gtk.ApplicationWindow):
         )
 
         # Show main window
+        self.first_frame_handler = self.connect_after('draw', self.on_first_draw)
         self.show_all()
 
         self.current_page.prepare('forwards')
@@ -305,7 +358,7 @@ class MainWindow(Gtk.ApplicationWindow):
         self.backwards_button.hide()
 
         self.progressbar.set_fraction(0)
-        self.progressbar_step = 0
+        self.progressbar_step = 1.0 / (len(self.pages) - 2)
 
         # Do not hide progress bar for minimal iso as it would break
         # the widget alignment on language page.
@@ -324,59 +377,73 @@ class MainWindow(Gtk.ApplicationWindow):
         elif widget.get_style_context().has_class('title'):
             widget.set_tooltip_text(self.tooltip_string)
 
-    def load_pages(self):
-        """ Preload all installer pages """
-        if not os.path.exists('/home/antergos/.config/openbox'):
-            self.pages["language"] = pages.language.Language(self.params)
-
-        self.pages["check"] = pages.check.Check(self.params)
-        self.pages["location"] = pages.location.Location(self.params)
-
-        self.pages["timezone"] = pages.timezone.Timezone(self.params)
+    def register_pages(self):
+        """ Registers all installer pages (they are loaded when needed) """
+        self.pages.register("welcome", "pages.welcome", "Welcome")
+        self.pages.register("language", "pages.language", "Language")
+        self.pages.register("check", "pages.check", "Check")
+        self.pages.register("location", "pages.location", "Location")
+        self.pages.register("timezone", "pages.timezone", "Timezone")
 
         if self.settings.get('desktop_ask'):
-            self.pages["keymap"] = pages.keymap.Keymap(self.params)
-            self.pages["desktop"] = pages.desktop.DesktopAsk(self.params)
-            self.pages["features"] = pages.features.Features(self.params)
-        else:
-            self.pages["keymap"] = pages.keymap.Keymap(
-                self.params,
-                next_page='features')
-            self.pages["features"] = pages.features.Features(
-                self.params,
-                prev_page='keymap')
-
-        self.pages["cache"] = pages.cache.Cache(self.params)
-        self.pages["mirrors"] = pages.mirrors.Mirrors(self.params)
-
-        self.pages["installation_ask"] = pages.ask.InstallationAsk(
-            self.params)
-        self.pages["installation_automatic"] = pages.automatic.InstallationAutomatic(
-            self.params)
-
-        if self.settings.get("enable_alongside"):
-            self.pages["installation_alongside"] = pages.alongside.InstallationAlongside(
-                self.params)
+            self.pages.register("keymap", "pages.keymap", "Keymap")
+            self.pages.register("desktop", "pages.desktop", "DesktopAsk")
+            self.pages.register("features", "pages.features", "Features")
         else:
-            self.pages["installation_alongside"] = None
-
-        self.pages["installation_advanced"] = pages.advanced.InstallationAdvanced(
-            self.params)
-        self.pages["installation_zfs"] = pages.zfs.InstallationZFS(
-            self.params)
-        self.pages["user_info"] = pages.user_info.UserInfo(self.params)
-        self.pages["summary"] = pages.summary.Summary(self.params)
-        self.pages["slides"] = pages.slides.Slides(self.params)
-
-        diff = 2
-        if os.path.exists('/home/antergos/.config/openbox'):
-            # In minimal (openbox) we don't have a welcome screen
-            diff = 3
-
-        num_pages = len(self.pages) - diff
-
-        if num_pages > 0:
-            self.progressbar_step = 1.0 / num_pages
+            self.pages.register(
+                "keymap", "pages.keymap", "Keymap", next_page='features')
+            self.pages.register(
+                "features", "pages.features", "Features", prev_page='keymap')
+
+        self.pages.register("cache", "pages.cache", "Cache")
+        self.pages.register("mirrors", "pages.mirrors", "Mirrors")
+
+        self.pages.register(
+            "installation_ask", "pages.ask", "InstallationAsk")
+        self.pages.register(
+            "installation_automatic", "pages.automatic", "InstallationAutomatic")
+
+        # InstallationAsk decides if alongside is available
+        self.pages.register(
+            "installation_alongside", "pages.alongside", "InstallationAlongside",
+            condition=lambda: self.settings.get("enable_alongside"))
+
+        self.pages.register(
+            "installation_advanced", "pages.advanced", "InstallationAdvanced")
+        self.pages.register(
+            "installation_zfs", "pages.zfs", "InstallationZFS")
+        self.pages.register("user_info", "pages.user_info", "UserInfo")
+        self.pages.register("summary", "pages.summary", "Summary")
+        self.pages.register("slides", "pages.slides", "Slides")
+
+    def on_first_draw(self, _widget, _context):
+        """ Logs how long it took to show the window for the first time """
+        self.disconnect(self.first_frame_handler)
+        self.first_frame_handler = None
+        logging.debug(
+            "Time to first frame: %.3f seconds",
+            time.monotonic() - self.start_time)
+        for name, seconds in self.pages.get_report():
+            logging.debug("  %s page: %.3f seconds", name, seconds)
+        self.prebuild_next_page()
+        return False
+
+    def prebuild_next_page(self):
+        """ Loads the next page while the user is looking at the current one.
+            Gtk widgets can only be created in the main thread, so this is
+            done when Gtk is idle """
+        GLib.idle_add(
+            self.on_prebuild_next_page, self.current_page,
+            priority=GLib.PRIORITY_LOW)
+
+    def on_prebuild_next_page(self, page):
+        """ Loads the page that follows page (if the user is still there) """
+        if page is not self.current_page or page is None:
+            return False
+        next_page = page.get_next_page()
+        if next_page in self.pages and not self.pages.is_built(next_page):
+            self.pages.build(next_page)
+        return False
 
     def set_geometry(self):
         """ Sets Cnchi window geometry """
@@ -463,11 +530,6 @@ class MainWindow(Gtk.ApplicationWindow):
 
         if next_page is not None:
             # self.logo.hide()
-            if next_page not in self.pages.keys():
-                # Load all pages
-                self.load_pages()
-                self.progressbar_step = 1.0 / (len(self.pages) - 2)
-
             stored = self.current_page.store_values()
 
             if stored:
@@ -479,6 +541,7 @@ class MainWindow(Gtk.ApplicationWindow):
                 if self.current_page is not None:
                     self.current_page.prepare('forwards')
                     self.main_box.add(self.current_page)
+                    self.prebuild_next_page()
                     if self.current_page.get_prev_page() is not None:
                         # There is a previous page, show back button
                         self.backwards_button.show()
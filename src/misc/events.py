@@ -28,10 +28,107 @@
 
 """ Events module, used to store events in log and show them to the user """
 
+import collections
 import inspect
+import os
 import queue
 import logging
 import sys
+import threading
+import time
+
+
+class EventChannel():
+    """ Sends events to the callback queue (read by the GUI).
+        High frequency events (progress bars) are coalesced: only their
+        latest value is sent once every tick window. All other events
+        (info, error, finished...) are never dropped and keep their order.
+        When several events are sent at once they are put in the queue as
+        a single ('batch', [events]) item. """
+
+    # Time (in seconds) high frequency events are hold before being sent
+    TICK_WINDOW = 0.25
+
+    HIGH_FREQUENCY_EVENTS = [
+        'percent', 'downloads_percent', 'download_progress', 'progress_bar_show_text']
+
+    def __init__(self, callback_queue):
+        self.queue = callback_queue
+        self.lock = threading.RLock()
+        self.pending = collections.OrderedDict()
+        self.timer = None
+        # Counts how many events of each type have been added
+        self.counters = collections.Counter()
+        self.start_time = time.monotonic()
+
+    def put(self, event_type, event_text):
+        """ Sends (or holds, if it is a high frequency one) an event """
+        with self.lock:
+            self.counters[event_type] += 1
+            if event_type in EventChannel.HIGH_FREQUENCY_EVENTS:
+                # Only keep the latest value
+                self.pending.pop(event_type, None)
+                self.pending[event_type] = event_text
+                if self.timer is None:
+                    self.timer = threading.Timer(EventChannel.TICK_WINDOW, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+            else:
+                # Send held events first, so order is kept
+                batch = self.take_pending()
+                batch.append((event_type, event_text))
+                self.send(batch)
+
+    def flush(self):
+        """ Sends all held events """
+        with self.lock:
+            self.send(self.take_pending())
+
+    def take_pending(self):
+        """ Returns held events (and forgets them) """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch = list(self.pending.items())
+        self.pending.clear()
+        return batch
+
+    def send(self, batch):
+        """ Puts a list of events in the callback queue """
+        if not batch:
+            return
+        if len(batch) == 1:
+            item = batch[0]
+        else:
+            item = ('batch', batch)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            logging.warning("Callback queue is full")
+
+    def get_rates(self):
+        """ Returns how many events per second of each type have been added """
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        with self.lock:
+            return {event_type: count / elapsed
+                    for event_type, count in self.counters.items()}
+
+
+# One channel per process and queue
+_CHANNELS = {}
+_CHANNELS_LOCK = threading.Lock()
+
+
+def get_channel(callback_queue):
+    """ Returns the event channel of this process for callback_queue """
+    key = (os.getpid(), id(callback_queue))
+    with _CHANNELS_LOCK:
+        channel = _CHANNELS.get(key)
+        if channel is None or channel.queue is not callback_queue:
+            channel = EventChannel(callback_queue)
+            _CHANNELS[key] = channel
+        return channel
+
 
 class Events():
     """ Class that will store events, log them and show them to the user """
@@ -75,10 +172,27 @@ class Events():
             else:
                 logging.debug(event_text)
         else:
-            try:
-                self.queue.put_nowait((event_type, event_text))
-            except queue.Full:
-                logging.warning("Callback queue is full")
+            channel = get_channel(self.queue)
+            channel.put(event_type, event_text)
+            if event_type in ['finished', 'error']:
+                logging.debug("Events sent per second: %s", self.get_rates())
+
+    def forget(self, event_type):
+        """ Forgets the last event_type event, so the next one is sent
+            even if it is the same """
+        self.last_event.pop(event_type, None)
+
+    def flush(self):
+        """ Sends any held (coalesced) event now """
+        if self.queue is not None:
+            get_channel(self.queue).flush()
+
+    def get_rates(self):
+        """ Returns events per second of each type sent to our queue """
+        if self.queue is None:
+            return {}
+        rates = get_channel(self.queue).get_rates()
+        return {event_type: round(rate, 2) for event_type, rate in rates.items()}
 
     def add_fatal(self, event_text=""):
         """ Adds an error event to Cnchi event queue and quits """
@@ -35,6 +35,8 @@ from socket import timeout
 import string
 import subprocess
 import syslog
+import threading
+import time
 import urllib
 import ssl
 import dbus
@@ -43,6 +45,10 @@ import dbus
 NM = 'org.freedesktop.NetworkManager'
 NM_STATE_CONNECTED_GLOBAL = 70
 
+# Seconds a connection check result is trusted
+CONNECTED_TTL = 120
+DISCONNECTED_TTL = 10
+
 _DROPPED_PRIVILEGES = 0
 
 
@@ -414,8 +420,8 @@ def get_nm_state():
     return state
 
 
-def has_connection():
-    """ Checks if we have an Internet connection """
+def probe_connection():
+    """ Checks if we have an Internet connection (connecting to our servers) """
     # The ips are reversed (to avoid spam)
     urls = [
         ('http', '20.13.206.130'),
@@ -454,6 +460,147 @@ def has_connection():
     return False
 
 
+class ConnectionMonitor():
+    """ Caches the connection status. It is checked again when it is too
+        old or when NetworkManager tells us it has changed """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.connected = None
+        self.checked = 0
+        self.probing = False
+        # Increased each time a check finishes
+        self.generation = 0
+        self.listeners = []
+        self.watching = False
+
+    def is_fresh(self):
+        """ True if the last check result can still be used """
+        if self.connected is None:
+            return False
+        ttl = CONNECTED_TTL if self.connected else DISCONNECTED_TTL
+        return time.monotonic() - self.checked < ttl
+
+    def is_connected(self):
+        """ Returns the connection status, checking it only if our cached
+            result is too old. If another thread is checking it, waits
+            for its result """
+        with self.condition:
+            while not self.is_fresh():
+                if not self.probing:
+                    self.probing = True
+                    break
+                self.condition.wait()
+            else:
+                return self.connected
+        return self.probe()
+
+    def probe(self):
+        """ Checks the connection and wakes up all waiters """
+        connected = False
+        try:
+            connected = probe_connection()
+        finally:
+            with self.condition:
+                self.connected = connected
+                self.checked = time.monotonic()
+                self.probing = False
+                self.generation += 1
+                self.condition.notify_all()
+        return connected
+
+    def get_status(self):
+        """ Returns the last known status (None if it is unknown).
+            Never blocks nor checks the connection """
+        with self.condition:
+            return self.connected
+
+    def invalidate(self):
+        """ Forgets the cached status """
+        with self.condition:
+            self.connected = None
+
+    def wait_for_connection(self, timeout=None):
+        """ Blocks until there is an Internet connection (or timeout seconds
+            have passed). Returns True if we're connected """
+        if timeout is not None:
+            timeout += time.monotonic()
+        warned = False
+        while not self.is_connected():
+            if not warned:
+                logging.warning(
+                    "Can't get network status. Cnchi will try again in a moment")
+                warned = True
+            with self.condition:
+                # Woken up by NetworkManager changes or when our result expires
+                wait = DISCONNECTED_TTL
+                if timeout is not None:
+                    wait = min(wait, timeout - time.monotonic())
+                    if wait <= 0:
+                        return False
+                generation = self.generation
+                self.condition.wait_for(
+                    lambda: self.generation != generation or self.connected is None,
+                    wait)
+        logging.debug("A working network connection has been detected.")
+        return True
+
+    def watch(self):
+        """ Listens to NetworkManager StateChanged signals (they are only
+            received in a process with a running GLib main loop) """
+        if self.watching:
+            return
+        try:
+            from dbus.mainloop.glib import DBusGMainLoop
+            bus = dbus.SystemBus(private=True, mainloop=DBusGMainLoop())
+            bus.add_signal_receiver(self.on_state_changed, 'StateChanged', NM, NM)
+            self.watching = True
+        except (ImportError, dbus.DBusException) as err:
+            logging.warning("Can't watch NetworkManager state: %s", err)
+
+    def on_state_changed(self, state):
+        """ NetworkManager state has changed """
+        with self.condition:
+            if state == NM_STATE_CONNECTED_GLOBAL:
+                # Check it again the next time we're asked
+                self.connected = None
+            else:
+                self.connected = False
+                self.checked = time.monotonic()
+            self.generation += 1
+            self.condition.notify_all()
+            listeners = list(self.listeners)
+        for func in listeners:
+            func(state == NM_STATE_CONNECTED_GLOBAL)
+
+
+_CONNECTION_MONITOR = None
+_CONNECTION_MONITOR_LOCK = threading.Lock()
+_CONNECTION_MONITOR_PID = None
+
+
+def get_connection_monitor():
+    """ Returns this process connection monitor """
+    global _CONNECTION_MONITOR, _CONNECTION_MONITOR_PID
+    with _CONNECTION_MONITOR_LOCK:
+        if _CONNECTION_MONITOR is None or _CONNECTION_MONITOR_PID != os.getpid():
+            # Do not inherit a (maybe locked) monitor from our parent
+            _CONNECTION_MONITOR = ConnectionMonitor()
+            _CONNECTION_MONITOR_PID = os.getpid()
+            _CONNECTION_MONITOR.watch()
+        return _CONNECTION_MONITOR
+
+
+def has_connection():
+    """ Checks if we have an Internet connection """
+    return get_connection_monitor().is_connected()
+
+
+def wait_for_connection(timeout=None):
+    """ Waits until there is an Internet connection available """
+    return get_connection_monitor().wait_for_connection(timeout)
+
+
 def inside_hypervisor():
     """ Checks if running inside an hypervisor (VM) """
 
@@ -471,12 +618,9 @@ def inside_hypervisor():
 
 def add_connection_watch(func):
     """ Add connection watch to Networkmanager """
-    def connection_cb(state):
-        """ Callback function that will be called if something changes """
-        func(state == NM_STATE_CONNECTED_GLOBAL)
-
-    bus = dbus.SystemBus()
-    bus.add_signal_receiver(connection_cb, 'StateChanged', NM, NM)
+    monitor = get_connection_monitor()
+    with monitor.condition:
+        monitor.listeners.append(func)
     try:
         func(has_connection())
     except (dbus.DBusException, dbus.exceptions.DBusException) as err:
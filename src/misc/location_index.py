@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# location_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Nearest location queries for the timezone map. Locations are put in a
+    grid of cells, so only the cells around a point have to be checked """
+
+import math
+
+
+class LocationIndex():
+    """ Uniform grid of projected locations for nearest location queries """
+
+    CELL_SIZE = 16
+
+    def __init__(self, points):
+        """ points is a list of (x, y, location) """
+        # (column, row) -> list of (order, x, y, location)
+        self.cells = {}
+        self.columns = 0
+        self.rows = 0
+        for order, (point_x, point_y, location) in enumerate(points):
+            column, row = self.get_cell(point_x, point_y)
+            self.cells.setdefault((column, row), []).append(
+                (order, point_x, point_y, location))
+            self.columns = max(self.columns, column + 1)
+            self.rows = max(self.rows, row + 1)
+        self.min_column = min([cell[0] for cell in self.cells], default=0)
+        self.min_row = min([cell[1] for cell in self.cells], default=0)
+
+    def get_cell(self, point_x, point_y):
+        """ Returns the grid cell of a point """
+        return (int(math.floor(point_x / LocationIndex.CELL_SIZE)),
+                int(math.floor(point_y / LocationIndex.CELL_SIZE)))
+
+    def get_nearest(self, my_x, my_y):
+        """ Returns the location nearest to (my_x, my_y) or None.
+            On ties, the first location (as given) wins """
+        if not self.cells:
+            return None
+
+        column, row = self.get_cell(my_x, my_y)
+        max_ring = max(
+            column - self.min_column, self.columns - 1 - column,
+            row - self.min_row, self.rows - 1 - row)
+
+        nearest = None
+        ring = 0
+        while ring <= max_ring:
+            for cell in self.get_ring(column, row, ring):
+                for order, point_x, point_y, location in self.cells.get(cell, []):
+                    diff_x = point_x - my_x
+                    diff_y = point_y - my_y
+                    candidate = (diff_x * diff_x + diff_y * diff_y, order, location)
+                    if nearest is None or candidate[:2] < nearest[:2]:
+                        nearest = candidate
+            # Points in the next ring are at least ring * CELL_SIZE away
+            limit = ring * LocationIndex.CELL_SIZE
+            if nearest is not None and nearest[0] < limit * limit:
+                break
+            ring += 1
+
+        if nearest is None:
+            return None
+        return nearest[2]
+
+    @staticmethod
+    def get_ring(column, row, ring):
+        """ Yields the cells at distance ring (square ring) of a cell """
+        if ring == 0:
+            yield (column, row)
+            return
+        for delta in range(-ring, ring + 1):
+            yield (column + delta, row - ring)
+            yield (column + delta, row + ring)
+        for delta in range(-ring + 1, ring):
+            yield (column - ring, row + delta)
+            yield (column + ring, row + delta)
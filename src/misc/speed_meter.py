@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# speed_meter.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Download speed meter. Measures bandwidth and estimates remaining time """
+
+import collections
+import threading
+import time
+
+# When testing, no _() is available
+try:
+    _("")
+except NameError as err:
+    def _(message):
+        return message
+
+# Numeric download progress info
+# done and total are bytes, fraction is 0..1, bps is bytes per second and
+# eta are seconds (None if unknown)
+Progress = collections.namedtuple('Progress', ['done', 'total', 'fraction', 'bps', 'eta'])
+
+
+class SpeedMeter():
+    """ Keeps track of how many bytes have been downloaded from a set of
+        files. Bandwidth is an exponentially weighted moving average (EWMA).
+        Progress is only reported at most max_updates times per second, so
+        callers can call add() or update() for every chunk they get """
+
+    # Maximum number of progress reports per second
+    MAX_UPDATES = 4
+
+    # Weight of the last measure in the EWMA bandwidth
+    ALPHA = 0.3
+
+    def __init__(self, total=0, max_updates=MAX_UPDATES, alpha=ALPHA):
+        self.total = total
+        self.done = 0
+        self.bps = 0.0
+        self.alpha = alpha
+        self.interval = 1.0 / max_updates
+        self.lock = threading.Lock()
+
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.last_done = 0
+
+    def set_total(self, total):
+        """ Sets total bytes to download """
+        with self.lock:
+            self.total = max(total, 0)
+
+    def add_total(self, nbytes):
+        """ Adds (or removes, if nbytes is negative) bytes to the total """
+        with self.lock:
+            self.total = max(self.total + nbytes, 0)
+
+    def add(self, nbytes):
+        """ Adds downloaded bytes. Returns a Progress if it is time to
+            report progress, None otherwise """
+        with self.lock:
+            self.done += nbytes
+            return self._report()
+
+    def update(self, done):
+        """ Sets total downloaded bytes. Returns a Progress if it is time to
+            report progress, None otherwise """
+        with self.lock:
+            self.done = done
+            return self._report()
+
+    def _report(self):
+        """ Updates bandwidth and returns progress if enough time has
+            passed since the last report """
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        if elapsed < self.interval:
+            return None
+
+        sample = max(self.done - self.last_done, 0) / elapsed
+        if self.last_done == 0 and self.bps == 0:
+            self.bps = sample
+        else:
+            self.bps = self.alpha * sample + (1 - self.alpha) * self.bps
+        self.last_time = now
+        self.last_done = self.done
+        return self._get_progress()
+
+    def get_progress(self):
+        """ Returns current progress (without waiting for the next report) """
+        with self.lock:
+            return self._get_progress()
+
+    def _get_progress(self):
+        """ Builds a Progress tuple """
+        fraction = 0.0
+        eta = None
+        if self.total > 0:
+            fraction = min(self.done / self.total, 1.0)
+            if self.bps > 0:
+                eta = max(self.total - self.done, 0) / self.bps
+        return Progress(self.done, self.total, fraction, self.bps, eta)
+
+
+def format_speed(bps):
+    """ Formats speed (bytes per second) """
+    # 1024 * 1024 = 1048576
+    if bps >= 1048576:
+        return "{0:.2f} MiB/s".format(bps / 1048576)
+    if bps >= 1024:
+        return "{0:.2f} KiB/s".format(bps / 1024)
+    return "{0:.2f} B/s".format(bps)
+
+
+def format_progress(progress):
+    """ Formats a Progress (or a tuple with the same fields) to be shown
+        to the user """
+    progress = Progress(*progress)
+    msg = "{0}%   {1}".format(int(progress.fraction * 100), format_speed(progress.bps))
+    if progress.eta is not None:
+        minutes, seconds = divmod(int(progress.eta), 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours:
+            eta = "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
+        else:
+            eta = "{0}:{1:02d}".format(minutes, seconds)
+        msg += "   " + _("{0} left").format(eta)
+    return msg
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  alpm_hooks.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Runs alpm (libalpm) post transaction hooks once for several transactions.
+    The install pipeline installs packages in batches with hooks disabled,
+    so they can be run only once, when all packages have been installed """
+
+from collections import OrderedDict
+import fnmatch
+import logging
+import os
+import shlex
+import subprocess
+
+import pyalpm
+
+# Operations a trigger can be interested in
+INSTALL = 'Install'
+UPGRADE = 'Upgrade'
+REMOVE = 'Remove'
+
+
+class Hook():
+    """ An alpm hook (read from a .hook file) """
+
+    def __init__(self, name):
+        self.name = name
+        # List of triggers (dicts with type, operations and targets)
+        self.triggers = []
+        self.when = None
+        self.exec_cmd = None
+        self.depends = []
+        self.needs_targets = False
+
+    @staticmethod
+    def load(path):
+        """ Reads a hook file. Returns a Hook or None if it is not valid """
+        hook = Hook(os.path.basename(path))
+        section = None
+        with open(path, 'r', errors='replace') as hook_file:
+            for line in hook_file:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('[') and line.endswith(']'):
+                    section = line[1:-1]
+                    if section == 'Trigger':
+                        hook.triggers.append(
+                            {'type': None, 'operations': set(), 'targets': []})
+                    continue
+                key, _sep, value = line.partition('=')
+                key = key.strip()
+                value = value.strip()
+                if section == 'Trigger' and hook.triggers:
+                    trigger = hook.triggers[-1]
+                    if key == 'Type':
+                        # File is the old name of Path
+                        trigger['type'] = 'Path' if value == 'File' else value
+                    elif key == 'Operation':
+                        trigger['operations'].add(value)
+                    elif key == 'Target':
+                        trigger['targets'].append(value)
+                elif section == 'Action':
+                    if key == 'When':
+                        hook.when = value
+                    elif key == 'Exec':
+                        hook.exec_cmd = value
+                    elif key == 'Depends':
+                        hook.depends.append(value)
+                    elif key == 'NeedsTargets':
+                        hook.needs_targets = True
+
+        if not hook.triggers or not hook.exec_cmd or not hook.when:
+            logging.warning("Invalid alpm hook %s", path)
+            return None
+        return hook
+
+    def get_matches(self, pkg_ops, pkg_files):
+        """ Returns the (sorted) targets that trigger this hook.
+            pkg_ops is a dict package name -> operation and pkg_files a
+            dict package name -> list of its files """
+        matches = set()
+        for trigger in self.triggers:
+            for name, operation in pkg_ops.items():
+                if operation not in trigger['operations']:
+                    continue
+                if trigger['type'] == 'Package':
+                    if match_patterns(name, trigger['targets']):
+                        matches.add(name)
+                elif trigger['type'] == 'Path':
+                    for path in pkg_files.get(name, []):
+                        if match_patterns(path, trigger['targets']):
+                            matches.add(path)
+        return sorted(matches)
+
+
+def match_patterns(name, patterns):
+    """ Checks name against glob patterns like alpm does: the last matching
+        pattern wins and patterns starting with ! exclude names """
+    for pattern in reversed(patterns):
+        negated = pattern.startswith('!')
+        if fnmatch.fnmatchcase(name, pattern.lstrip('!')):
+            return not negated
+    return False
+
+
+def load_hooks(hookdirs):
+    """ Returns all valid hooks sorted by name. A hook in a directory
+        overrides the ones with the same name in previous directories """
+    paths = {}
+    for hookdir in hookdirs:
+        try:
+            names = os.listdir(hookdir)
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith('.hook'):
+                paths[name] = os.path.join(hookdir, name)
+
+    hooks = []
+    for name in sorted(paths):
+        try:
+            hook = Hook.load(paths[name])
+        except OSError as err:
+            logging.warning("Can't read alpm hook %s: %s", paths[name], err)
+            continue
+        if hook is not None:
+            hooks.append(hook)
+    return hooks
+
+
+def run_hook(hook, root_dir, targets):
+    """ Runs hook's command (inside root_dir). Returns True if it succeeds """
+    cmd = shlex.split(hook.exec_cmd)
+    if os.path.realpath(root_dir) != '/':
+        cmd = ['chroot', root_dir] + cmd
+    stdin_data = None
+    if hook.needs_targets:
+        stdin_data = ''.join(target + '\n' for target in targets).encode()
+    try:
+        proc = subprocess.run(
+            cmd, input=stdin_data, cwd='/', stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+    except OSError as err:
+        logging.error("Can't run alpm hook %s: %s", hook.name, err)
+        return False
+    output = proc.stdout.decode(errors='replace').strip()
+    if output:
+        logging.debug(output)
+    if proc.returncode != 0:
+        logging.error("alpm hook %s failed (exit code %d)", hook.name, proc.returncode)
+        return False
+    return True
+
+
+def run_post_transaction_hooks(handle, hookdirs, pkg_ops):
+    """ Runs the post transaction hooks in hookdirs triggered by the
+        installed packages in pkg_ops (dict package name -> operation).
+        Returns False if any of them fails """
+    localdb = handle.get_localdb()
+    local_pkgs = localdb.pkgcache
+    pkg_files = OrderedDict()
+    for name in pkg_ops:
+        pkg = localdb.get_pkg(name)
+        if pkg is not None:
+            pkg_files[name] = [path for path, _size, _mode in pkg.files]
+
+    result = True
+    for hook in load_hooks(hookdirs):
+        if hook.when != 'PostTransaction':
+            continue
+        targets = hook.get_matches(pkg_ops, pkg_files)
+        if not targets:
+            continue
+        missing = [dep for dep in hook.depends
+                   if pyalpm.find_satisfier(local_pkgs, dep) is None]
+        if missing:
+            logging.error(
+                "Can't run alpm hook %s, missing dependencies: %s",
+                hook.name, ' '.join(missing))
+            result = False
+            continue
+        logging.debug("Running alpm hook %s", hook.name)
+        if not run_hook(hook, handle.root, targets):
+            result = False
+    return result
@@ -31,16 +31,18 @@
 
 """ Module interface to pyalpm """
 
-from collections import OrderedDict
-
 import logging
 import os
 import sys
+import time
 
 from misc.events import Events
+import misc.speed_meter as speed_meter
+from logging_utils import QueueLogHandler, get_subsystem_level
 
 import pacman.alpm_include as _alpm
 import pacman.pkginfo as pkginfo
+import pacman.pkg_index as pkg_index
 import pacman.pacman_conf as config
 
 try:
@@ -79,8 +81,12 @@ class Pac():
         self.last_target = ""
         self.last_percent = 0
         self.already_transferred = 0
+        # Last file whose download has been counted as finished
+        self.last_downloaded = None
         # Store package total download size
         self.total_size = 0
+        # Measures download speed (used in cb_dl)
+        self.speed_meter = speed_meter.SpeedMeter()
         # Store last action
         self.last_action = ""
 
@@ -90,6 +96,9 @@ class Pac():
 
         self.last_event = {}
 
+        # Sync packages lookup tables (see get_index)
+        self.pkg_index = None
+
         if not os.path.exists(conf_path):
             raise pyalpm.error
 
@@ -157,10 +166,23 @@ class Pac():
 
     def release(self):
         """ Release alpm handle """
+        self.pkg_index = None
         if self.handle is not None:
             del self.handle
             self.handle = None
 
+    def get_index(self):
+        """ Returns name, group and provides lookup tables of the sync
+            databases (they are built only once) """
+        if self.pkg_index is None:
+            self.pkg_index = pkg_index.PackageIndex(self.handle.get_syncdbs())
+        return self.pkg_index
+
+    def get_local_index(self):
+        """ Returns lookup tables of the local database (installed packages
+            change, so they are built each time) """
+        return pkg_index.PackageIndex([self.handle.get_localdb()])
+
     @staticmethod
     def finalize_transaction(transaction):
         """ Commit a transaction """
@@ -232,13 +254,43 @@ class Pac():
 
         return self.finalize_transaction(transaction)
 
-    def refresh(self):
-        """ Sync databases like pacman -Sy """
+    def get_databases_age(self):
+        """ Returns seconds since the oldest sync database was downloaded
+            (None if any of them is missing) """
+        sync_dir = os.path.join(self.config.options["DBPath"], 'sync')
+        oldest = None
+        for database in self.handle.get_syncdbs():
+            path = os.path.join(sync_dir, database.name + '.db')
+            try:
+                # alpm sets mtime to the server's one, ctime is when we got it
+                fetched = os.stat(path).st_ctime
+            except OSError:
+                return None
+            if oldest is None or fetched < oldest:
+                oldest = fetched
+        if oldest is None:
+            return None
+        return time.time() - oldest
+
+    def refresh(self, force=True, max_age=None):
+        """ Sync databases like pacman -Sy (or -Syy if force is True)
+            If max_age (seconds) is given, databases downloaded less than
+            max_age seconds ago are not checked again """
         if self.handle is None:
             logging.error("alpm is not initialised")
             raise pyalpm.error
 
-        force = True
+        if max_age is not None:
+            age = self.get_databases_age()
+            if age is not None and age < max_age:
+                logging.debug(
+                    "Pacman databases were downloaded %d seconds ago, no need to refresh them",
+                    age)
+                return True
+
+        # Databases may change, lookup tables will have to be built again
+        self.pkg_index = None
+
         res = True
         for database in self.handle.get_syncdbs():
             transaction = self.init_transaction()
@@ -249,12 +301,39 @@ class Pac():
                 res = False
         return res
 
+    def resolve(self, pkgs, conflicts=None):
+        """ Resolves a list of package (or group) names in one pass.
+            Returns a pkg_index.Resolution """
+        index = self.get_index()
+
+        # Packages from these groups should be sourced from the antergos repo only.
+        one_repo_groups_names = ['cinnamon', 'mate', 'mate-extra']
+        one_repo_pkgs = index.get_group_pkg_names('antergos', one_repo_groups_names)
+
+        resolution = index.resolve(pkgs, conflicts, one_repo_pkgs, 'antergos')
+
+        if resolution.not_found:
+            # As we don't know if this error is fatal or not, we'll register
+            # it and we'll allow to continue.
+            logging.error(
+                "Can't find a package or group called: %s",
+                ' '.join(resolution.not_found))
+
+        if resolution.conflicts:
+            logging.debug(
+                "These packages will not be installed (conflicts): %s",
+                ' '.join(resolution.conflicts))
+
+        return resolution
+
+    def resolve_targets(self, pkgs, conflicts=None):
+        """ Resolves a list of package (or group) names to the list of
+            package names that have to be installed """
+        return list(self.resolve(pkgs, conflicts).pkgs)
+
     def install(self, pkgs, conflicts=None, options=None):
         """ Install a list of packages like pacman -S """
 
-        if not conflicts:
-            conflicts = []
-
         if not options:
             options = {}
 
@@ -266,69 +345,8 @@ class Pac():
             logging.error("Package list is empty")
             raise pyalpm.error
 
-        # Discard duplicates
-        pkgs = list(set(pkgs))
-
-        # `alpm.handle.get_syncdbs()` returns a list (the order is important) so we
-        # have to ensure we don't clobber the priority of the repos.
-        repos = OrderedDict()
-        repo_order = []
-        db_match = [db for db in self.handle.get_syncdbs()
-                    if db.name == 'antergos']
-        antdb = OrderedDict()
-        antdb['antergos'] = db_match[0]
-
-        one_repo_groups_names = ['cinnamon', 'mate', 'mate-extra']
-        one_repo_groups = []
-        for one_repo_group_name in one_repo_groups_names:
-            grp = antdb['antergos'].read_grp(one_repo_group_name)
-            if not grp:
-                # Group does not exist
-                grp = ['None', []]
-            one_repo_groups.append(grp)
-
-        one_repo_pkgs = {pkg for one_repo_group in one_repo_groups
-                         for pkg in one_repo_group[1] if one_repo_group}
-
-        for syncdb in self.handle.get_syncdbs():
-            repo_order.append(syncdb)
-            repos[syncdb.name] = syncdb
-
-        targets = []
-        for name in pkgs:
-            _repos = repos
-
-            if name in one_repo_pkgs:
-                # pkg should be sourced from the antergos repo only.
-                _repos = antdb
-
-            result_ok, pkg = self.find_sync_package(name, _repos)
-
-            if result_ok:
-                # Check that added package is not in our conflicts list
-                if pkg.name not in conflicts:
-                    targets.append(pkg.name)
-            else:
-                # Couldn't find the package, check if it's a group
-                group_pkgs = self.get_group_pkgs(name)
-                if group_pkgs is not None:
-                    # It's a group
-                    for group_pkg in group_pkgs:
-                        # Check that added package is not in our conflicts list
-                        # Ex: connman conflicts with netctl(openresolv),
-                        # which is installed by default with base group
-                        if group_pkg.name not in conflicts:
-                            targets.append(group_pkg.name)
-                else:
-                    # No, it wasn't neither a package nor a group. As we don't
-                    # know if this error is fatal or not, we'll register it and
-                    # we'll allow to continue.
-                    logging.error(
-                        "Can't find a package or group called '%s'", name)
-
-        # Discard duplicates
-        targets = list(set(targets))
-        logging.debug(targets)
+        targets = self.resolve(pkgs, conflicts).pkgs
+        logging.debug(list(targets))
 
         if not targets:
             logging.error("No targets found")
@@ -347,15 +365,45 @@ class Pac():
             logging.error("Can't initialize alpm transaction")
             return False
 
-        for _index in range(0, num_targets):
-            result_ok, pkg = self.find_sync_package(targets.pop(), repos)
-            if result_ok:
-                transaction.add_pkg(pkg)
-            else:
-                logging.warning(pkg)
+        for pkg in targets.values():
+            transaction.add_pkg(pkg)
 
         return self.finalize_transaction(transaction)
 
+    def install_pkgs(self, pkgs, options=None):
+        """ Install a list of (already resolved) sync packages """
+
+        if self.handle is None:
+            logging.error("alpm is not initialised")
+            raise pyalpm.error
+
+        if not pkgs:
+            logging.error("Package list is empty")
+            raise pyalpm.error
+
+        transaction = self.init_transaction(options)
+
+        if transaction is None:
+            logging.error("Can't initialize alpm transaction")
+            return False
+
+        for pkg in pkgs:
+            transaction.add_pkg(pkg)
+
+        return self.finalize_transaction(transaction)
+
+    def set_pkgs_reason(self, pkg_names, reason):
+        """ Sets install reason (explicit or dependency) of installed packages """
+        database = self.handle.get_localdb()
+        for pkg_name in pkg_names:
+            pkg = database.get_pkg(pkg_name)
+            if pkg is None:
+                continue
+            try:
+                self.handle.set_pkgreason(pkg, reason)
+            except (AttributeError, pyalpm.error) as err:
+                logging.warning("Can't set install reason of %s: %s", pkg_name, err)
+
     def upgrade(self, pkgs, conflicts=None, options=None):
         """ Install a list package tarballs like pacman -U """
 
@@ -392,25 +440,18 @@ class Pac():
 
         return self.finalize_transaction(transaction)
 
-    @staticmethod
-    def find_sync_package(pkgname, syncdbs):
-        """ Finds a package name in a list of DBs
+    def find_sync_package(self, pkgname):
+        """ Finds a package name in the sync DBs
         :rtype : tuple (True/False, package or error message)
         """
-        for database in syncdbs.values():
-            pkg = database.get_pkg(pkgname)
-            if pkg is not None:
-                return True, pkg
+        pkg = self.get_index().get_pkg(pkgname)
+        if pkg is not None:
+            return True, pkg
         return False, "Package '{0}' was not found.".format(pkgname)
 
     def get_group_pkgs(self, group):
         """ Get group's packages """
-        for repo in self.handle.get_syncdbs():
-            grp = repo.read_grp(group)
-            if grp is not None:
-                _name, pkgs = grp
-                return pkgs
-        return None
+        return self.get_index().get_group(group)
 
     def get_packages_info(self, pkg_names=None):
         """ Get information about packages like pacman -Si """
@@ -426,10 +467,8 @@ class Pac():
                         level=2,
                         style='sync')
         else:
-            repos = OrderedDict((database.name, database)
-                                for database in self.handle.get_syncdbs())
             for pkg_name in pkg_names:
-                result_ok, pkg = self.find_sync_package(pkg_name, repos)
+                result_ok, pkg = self.find_sync_package(pkg_name)
                 if result_ok:
                     packages_info[pkg_name] = pkginfo.get_pkginfo(
                         pkg,
@@ -442,9 +481,7 @@ class Pac():
 
     def get_package_info(self, pkg_name):
         """ Get information about packages like pacman -Si """
-        repos = OrderedDict((database.name, database)
-                            for database in self.handle.get_syncdbs())
-        result_ok, pkg = self.find_sync_package(pkg_name, repos)
+        result_ok, pkg = self.find_sync_package(pkg_name)
         if result_ok:
             info = pkginfo.get_pkginfo(pkg, level=2, style='sync')
         else:
@@ -477,6 +514,7 @@ class Pac():
         elif event == _alpm.ALPM_EVENT_INTEGRITY_START:
             action = _('Checking integrity...')
             self.already_transferred = 0
+            self.last_downloaded = None
         elif event == _alpm.ALPM_EVENT_LOAD_START:
             action = _('Loading packages files...')
         elif event == _alpm.ALPM_EVENT_DELTA_INTEGRITY_START:
@@ -544,6 +582,7 @@ class Pac():
     def cb_totaldl(self, total_size):
         """ Stores total download size for use in cb_dl and cb_progress """
         self.total_size = total_size
+        self.speed_meter = speed_meter.SpeedMeter(total=total_size)
 
     def cb_dl(self, filename, transferred, total):
         """ Shows downloading progress """
@@ -553,24 +592,38 @@ class Pac():
             action = _("Downloading {}...").format(filename.replace('.pkg.tar.xz', ''))
 
         # target = self.last_target
-        percent = self.last_percent
-
-        if self.total_size > 0:
-            percent = round((transferred + self.already_transferred) / self.total_size, 2)
-        elif total > 0:
-            percent = round(transferred / total, 2)
-
         if action != self.last_action:
             self.last_action = action
             self.events.add('info', action)
 
-        if percent != self.last_percent:
-            self.last_percent = percent
-            self.events.add('percent', percent)
-        elif transferred == total:
+        # libalpm may call us several times when a download ends (and
+        # with 0/0 before it starts), count each file only once
+        counted = filename == self.last_downloaded
+        if self.total_size > 0:
+            done = self.already_transferred
+            if not counted:
+                done += transferred
+            total_size = self.total_size
+        else:
+            done = transferred
+            total_size = total
+
+        if total > 0 and transferred == total and not counted:
+            self.last_downloaded = filename
             self.already_transferred += total
             self.downloaded_packages += 1
 
+        # Only show progress a few times per second
+        if self.speed_meter.total != total_size:
+            self.speed_meter.set_total(total_size)
+        progress = self.speed_meter.update(done)
+        if progress is not None:
+            percent = round(progress.fraction, 2)
+            if percent != self.last_percent:
+                self.last_percent = percent
+                self.events.add('percent', percent)
+            self.events.add('download_progress', tuple(progress))
+
     def is_package_installed(self, package_name):
         """ Check if package is already installed """
         database = self.handle.get_localdb()
@@ -584,7 +637,8 @@ class Pac():
         """ Configure our logger """
         self.logger = logging.getLogger(__name__)
 
-        self.logger.setLevel(logging.DEBUG)
+        # Everything is logged unless an alpm log level has been set
+        self.logger.setLevel(get_subsystem_level('alpm', logging.DEBUG))
 
         self.logger.propagate = False
 
@@ -599,7 +653,8 @@ class Pac():
                 file_handler = logging.FileHandler(log_path, mode='w')
                 file_handler.setLevel(logging.DEBUG)
                 file_handler.setFormatter(formatter)
-                self.logger.addHandler(file_handler)
+                # alpm logs a lot, do not make it wait for the disk
+                self.logger.addHandler(QueueLogHandler([file_handler]))
             except PermissionError as permission_error:
                 print("Can't open ", log_path, " : ", permission_error)
 
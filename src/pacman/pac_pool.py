@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  pac_pool.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Process wide pool of alpm handles. Creating a Pac object parses
+    pacman.conf and registers all sync databases, so we create only one for
+    each pacman.conf and root dir and share it """
+
+import contextlib
+import logging
+import os
+import threading
+
+from misc.events import Events
+import pacman.pac as pac
+import pacman.pacman_conf as config
+
+# Sync databases downloaded less than REFRESH_MAX_AGE seconds ago are not
+# downloaded again
+REFRESH_MAX_AGE = 10 * 60
+
+_LOCK = threading.Lock()
+_ENTRIES = {}
+_PID = None
+
+# Entries replaced because their pacman.conf changed. Their handles may
+# still be in use (get_pac() does not lock them), so they are only released
+# by release() and release_all()
+_RETIRED = []
+
+# (pacman.conf path, mtime) -> pool key (so pacman.conf is not parsed again)
+_KEYS = {}
+
+
+class PoolEntry():
+    """ A shared Pac object """
+
+    def __init__(self, key, pacman, conf_mtime):
+        self.key = key
+        self.pacman = pacman
+        self.conf_mtime = conf_mtime
+        # Serializes the use of the handle between users
+        self.lock = threading.RLock()
+
+
+def get_key(conf_path):
+    """ Returns the pool key (pacman.conf path and root dir) of conf_path """
+    conf_path = os.path.realpath(conf_path)
+    try:
+        conf_mtime = os.stat(conf_path).st_mtime_ns
+    except OSError:
+        conf_mtime = None
+    key = _KEYS.get((conf_path, conf_mtime))
+    if key is None:
+        root_dir = config.PacmanConfig(conf_path).options.get("RootDir", "/")
+        key = (conf_path, os.path.realpath(root_dir))
+        _KEYS[(conf_path, conf_mtime)] = key
+    return key
+
+
+def _get_entry(conf_path, callback_queue):
+    """ Returns the pool entry for conf_path, creating it if needed.
+        Raises pyalpm.error if the handle can't be created """
+    global _PID
+
+    if not os.path.exists(conf_path):
+        raise pac.pyalpm.error
+
+    conf_mtime = os.stat(conf_path).st_mtime_ns
+    key = get_key(conf_path)
+
+    with _LOCK:
+        if _PID != os.getpid():
+            # alpm handles can't be shared with a forked process
+            _ENTRIES.clear()
+            del _RETIRED[:]
+            _PID = os.getpid()
+
+        entry = _ENTRIES.get(key)
+        if entry is not None and entry.conf_mtime != conf_mtime:
+            # pacman.conf has changed, we need a new handle. The old one
+            # may still be in use, so it is not released now
+            logging.debug("%s has changed, using a new alpm handle", conf_path)
+            _RETIRED.append(entry)
+            entry = None
+
+        if entry is None:
+            entry = PoolEntry(key, pac.Pac(conf_path, callback_queue), conf_mtime)
+            _ENTRIES[key] = entry
+        elif callback_queue is not None:
+            # Send events to the new user
+            entry.pacman.events = Events(callback_queue)
+
+        return entry
+
+
+def get_pac(conf_path="/etc/pacman.conf", callback_queue=None):
+    """ Returns the shared Pac object for conf_path, without locking it.
+        It is meant for the installation stages (package selection and
+        install), which run one after the other in the same thread and keep
+        the handle for long. Code that may run at the same time as them
+        (from other threads) must use handle() and refresh(), which lock it """
+    return _get_entry(conf_path, callback_queue).pacman
+
+
+@contextlib.contextmanager
+def handle(conf_path="/etc/pacman.conf", callback_queue=None):
+    """ Context manager that gives exclusive access to the shared Pac
+        object for conf_path """
+    entry = _get_entry(conf_path, callback_queue)
+    with entry.lock:
+        yield entry.pacman
+
+
+def refresh(pacman, force=True):
+    """ Syncs pacman databases, unless they have just been downloaded """
+    with _LOCK:
+        entry = next(
+            (entry for entry in list(_ENTRIES.values()) + _RETIRED
+             if entry.pacman is pacman), None)
+    if entry is None:
+        return pacman.refresh(force=force, max_age=REFRESH_MAX_AGE)
+    with entry.lock:
+        return pacman.refresh(force=force, max_age=REFRESH_MAX_AGE)
+
+
+def release(conf_path):
+    """ Releases the shared Pac objects for conf_path (if any). Nobody
+        may be using them """
+    key = get_key(conf_path)
+    with _LOCK:
+        # Retired entries may have another root dir, compare conf paths
+        entries = [entry for entry in _RETIRED if entry.key[0] == key[0]]
+        _RETIRED[:] = [entry for entry in _RETIRED if entry.key[0] != key[0]]
+        entry = _ENTRIES.pop(key, None)
+        if entry is not None:
+            entries.append(entry)
+    for entry in entries:
+        with entry.lock:
+            entry.pacman.release()
+
+
+def release_all():
+    """ Releases all shared Pac objects (retired ones too) """
+    with _LOCK:
+        entries = list(_ENTRIES.values()) + _RETIRED
+        _ENTRIES.clear()
+        del _RETIRED[:]
+    for entry in entries:
+        with entry.lock:
+            entry.pacman.release()
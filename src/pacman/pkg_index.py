@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  pkg_index.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Package name, group and provides lookup tables of alpm databases """
+
+from collections import namedtuple, OrderedDict
+import re
+
+try:
+    import pyalpm
+except ImportError as err:
+    # This is already logged elsewhere
+    pass
+
+# Result of resolving a list of package (or group) names
+# pkgs is an OrderedDict (package name -> pkg), groups the set of names that
+# are groups, not_found and conflicts are lists of names
+Resolution = namedtuple('Resolution', ['pkgs', 'groups', 'not_found', 'conflicts'])
+
+_DEP_NAME_RE = re.compile(r'[<>=]')
+
+
+def get_dep_name(dep):
+    """ Returns the package name of a dependency string (foo>=1.0 -> foo) """
+    return _DEP_NAME_RE.split(dep, 1)[0]
+
+
+class PackageIndex():
+    """ Indexes all packages of a list of databases by name, group and
+        provides. When a name is in several databases, the first one wins
+        (like pacman does with repository order) """
+
+    def __init__(self, databases):
+        self.repos = OrderedDict()
+        # package name -> pkg
+        self.names = {}
+        # (repository name, package name) -> pkg
+        self.repo_names = {}
+        # group name -> list of pkgs
+        self.groups = {}
+        # (repository name, group name) -> list of pkgs
+        self.repo_groups = {}
+        # name -> list of pkgs that are called name or provide it
+        self.providers = {}
+
+        for database in databases:
+            self.repos[database.name] = database
+            db_groups = OrderedDict()
+            for pkg in database.pkgcache:
+                self.repo_names[(database.name, pkg.name)] = pkg
+                self.names.setdefault(pkg.name, pkg)
+                self.providers.setdefault(pkg.name, []).append(pkg)
+                for provide in pkg.provides:
+                    self.providers.setdefault(get_dep_name(provide), []).append(pkg)
+                for group in pkg.groups:
+                    db_groups.setdefault(group, []).append(pkg)
+            for group, pkgs in db_groups.items():
+                self.repo_groups[(database.name, group)] = pkgs
+                self.groups.setdefault(group, pkgs)
+
+    def get_pkg(self, name, repo=None):
+        """ Returns package called name (from repo if given) or None """
+        if repo:
+            return self.repo_names.get((repo, name))
+        return self.names.get(name)
+
+    def get_group(self, name, repo=None):
+        """ Returns the packages of group name (from repo if given) or None """
+        if repo:
+            return self.repo_groups.get((repo, name))
+        return self.groups.get(name)
+
+    def get_group_pkg_names(self, repo, group_names):
+        """ Returns the set of package names in the given groups of repo """
+        names = set()
+        for group_name in group_names:
+            for pkg in self.repo_groups.get((repo, group_name), []):
+                names.add(pkg.name)
+        return names
+
+    def find_satisfier(self, dep):
+        """ Returns the package that satisfies dependency dep or None """
+        candidates = self.providers.get(get_dep_name(dep))
+        if not candidates:
+            return None
+        return pyalpm.find_satisfier(candidates, dep)
+
+    def resolve(self, names, conflicts=None, repo_only_names=None, repo=None):
+        """ Resolves package (or group) names in one pass.
+            Names in repo_only_names are only searched in repo.
+            Packages in conflicts are skipped (and reported) """
+        conflicts = set(conflicts or [])
+        repo_only_names = repo_only_names or set()
+
+        pkgs = OrderedDict()
+        groups = set()
+        not_found = []
+        skipped = []
+
+        for name in OrderedDict.fromkeys(names):
+            pkg_repo = repo if name in repo_only_names else None
+            pkg = self.get_pkg(name, pkg_repo)
+            if pkg is not None:
+                group_pkgs = [pkg]
+            else:
+                # Couldn't find the package, check if it's a group
+                group_pkgs = self.get_group(name, pkg_repo)
+                if group_pkgs is None:
+                    not_found.append(name)
+                    continue
+                groups.add(name)
+            for group_pkg in group_pkgs:
+                # Ex: connman conflicts with netctl(openresolv),
+                # which is installed by default with base group
+                if group_pkg.name in conflicts:
+                    skipped.append(group_pkg.name)
+                else:
+                    pkgs[group_pkg.name] = group_pkg
+
+        return Resolution(pkgs, groups, not_found, skipped)
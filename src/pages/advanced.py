@@ -45,6 +45,7 @@ from misc.run_cmd import call
 
 import parted3.partition_module as pm
 import parted3.fs_module as fs
+import parted3.block_devices as block_devices
 import parted3.lvm as lvm
 import parted3.used_space as used_space
 
@@ -1114,6 +1115,9 @@ class InstallationAdvanced(GtkBaseBox):
     def prepare(self, direction):
         """ Prepare our dialog to show/hide/activate/deactivate what's necessary """
 
+        # Disks may have been modified outside Cnchi, get their info again
+        block_devices.invalidate()
+
         self.translate_ui()
         self.update_view()
         self.show_all()
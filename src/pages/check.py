@@ -32,22 +32,19 @@
 import logging
 import os
 import subprocess
-import tarfile
-import tempfile
 import dbus
 
-import requests
-
 from gi.repository import GLib
 
 import info
 
 from misc.gtkwidgets import StateBox
 import misc.extra as misc
-from misc.run_cmd import call
+import parted3.block_devices as block_devices
 from pages.gtkbasebox import GtkBaseBox
 
 import show_message as show
+import startup_prefetch
 
 # When testing, no _() is available
 try:
@@ -140,7 +137,12 @@ class Check(GtkBaseBox):
             show.fatal_error(self.main_window, msg)
             return False
 
-        has_internet = misc.has_connection()
+        # Never wait for network checks here (we're in Gtk's thread), the
+        # timer will call us again. Check the connection again (in
+        # background) on each call, so losing it is noticed too. The
+        # monitor only probes it when its cached status is too old
+        startup_prefetch.get_service().submit(startup_prefetch.CONNECTION)
+        has_internet = bool(misc.get_connection_monitor().get_status())
         self.prepare_network_connection.set_state(has_internet)
 
         on_power = not self.on_battery()
@@ -201,24 +203,24 @@ class Check(GtkBaseBox):
     def has_enough_space():
         """ Check that we have a disk or partition with enough space """
 
-        output = call(cmd=["lsblk", "-lnb"], debug=False).split("\n")
-
         max_size = 0
 
-        for item in output:
-            col = item.split()
-            if len(col) >= 5:
-                if col[5] == "disk" or col[5] == "part":
-                    size = int(col[3])
-                    if size > max_size:
-                        max_size = size
+        for path, device in block_devices.get_devices().items():
+            if device.get('type') in ["disk", "part"]:
+                size = block_devices.get_size(path)
+                if size > max_size:
+                    max_size = size
 
         return max_size >= Check.MIN_ROOT_SIZE
 
     def is_updated(self):
         """ Checks that we're running the latest stable cnchi version """
         if not self.remote_version:
-            self.remote_version = self.get_cnchi_version_in_repo()
+            prefetch = startup_prefetch.get_service()
+            self.remote_version = prefetch.peek(startup_prefetch.VERSION)
+            if not self.remote_version:
+                # Not finished or failed (no connection?), check again
+                prefetch.submit(startup_prefetch.VERSION)
 
         if self.remote_version:
             return self.compare_versions(self.remote_version, info.CNCHI_VERSION)
@@ -250,37 +252,7 @@ class Check(GtkBaseBox):
     @staticmethod
     def get_cnchi_version_in_repo():
         """ Checks cnchi version in the Antergos repository """
-        mirrors = [
-            ("info.antergos.repo", "/antergos/x86_64/antergos.db"),
-            ("net.leaseweb.de.mirror", "/antergos/antergos/x86_64/antergos.db")]
-
-        for fdqn, path in mirrors:
-            fdqn = '.'.join(fdqn.split('.')[::-1])
-            url = 'https://' + fdqn + path
-            pkg = None
-            try:
-                ant_db = tempfile.NamedTemporaryFile(delete=False)
-                response = requests.get(url)
-                ant_db.write(response.content)
-                ant_db.close()
-
-                with tarfile.open(ant_db.name) as tar:
-                    members = tar.getmembers()
-                    for tarinfo in members:
-                        if ("desc" not in tarinfo.name and
-                                "cnchi" in tarinfo.name and
-                                "cnchi-dev" not in tarinfo.name):
-                            pkg = tarinfo.name
-                            break
-                if pkg:
-                    version = pkg.split('-')[1]
-                    logging.debug('Cnchi version in the Antergos repository is: %s', version)
-                    return version
-            except (requests.exceptions.ConnectionError, tarfile.ReadError) as err:
-                logging.warning(err)
-
-        logging.error("Cannot get Cnchi's version from Antergos repository!")
-        return None
+        return startup_prefetch.get_cnchi_version_in_repo()
 
     def on_timer(self):
         """ If all requirements are meet, enable forward button """
@@ -39,12 +39,12 @@ import xml.etree.cElementTree as elementTree
 
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 
 from pages.gtkbasebox import GtkBaseBox
 from logging_utils import ContextFilter
 
-import geoip
+import startup_prefetch
 
 class Location(GtkBaseBox):
     """ Location page """
@@ -114,8 +114,17 @@ class Location(GtkBaseBox):
     def select_detected_country(self):
         """ Selects listbox item that matches detected country using GeoIP database """
         if not self.geoip_country:
-            logging.debug("Getting your country using GeoIP database")
-            self.geoip_country = geoip.GeoIP().get_country()
+            prefetch = startup_prefetch.get_service()
+            geo = prefetch.peek(startup_prefetch.GEOIP)
+            if geo is not None:
+                self.geoip_country = geo.get_country()
+            if not self.geoip_country:
+                # Do not block Gtk waiting for it, select it when it's ready
+                logging.debug("Getting your country using GeoIP database")
+                if geo is not None:
+                    # It failed (no connection?), try again
+                    prefetch.submit(startup_prefetch.GEOIP)
+                prefetch.when_done(startup_prefetch.GEOIP, self.on_geoip_done)
         if self.geoip_country:
             names = self.geoip_country.names
             #logging.debug(names)
@@ -132,6 +141,18 @@ class Location(GtkBaseBox):
         else:
             self.select_first_listbox_item()
 
+    def on_geoip_done(self, geo):
+        """ GeoIP lookup has finished (called from a worker thread) """
+        if geo is not None and geo.get_country():
+            GLib.idle_add(self.on_geoip_country, geo.get_country())
+
+    def on_geoip_country(self, country):
+        """ Selects the country GeoIP has detected (in Gtk's thread) """
+        if not self.geoip_country:
+            self.geoip_country = country
+            self.select_detected_country()
+        return False
+
     def hide_all(self):
         """ Hide all widgets """
         names = [
@@ -42,6 +42,7 @@ from gi.repository import Gtk, GLib, GdkPixbuf
 
 import show_message as show
 import misc.extra as misc
+import misc.speed_meter as speed_meter
 
 from pages.gtkbasebox import GtkBaseBox
 
@@ -206,53 +207,68 @@ class Slides(GtkBaseBox):
                 # Queue is empty, just quit.
                 return True
 
-            if event[0] == 'percent':
-                self.progress_bar.set_fraction(float(event[1]))
-            elif event[0] == 'downloads_percent':
-                self.downloads_progress_bar.set_fraction(float(event[1]))
-            elif event[0] == 'progress_bar_show_text':
-                if event[1]:
-                    self.progress_bar.set_text(event[1])
-                else:
-                    self.progress_bar.set_text("")
-            elif event[0] == 'progress_bar':
-                if event[1] == 'hide':
-                    self.progress_bar.hide()
-                elif event[1] == 'show':
-                    self.progress_bar.show()
-            elif event[0] == 'downloads_progress_bar':
-                if event[1] == 'hide':
-                    self.downloads_progress_bar.hide()
-                elif event[1] == 'show':
-                    self.downloads_progress_bar.show()
-            elif event[0] == 'pulse':
-                if event[1] == 'stop':
-                    self.stop_pulse()
-                elif event[1] == 'start':
-                    self.start_pulse()
-            elif event[0] == 'finished':
-                logging.info(event[1])
-                self.installation_finished()
-            elif event[0] == 'error':
-                self.callback_queue.task_done()
-                self.install_error(event[1])
-            elif event[0] == 'info':
-                logging.info(event[1])
-                if self.should_pulse:
-                    self.progress_bar.set_text(event[1])
-                else:
-                    self.info_label.set_markup(event[1])
-            elif event[0] == 'cache_pkgs_md5_check_failed':
-                logging.debug(
-                    'Adding %s to cache_pkgs_md5_check_failed list', event[1])
-                self.settings.set('cache_pkgs_md5_check_failed', event[1])
+            # Several events can be sent together (see misc/events.py)
+            if event[0] == 'batch':
+                events = event[1]
             else:
-                logging.warning("Event %s not recognised. Ignoring.", event[0])
+                events = [event]
+
+            for event_type, event_text in events:
+                if event_type == 'error':
+                    self.callback_queue.task_done()
+                    self.install_error(event_text)
+                    return True
+                self.manage_event(event_type, event_text)
 
             self.callback_queue.task_done()
 
         return True
 
+    def manage_event(self, event_type, event_text):
+        """ Shows one event from the installation process to the user """
+        if event_type == 'percent':
+            self.progress_bar.set_fraction(float(event_text))
+        elif event_type == 'downloads_percent':
+            self.downloads_progress_bar.set_fraction(float(event_text))
+        elif event_type == 'download_progress':
+            # Numeric progress info (see misc/speed_meter.py)
+            self.progress_bar.set_text(speed_meter.format_progress(event_text))
+        elif event_type == 'progress_bar_show_text':
+            if event_text:
+                self.progress_bar.set_text(event_text)
+            else:
+                self.progress_bar.set_text("")
+        elif event_type == 'progress_bar':
+            if event_text == 'hide':
+                self.progress_bar.hide()
+            elif event_text == 'show':
+                self.progress_bar.show()
+        elif event_type == 'downloads_progress_bar':
+            if event_text == 'hide':
+                self.downloads_progress_bar.hide()
+            elif event_text == 'show':
+                self.downloads_progress_bar.show()
+        elif event_type == 'pulse':
+            if event_text == 'stop':
+                self.stop_pulse()
+            elif event_text == 'start':
+                self.start_pulse()
+        elif event_type == 'finished':
+            logging.info(event_text)
+            self.installation_finished()
+        elif event_type == 'info':
+            logging.info(event_text)
+            if self.should_pulse:
+                self.progress_bar.set_text(event_text)
+            else:
+                self.info_label.set_markup(event_text)
+        elif event_type == 'cache_pkgs_md5_check_failed':
+            logging.debug(
+                'Adding %s to cache_pkgs_md5_check_failed list', event_text)
+            self.settings.set('cache_pkgs_md5_check_failed', event_text)
+        else:
+            logging.warning("Event %s not recognised. Ignoring.", event_type)
+
     def empty_queue(self):
         """ Empties messages queue """
         while not self.callback_queue.empty():
@@ -28,22 +28,15 @@
 
 """ Timezone screen """
 
-import hashlib
-import http.client
 import logging
-import multiprocessing
 import os
 import queue
-import time
-import urllib.request
-import urllib.error
 
 import misc.tz as tz
-import misc.extra as misc
 import widgets.timezonemap as timezonemap
 from pages.gtkbasebox import GtkBaseBox
 
-import geoip
+import auto_timezone
 
 # When testing, no _() is available
 try:
@@ -52,7 +45,6 @@ except NameError as err:
     def _(message):
         return message
 
-
 class Timezone(GtkBaseBox):
     """ Timezone screen """
 
@@ -74,11 +66,10 @@ class Timezone(GtkBaseBox):
         self.old_zone = None
 
         # Autotimezone process will store detected coords in this queue
-        self.auto_timezone_coords = multiprocessing.Queue()
-
-        # Process to try to determine timezone.
+        # (Cnchi starts it at startup, this page is loaded later)
+        self.auto_timezone_coords = auto_timezone.start_auto_timezone_process(
+            self.settings)
         self.autodetected_coords = None
-        self.start_auto_timezone_process()
 
         # Setup window
         self.tzmap = timezonemap.TimezoneMap()
@@ -220,13 +211,6 @@ class Timezone(GtkBaseBox):
 
         self.show_all()
 
-    def start_auto_timezone_process(self):
-        """ Starts timezone thread """
-        proc = AutoTimezoneProcess(self.auto_timezone_coords, self.settings)
-        proc.daemon = True
-        proc.name = "timezone"
-        proc.start()
-
     @staticmethod
     def log_location(loc):
         """ Log selected location """
@@ -286,94 +270,3 @@ class Timezone(GtkBaseBox):
     def on_switch_ntp_activate(self, ntp_switch, _data):
         """ activated/deactivated ntp switch """
         self.settings.set('use_timesyncd', ntp_switch.get_active())
-
-
-class AutoTimezoneProcess(multiprocessing.Process):
-    """ Thread that asks our server for user's location """
-
-    def __init__(self, coords_queue, settings):
-        super(AutoTimezoneProcess, self).__init__()
-        self.coords_queue = coords_queue
-        self.settings = settings
-
-    def run(self):
-        """ main thread method """
-        # Do not start looking for our timezone until we've reached the
-        # language screen (welcome.py sets timezone_start to true when
-        # next is clicked)
-        while not self.settings.get('timezone_start'):
-            time.sleep(2)
-
-        coords = self.use_geoip()
-        if not coords:
-            msg = "Could not detect your timezone using GeoIP database. Let's use another method."
-            logging.warning(msg)
-            coords = self.use_geo_antergos()
-
-        # If latitude and longitude are zero it means something bad has happened
-        if not coords or (float(coords[0]) == 0 and float(coords[1]) == 0):
-            logging.warning(
-                "Could not detect your timezone. Are you behind a firewall?")
-            return
-
-        logging.debug(
-            _("Timezone (latitude %s, longitude %s) detected."),
-            coords[0], coords[1])
-        self.coords_queue.put(coords)
-
-    @staticmethod
-    def use_geoip():
-        """ Determine our location using GeoIP database """
-        logging.debug("Getting your location using GeoIP database")
-        location = geoip.GeoIP().get_location()
-        if location:
-            return [location.latitude, location.longitude]
-        return None
-
-    @staticmethod
-    def maybe_wait_for_network():
-        """ Waits until there is an Internet connection available """
-        if not misc.has_connection():
-            logging.warning(
-                "Can't get network status. Cnchi will try again in a moment")
-            while not misc.has_connection():
-                time.sleep(4)  # Wait 4 seconds and try again
-        logging.debug("A working network connection has been detected.")
-
-
-    def use_geo_antergos(self):
-        """ Determine our location using geo.antergos.com """
-        # Calculate logo hash
-        logo = "data/images/antergos/antergos-logo-mini2.png"
-        logo_path = os.path.join(self.settings.get("cnchi"), logo)
-        with open(logo_path, "rb") as logo_file:
-            logo_bytes = logo_file.read()
-        logo_hasher = hashlib.sha1()
-        logo_hasher.update(logo_bytes)
-        logo_digest = logo_hasher.digest()
-
-        # Wait until there is an Internet connection available
-        self.maybe_wait_for_network()
-
-        # OK, now get our timezone
-        logging.debug("We have connection. Let's get our timezone")
-
-        try:
-            url = urllib.request.Request(
-                url="http://geo.antergos.com",
-                data=logo_digest,
-                headers={"User-Agent": "Antergos Installer", "Connection": "close"})
-            with urllib.request.urlopen(url) as conn:
-                coords = conn.read().decode('utf-8').strip()
-            if coords == "0 0":
-                # Sometimes server returns 0 0, we treat it as an error
-                coords = None
-            else:
-                coords = coords.split()
-        except (OSError, urllib.error.HTTPError, http.client.HTTPException) as err:
-            template = "Error getting timezone coordinates. " \
-                "An exception of type {0} occured. Arguments:\n{1!r}"
-            message = template.format(type(err).__name__, err.args)
-            logging.error(message)
-            coords = None
-        return coords
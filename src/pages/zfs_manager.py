@@ -31,6 +31,7 @@ import time
 from misc.extra import InstallError
 from misc.run_cmd import call
 from installation import wrapper
+import parted3.block_devices as block_devices
 
 # When testing, no _() is available
 try:
@@ -273,6 +274,8 @@ def settle():
     """ Wait until in /dev initialized correct devices """
     call(["/usr/bin/udevadm", "settle"])
     call(["/usr/bin/sync"])
+    # Devices have changed
+    block_devices.invalidate()
 
 
 def create_pool(pool_name, pool_type, device_paths, force_4k):
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  block_devices.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Block devices inventory. Runs lsblk once to get the info of all block
+    devices and keeps it until it is invalidated (after partitioning,
+    formatting or labeling something, call invalidate()) """
+
+import json
+import logging
+import os
+import subprocess
+import threading
+
+import misc.extra as misc
+
+# -J json output, -b sizes in bytes, -O all columns, -p full device paths
+LSBLK_CMD = ['lsblk', '-J', '-b', '-O', '-p']
+
+_LOCK = threading.Lock()
+
+# device path -> dict with all lsblk columns (lowercase names)
+_DEVICES = None
+# kernel device path (/dev/dm-0) -> the same dicts
+_KNAMES = None
+# True if devices have been modified since the last scan
+_CHANGED = False
+
+
+def _add_devices(devices, parent=None):
+    """ Adds lsblk devices (and their children) to the inventory """
+    for device in devices:
+        children = device.pop('children', [])
+        if parent and not device.get('pkname'):
+            device['pkname'] = parent['name']
+        # A device with several parents (raid, lvm) appears several times
+        if device['name'] not in _DEVICES:
+            _DEVICES[device['name']] = device
+            kname = device.get('kname')
+            if kname:
+                _KNAMES[kname] = device
+        _add_devices(children, device)
+
+
+@misc.raise_privileges
+def _scan():
+    """ Runs lsblk and stores the info of all block devices """
+    global _DEVICES, _KNAMES, _CHANGED
+
+    if _CHANGED:
+        # Let udev process the changes first (lsblk reads its database)
+        try:
+            subprocess.check_call(['udevadm', 'settle', '--timeout=10'])
+        except (OSError, subprocess.CalledProcessError) as err:
+            logging.debug("udevadm settle failed: %s", err)
+
+    _DEVICES = {}
+    _KNAMES = {}
+    _CHANGED = False
+    try:
+        output = subprocess.check_output(LSBLK_CMD).decode()
+        _add_devices(json.loads(output).get('blockdevices', []))
+    except subprocess.CalledProcessError as err:
+        logging.warning("Error running %s: %s", err.cmd, err.output)
+    except (OSError, ValueError) as err:
+        logging.warning("Can't get block devices info: %s", err)
+    logging.debug("Block devices inventory: %d devices found", len(_DEVICES))
+
+
+def invalidate():
+    """ Drops the inventory. Call it each time a block device is
+        created, removed, formatted or labeled """
+    global _DEVICES, _KNAMES, _CHANGED
+    with _LOCK:
+        _DEVICES = None
+        _KNAMES = None
+        _CHANGED = True
+
+
+def _after_fork():
+    """ A forked process (the installation one) must not use its parent's
+        lock (another thread may have been holding it) nor its inventory """
+    global _LOCK, _DEVICES, _KNAMES, _CHANGED
+    _LOCK = threading.Lock()
+    _DEVICES = None
+    _KNAMES = None
+    _CHANGED = True
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_devices():
+    """ Returns a dict (device path -> device info) of all block devices """
+    with _LOCK:
+        if _DEVICES is None:
+            _scan()
+        return dict(_DEVICES)
+
+
+def _find(path):
+    """ Finds path in the inventory (it must be already loaded) """
+    device = _DEVICES.get(path)
+    if device is None:
+        # /dev/disk/by-*, /dev/VG/LV and /dev/mapper/* are symlinks
+        device = _KNAMES.get(os.path.realpath(path))
+    return device
+
+
+def get_device(path):
+    """ Returns lsblk info (dict) of device path or None if it is unknown """
+    if not path:
+        return None
+    with _LOCK:
+        if _DEVICES is None:
+            _scan()
+        device = _find(path)
+        if device is None:
+            # Device may be new, scan again (only once)
+            _scan()
+            device = _find(path)
+        return device
+
+
+def get_value(path, column):
+    """ Returns lsblk column value (lowercase name) of device path or
+        an empty string if it's not known """
+    device = get_device(path)
+    if device is None:
+        return ''
+    value = device.get(column)
+    if value is None:
+        return ''
+    return value
+
+
+def get_uuid(path):
+    """ Returns file system UUID of device path """
+    return get_value(path, 'uuid')
+
+
+def get_label(path):
+    """ Returns file system label of device path """
+    return get_value(path, 'label')
+
+
+def get_fstype(path):
+    """ Returns file system type of device path """
+    return get_value(path, 'fstype')
+
+
+def get_size(path):
+    """ Returns size (bytes) of device path """
+    try:
+        return int(get_value(path, 'size') or 0)
+    except ValueError:
+        return 0
+
+
+def get_pkname(path):
+    """ Returns the parent kernel device path of device path """
+    return get_value(path, 'pkname')
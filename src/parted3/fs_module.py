@@ -34,6 +34,7 @@ import logging
 import os
 
 import misc.extra as misc
+import parted3.block_devices as block_devices
 
 # constants
 NAMES = [
@@ -70,7 +71,9 @@ def get_label(part):
 
 @misc.raise_privileges
 def get_info(part):
-    """ Get partition info using blkid """
+    """ Get partition info using blkid (not the block devices inventory:
+        its UUID and LABEL go to fstab and the bootloader configuration,
+        and udev's database may not be up to date yet) """
 
     ret = ''
     partdic = {}
@@ -91,46 +94,23 @@ def get_info(part):
     return partdic
 
 
-@misc.raise_privileges
 def get_type(part):
     """ Get partition filesystem type """
-    ret = ''
     if part and not misc.is_partition_extended(part):
-        #cmd = ['blkid', '-o', 'value', '-s', 'TYPE', part]
-        cmd = ['lsblk', part, '-n', '-o', 'FSTYPE', '-l']
-        try:
-            ret = subprocess.check_output(cmd).decode().strip()
-        except subprocess.CalledProcessError as err:
-            logging.warning("Error running %s: %s", err.cmd, err.output)
-    return ret
+        return block_devices.get_fstype(part)
+    return ''
 
 
 def get_pknames():
     """ PKNAME: internal parent kernel device name """
     pknames = {}
-    info = None
-    try:
-        cmd = ['lsblk', '-o', 'NAME,PKNAME', '-l']
-        info = subprocess.check_output(cmd).decode().strip().split('\n')
-    except subprocess.CalledProcessError as err:
-        logging.warning("Error running %s: %s", err.cmd, err.output)
-
-    if info:
-        # skip header
-        info = info[1:]
-        skip_list = ["disk", "rom", "loop", "arch_root-image"]
-        for line in info:
-            skip_line = False
-            for skip in skip_list:
-                if skip in line:
-                    skip_line = True
-                    break
-            if not skip_line:
-                line = line.split()
-                try:
-                    pknames[line[0]] = line[1]
-                except IndexError as err:
-                    pass
+    skip_types = ["disk", "rom", "loop"]
+    for path, device in block_devices.get_devices().items():
+        if device.get('type') in skip_types or "arch_root-image" in path:
+            continue
+        pkname = device.get('pkname')
+        if pkname:
+            pknames[os.path.basename(path)] = os.path.basename(pkname)
     return pknames
 
 
@@ -165,6 +145,7 @@ def label_fs(fstype, part, label):
             logging.error("Error running %s: %s", err.cmd, err.output.decode())
             ret = (1, err)
             # check_call returns exit code.  0 should mean success
+        block_devices.invalidate()
     else:
         ret = (1, _("Cnchi does not know how to label a {0} partition").format(fstype))
     return ret
@@ -248,6 +229,7 @@ def create_fs(part, fstype, label='', options=''):
     except subprocess.CalledProcessError as err:
         logging.error("Error running %s: %s", err.cmd, err.output.decode())
         ret = (True, err)
+    block_devices.invalidate()
     return ret
 
 @misc.raise_privileges
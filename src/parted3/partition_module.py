@@ -38,6 +38,7 @@ import parted
 import show_message as show
 
 import misc.extra as misc
+import parted3.block_devices as block_devices
 
 OK = 0
 UNRECOGNISED_DISK_LABEL = -1
@@ -386,6 +387,8 @@ def finalize_changes(diskob):
     except parted._ped.IOException as io_error:
         logging.error(str(io_error))
         raise IOError(str(io_error))
+    finally:
+        block_devices.invalidate()
 
 
 def order_partitions(partdic):
@@ -30,11 +30,11 @@
 
 """ Creates mirrorlist sorted by both latest updates and fastest connection """
 
+import concurrent.futures
 import http.client
 import logging
 import multiprocessing
 import os
-import queue
 import subprocess
 import threading
 import time
@@ -77,6 +77,11 @@ class RankMirrors(multiprocessing.Process):
         'arch': 'core/os/x86_64/{0}-{1}-x86_64.pkg.tar.xz',
         'antergos': '/{0}-{1}-any.pkg.tar.xz'}
 
+    # Bytes downloaded from each mirror to test its speed
+    PROBE_BYTES = 256 * 1024
+    PROBE_CHUNK_SIZE = 16 * 1024
+    PROBE_TIMEOUT = 5
+
     def __init__(self, fraction_pipe, settings):
         """ Initialize process class
             fraction_pipe is a pipe used to send progress for a gtk.progress widget update
@@ -87,6 +92,8 @@ class RankMirrors(multiprocessing.Process):
         # Antergos mirrors info is returned as RSS, arch's as JSON
         self.data = {'arch': {}, 'antergos': {}}
         self.mirrorlist_ranked = {'arch': [], 'antergos': []}
+        # Per thread requests session (see get_session)
+        self.local = None
 
     @staticmethod
     def is_good_mirror(mirror):
@@ -169,8 +176,48 @@ class RankMirrors(multiprocessing.Process):
             version = False
         return version
 
+    def get_session(self):
+        """ Returns the requests session of the calling thread (connections
+            to the same mirror host are kept alive and reused) """
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({'User-Agent': 'Mozilla/5.0'})
+            self.local.session = session
+        return session
+
+    def test_mirror(self, url):
+        """ Downloads (at most) PROBE_BYTES from url.
+            Returns rate (bytes/s, counting the time to first byte) and
+            time to first byte. Rate is 0 if the connection fails. """
+        rate = 0
+        ttfb = float('NaN')
+        headers = {'Range': 'bytes=0-{0}'.format(RankMirrors.PROBE_BYTES - 1)}
+        try:
+            time0 = time.perf_counter()
+            with self.get_session().get(
+                    url, headers=headers, stream=True,
+                    timeout=RankMirrors.PROBE_TIMEOUT) as req:
+                req.raise_for_status()
+                size = 0
+                for data in req.iter_content(RankMirrors.PROBE_CHUNK_SIZE):
+                    if not size:
+                        ttfb = time.perf_counter() - time0
+                    size += len(data)
+                    if size >= RankMirrors.PROBE_BYTES:
+                        # Mirror may not honour range requests
+                        break
+                dtime = time.perf_counter() - time0
+            if dtime > 0:
+                rate = size / dtime
+        except requests.RequestException as err:
+            logging.warning("Couldn't download %s", url)
+            logging.warning(err)
+        return rate, ttfb
+
     def sort_mirrors_by_speed(self, mirrors=None, max_threads=8):
-        """ Sorts mirror list """
+        """ Sorts mirror list. Mirrors of all repositories are tested at
+            the same time using a pool of threads """
 
         test_packages = {
             'arch': {'name':'cryptsetup', 'version': ''},
@@ -181,52 +228,12 @@ class RankMirrors(multiprocessing.Process):
         for key, value in test_packages.items():
             test_packages[key]['version'] = self.get_package_version(value['name'])
 
-        total_num_mirrors = 0
-        for key in mirrors.keys():
-            total_num_mirrors += len(mirrors[key])
-        num_mirrors_done = 0
-        old_fraction = -1
-
-        num_threads = min(max_threads, total_num_mirrors)
-        # URL input queue.Queue
-        q_in = queue.Queue()
-        # URL and rate output queue.Queue
-        q_out = queue.Queue()
-
-        name = ""
-        version = ""
-        rates = {}
-
+        # Create the list of urls to test
+        jobs = []
         for repo in RankMirrors.REPOSITORIES:
             name = test_packages[repo]['name']
             version = test_packages[repo]['version']
-
-            def worker():
-                """ worker thread. Retrieves data to test mirror speed """
-                while not q_in.empty():
-                    mirror_url, full_url = q_in.get()
-                    # Leave the rate as 0 if the connection fails.
-                    rate = 0
-                    dtime = float('NaN')
-                    if full_url:
-                        req = urllib.request.Request(url=full_url)
-                        try:
-                            time0 = time.time()
-                            with urllib.request.urlopen(req, None, 5) as my_file:
-                                size = len(my_file.read())
-                                dtime = time.time() - time0
-                                rate = size / dtime
-                        except (OSError, urllib.error.HTTPError,
-                                http.client.HTTPException) as err:
-                            logging.warning("Couldn't download %s", full_url)
-                            logging.warning(err)
-                    q_out.put((mirror_url, full_url, rate, dtime))
-                    q_in.task_done()
-
-            # Load the input queue.Queue
-            url_len = 0
             for mirror in mirrors[repo]:
-                url_len = max(url_len, len(mirror['url']))
                 if repo == 'antergos':
                     url = self.get_antergos_mirror_url(mirror['url'])
                     # Save mirror url
@@ -240,62 +247,46 @@ class RankMirrors(multiprocessing.Process):
                 else:
                     package_url = mirror['url']
                 if mirror['url'] and package_url:
-                    q_in.put((mirror['url'], package_url))
-
-            # Launch threads
-            my_threads = []
-            for _index in range(num_threads):
-                my_thread = threading.Thread(target=worker)
-                my_thread.start()
-                my_threads.append(my_thread)
+                    jobs.append((repo, mirror['url'], package_url))
 
             # Remove mirrors that are not present in antergos-mirrorlist
             if repo == 'antergos':
-                mirrors_pruned = []
-                for mirror in mirrors[repo]:
-                    if mirror['url'] is not None:
-                        mirrors_pruned.append(mirror)
-                mirrors[repo] = mirrors_pruned
+                mirrors[repo] = [m for m in mirrors[repo] if m['url'] is not None]
 
-            # Wait for queue to empty
-            while not q_in.empty():
-                fraction = (float(q_out.qsize()) + num_mirrors_done) / float(total_num_mirrors)
-                if fraction != old_fraction:
-                    if self.fraction_pipe:
-                        self.fraction_pipe.send(fraction)
-                    old_fraction = fraction
-
-            num_mirrors_done += q_out.qsize()
-
-            # Wait for all threads to complete
-            q_in.join()
+        rates = {}
+        results = {'arch': [], 'antergos': []}
+        self.local = threading.local()
+        num_threads = max(1, min(max_threads, len(jobs)))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = {}
+            for job in jobs:
+                future = executor.submit(self.test_mirror, job[2])
+                futures[future] = job
+
+            # Send progress each time a mirror test finishes
+            num_mirrors_done = 0
+            for future in concurrent.futures.as_completed(futures):
+                repo, url, _package_url = futures[future]
+                rate, ttfb = future.result()
+                rates[url] = rate
+                results[repo].append((url, rate, ttfb))
+                num_mirrors_done += 1
+                if self.fraction_pipe:
+                    self.fraction_pipe.send(float(num_mirrors_done) / len(jobs))
 
+        for repo in RankMirrors.REPOSITORIES:
             # Log some extra data.
-            url_len = str(url_len)
+            url_len = str(max([len(url) for url, _rate, _ttfb in results[repo]] or [0]))
             fmt = '%-' + url_len + 's  %14s  %9s'
-            logging.debug(fmt, _("Server"), _("Rate"), _("Time"))
-
-            # Loop over the mirrors just to ensure that we get the rate for each.
-            # The value in the loop does not (necessarily) correspond to the mirror.
+            logging.debug(fmt, _("Server"), _("Rate"), _("TTFB"))
             fmt = '%-' + url_len + 's  %8.2f KiB/s  %7.2f s'
-            for mirror in mirrors[repo]:
-                url, full_url, rate, dtime = q_out.get()
-                if full_url:
-                    kibps = rate / 1024.0
-                    logging.debug(fmt, url, kibps, dtime)
-                    rates[url] = rate
-                q_out.task_done()
-
-            # Wait for all threads to finnish (all will be finished, but...)
-            for my_thread in my_threads:
-                my_thread.join()
+            for url, rate, ttfb in results[repo]:
+                logging.debug(fmt, url, rate / 1024.0, ttfb)
 
             # Sort mirrors by rate
-            try:
-                rated_mirrors[repo] = [m for m in mirrors[repo] if rates[m['url']] > 0]
-                rated_mirrors[repo].sort(key=lambda m: rates[m['url']], reverse=True)
-            except KeyError as err:
-                logging.warning(err)
+            rated_mirrors[repo] = [m for m in mirrors[repo] if rates.get(m['url'], 0) > 0]
+            rated_mirrors[repo].sort(key=lambda m: rates[m['url']], reverse=True)
 
         return rated_mirrors
 
@@ -363,8 +354,7 @@ class RankMirrors(multiprocessing.Process):
     def run(self):
         """ Run process """
         # Wait until there is an Internet connection available
-        while not misc.has_connection():
-            time.sleep(2)  # Delay, try again after 2 seconds
+        misc.wait_for_connection()
 
         logging.debug("Updating both mirrorlists (Arch and Antergos)...")
         self.update_mirrorlists()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  startup_prefetch.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Fetches (in background threads) the network information pages need:
+    connection status, GeoIP location, Cnchi version in our repository and
+    the packages list. Pages get futures instead of blocking Gtk """
+
+import concurrent.futures
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+
+import requests
+
+import misc.extra as misc
+
+PKGLIST_URL = 'https://raw.githubusercontent.com/Antergos/Cnchi/master/data/packages.xml'
+
+# Seconds to wait for a remote server
+REQUEST_TIMEOUT = 30
+
+CONNECTION = 'connection'
+GEOIP = 'geoip'
+VERSION = 'version'
+PACKAGES_XML = 'packages_xml'
+
+_SERVICE = None
+
+
+def get_cnchi_version_in_repo():
+    """ Checks cnchi version in the Antergos repository """
+    mirrors = [
+        ("info.antergos.repo", "/antergos/x86_64/antergos.db"),
+        ("net.leaseweb.de.mirror", "/antergos/antergos/x86_64/antergos.db")]
+
+    for fdqn, path in mirrors:
+        fdqn = '.'.join(fdqn.split('.')[::-1])
+        url = 'https://' + fdqn + path
+        pkg = None
+        ant_db = None
+        try:
+            ant_db = tempfile.NamedTemporaryFile(delete=False)
+            response = requests.get(url, timeout=REQUEST_TIMEOUT)
+            ant_db.write(response.content)
+            ant_db.close()
+
+            with tarfile.open(ant_db.name) as tar:
+                members = tar.getmembers()
+                for tarinfo in members:
+                    if ("desc" not in tarinfo.name and
+                            "cnchi" in tarinfo.name and
+                            "cnchi-dev" not in tarinfo.name):
+                        pkg = tarinfo.name
+                        break
+            if pkg:
+                version = pkg.split('-')[1]
+                logging.debug('Cnchi version in the Antergos repository is: %s', version)
+                return version
+        except (requests.exceptions.RequestException, tarfile.ReadError) as err:
+            logging.warning(err)
+        finally:
+            if ant_db is not None and os.path.exists(ant_db.name):
+                os.remove(ant_db.name)
+
+    logging.error("Cannot get Cnchi's version from Antergos repository!")
+    return None
+
+
+def get_packages_xml():
+    """ Downloads the packages list (xml). Returns its contents or None """
+    logging.debug("Getting url %s...", PKGLIST_URL)
+    try:
+        req = requests.get(
+            PKGLIST_URL, headers={'User-Agent': 'Mozilla/5.0'},
+            timeout=REQUEST_TIMEOUT)
+        req.raise_for_status()
+        return req.content
+    except requests.exceptions.RequestException as err:
+        logging.warning("Can't retrieve remote package list: %s", err)
+    return None
+
+
+def get_geoip():
+    """ Returns a GeoIP object (its record is None if it fails) """
+    import geoip
+    return geoip.GeoIP(wait_for_network=False)
+
+
+class PrefetchService():
+    """ Runs all startup network tasks concurrently """
+
+    TASKS = {
+        CONNECTION: misc.has_connection,
+        GEOIP: get_geoip,
+        VERSION: get_cnchi_version_in_repo,
+        PACKAGES_XML: get_packages_xml}
+
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(PrefetchService.TASKS))
+        self.futures = {}
+        self.lock = threading.Lock()
+        # Futures can't be waited from a forked process
+        self.pid = os.getpid()
+
+    def start(self):
+        """ Starts all tasks """
+        for name in PrefetchService.TASKS:
+            self.submit(name)
+
+    def submit(self, name):
+        """ Runs task name again (unless it is still running).
+            Returns its future """
+        with self.lock:
+            future = self.futures.get(name)
+            if os.getpid() != self.pid:
+                return future
+            if future is None or future.done():
+                future = self.executor.submit(self.run_task, name)
+                self.futures[name] = future
+            return future
+
+    @staticmethod
+    def run_task(name):
+        """ Runs task name, logging any error """
+        try:
+            return PrefetchService.TASKS[name]()
+        except Exception as err:
+            logging.warning("Startup task %s failed: %s", name, err)
+            return None
+
+    def get_future(self, name):
+        """ Returns the future of task name (None if it has not been started) """
+        with self.lock:
+            return self.futures.get(name)
+
+    def peek(self, name, default=None):
+        """ Returns the result of task name, or default if it has not
+            finished yet. Never blocks """
+        future = self.get_future(name)
+        if future is None or not future.done():
+            return default
+        return future.result()
+
+    def wait(self, name, timeout=None):
+        """ Waits for task name and returns its result (None if it can't be
+            waited for or if it doesn't finish in time) """
+        future = self.get_future(name)
+        if future is None:
+            return None
+        if os.getpid() != self.pid and not future.done():
+            # Its thread does not exist in this process
+            return None
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+
+    def when_done(self, name, callback):
+        """ Calls callback(result) (from a worker thread) when task name
+            finishes. Returns False if the task has not been started """
+        future = self.get_future(name)
+        if future is None:
+            return False
+        future.add_done_callback(lambda done: callback(done.result()))
+        return True
+
+
+def start():
+    """ Starts the prefetch service (only once) """
+    global _SERVICE
+    if _SERVICE is None:
+        _SERVICE = PrefetchService()
+        _SERVICE.start()
+    return _SERVICE
+
+
+def get_service():
+    """ Returns the prefetch service, starting it if needed """
+    return start()
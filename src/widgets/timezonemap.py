@@ -48,8 +48,10 @@ from gi.repository import Pango, PangoCairo
 
 try:
     import misc.tz as tz
+    from misc.location_index import LocationIndex
 except ImportError:
     import tz
+    from location_index import LocationIndex
 
 import xml.etree.cElementTree as elementTree
 
@@ -88,6 +90,9 @@ class TimezoneMap(Gtk.Widget):
         (11.0, 212, 170, 0, 255), (11.5, 249, 25, 87, 253), (12.0, 255, 204, 0, 255),
         (12.75, 254, 74, 100, 248), (13.0, 255, 85, 153, 250)]
 
+    # (red, green, blue, alpha) -> offset (first color code wins)
+    COLOR_OFFSETS = {
+        tuple(color_code[1:]): color_code[0] for color_code in reversed(COLOR_CODES)}
 
     def __init__(self):
         Gtk.Widget.__init__(self)
@@ -129,6 +134,9 @@ class TimezoneMap(Gtk.Widget):
 
         self.tzdb = tz.Database()
 
+        # (width, height) -> LocationIndex
+        self._location_indexes = {}
+
     def load_olsen_map_timezones(self):
         """ Load olson map timezones """
         try:
@@ -388,47 +396,39 @@ class TimezoneMap(Gtk.Widget):
         rowstride = self._color_map.get_rowstride()
         pixels = self._color_map.get_pixels()
 
-        position = int(rowstride * my_y + my_x * 4)
-        my_red = pixels[position]
-        my_green = pixels[position + 1]
-        my_blue = pixels[position + 2]
-        my_alpha = pixels[position + 3]
-
-        for color_code in TimezoneMap.COLOR_CODES:
-            (offset, red, green, blue, alpha) = color_code
-            if red == my_red and green == my_green and blue == my_blue and alpha == my_alpha:
+        position = int(rowstride * int(my_y) + int(my_x) * 4)
+        if 0 <= position and position + 3 < len(pixels):
+            color = tuple(pixels[position:position + 4])
+            offset = TimezoneMap.COLOR_OFFSETS.get(color)
+            if offset is not None:
                 self._selected_offset = offset
-                break
 
         self.queue_draw()
 
         # Work out the co-ordinates
         allocation = self.get_allocation()
-        width = allocation.width
-        height = allocation.height
-
-        nearest_tz_location = None
-
-        # Impossible distance
-        small_dist = -1
-
-        for tz_location in self.tzdb.get_locations():
-            longitude = tz_location.get_property('longitude')
-            latitude = tz_location.get_property('latitude')
-
-            point_x = self.convert_longitude_to_x(longitude, width)
-            point_y = self.convert_latitude_to_y(latitude, height)
-
-            diff_x = point_x - my_x
-            diff_y = point_y - my_y
-
-            dist = diff_x * diff_x + diff_y * diff_y
-
-            if small_dist == -1 or dist < small_dist:
-                nearest_tz_location = tz_location
-                small_dist = dist
-
-        return nearest_tz_location
+        index = self.get_location_index(allocation.width, allocation.height)
+        return index.get_nearest(my_x, my_y)
+
+    def get_location_index(self, width, height):
+        """ Returns the index of all locations projected to a map of
+            width x height (they are only projected once for each size) """
+        key = (width, height)
+        index = self._location_indexes.get(key)
+        if index is None:
+            points = []
+            for tz_location in self.tzdb.get_locations():
+                longitude = tz_location.get_property('longitude')
+                latitude = tz_location.get_property('latitude')
+                point_x = self.convert_longitude_to_x(longitude, width)
+                point_y = self.convert_latitude_to_y(latitude, height)
+                points.append((point_x, point_y, tz_location))
+            index = LocationIndex(points)
+            # Only keep the sizes used recently
+            if len(self._location_indexes) >= 4:
+                self._location_indexes.clear()
+            self._location_indexes[key] = index
+        return index
 
     def do_button_press_event(self, event):
         """ The button press event virtual method """
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_event_channel.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests that high frequency events are coalesced """
+
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from misc.events import EventChannel
+
+
+def get_items(callback_queue):
+    """ Returns all items in the queue """
+    items = []
+    while not callback_queue.empty():
+        items.append(callback_queue.get_nowait())
+    return items
+
+
+def test_coalesce():
+    """ Only the latest value of a high frequency event is sent """
+    callback_queue = queue.Queue()
+    channel = EventChannel(callback_queue)
+    for percent in range(10):
+        channel.put('percent', percent)
+    channel.put('downloads_percent', 1)
+    assert callback_queue.empty()
+
+    channel.flush()
+    assert get_items(callback_queue) == [
+        ('batch', [('percent', 9), ('downloads_percent', 1)])]
+
+    # Nothing else is pending
+    channel.flush()
+    assert callback_queue.empty()
+
+
+def test_order():
+    """ Held events are sent before any other event """
+    callback_queue = queue.Queue()
+    channel = EventChannel(callback_queue)
+    channel.put('info', 'first')
+    channel.put('percent', 1)
+    channel.put('percent', 2)
+    channel.put('info', 'second')
+    channel.put('info', 'third')
+    assert get_items(callback_queue) == [
+        ('info', 'first'),
+        ('batch', [('percent', 2), ('info', 'second')]),
+        ('info', 'third')]
+
+
+def test_latest_value_last():
+    """ A re-sent high frequency event goes after the other held ones """
+    callback_queue = queue.Queue()
+    channel = EventChannel(callback_queue)
+    channel.put('percent', 1)
+    channel.put('download_progress', 'a')
+    channel.put('percent', 2)
+    channel.flush()
+    assert get_items(callback_queue) == [
+        ('batch', [('download_progress', 'a'), ('percent', 2)])]
+
+
+def test_timer():
+    """ Held events are sent after the tick window """
+    callback_queue = queue.Queue()
+    channel = EventChannel(callback_queue)
+    channel.put('percent', 1)
+    assert callback_queue.get(timeout=EventChannel.TICK_WINDOW * 10) == ('percent', 1)
+    assert channel.timer is None
+
+
+def test_full_queue():
+    """ Events are dropped (not blocked) when the queue is full """
+    callback_queue = queue.Queue(maxsize=1)
+    channel = EventChannel(callback_queue)
+    channel.put('info', 'first')
+    channel.put('info', 'second')
+    assert get_items(callback_queue) == [('info', 'first')]
+
+
+def test_rates():
+    """ Every added event is counted """
+    channel = EventChannel(queue.Queue())
+    for _index in range(5):
+        channel.put('percent', 1)
+    channel.put('info', 'done')
+    assert channel.counters == {'percent': 5, 'info': 1}
+    time.sleep(0.01)
+    rates = channel.get_rates()
+    assert abs(rates['percent'] - 5 * rates['info']) < 1e-6 * rates['percent']
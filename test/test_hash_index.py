@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_hash_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests the index of verified package hashes """
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import download.hash_index as hash_index
+
+
+def use_index_dir(path):
+    """ Makes hash_index open a new index in path """
+    hash_index.INDEX_DIR = path
+    close_indexes()
+
+
+def close_indexes():
+    """ Closes all open indexes """
+    for index in hash_index._INDEXES.values():
+        index.close()
+    hash_index._INDEXES.clear()
+    hash_index._CACHE_DIRS.clear()
+
+
+def test_store_and_lookup():
+    """ Stored hashes are found while the file does not change """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        use_index_dir(os.path.join(tmp_dir, 'index'))
+        path = os.path.join(tmp_dir, 'foo.pkg.tar.xz')
+        with open(path, 'wb') as pkg_file:
+            pkg_file.write(b'package contents')
+
+        file_stat = hash_index.get_stat(path)
+        assert hash_index.lookup(path, 'sha256', file_stat) is None
+
+        hash_index.store(path, {'sha256': 'abc'}, file_stat)
+        assert hash_index.lookup(path, 'sha256', file_stat) == 'abc'
+        assert hash_index.lookup(path, 'md5', file_stat) is None
+
+        # Other hash types are added to the same entry
+        hash_index.store(path, {'md5': 'def'}, file_stat)
+        assert hash_index.lookup(path, 'sha256', file_stat) == 'abc'
+        assert hash_index.lookup(path, 'md5', file_stat) == 'def'
+
+        # Relative and absolute paths share the entry
+        old_cwd = os.getcwd()
+        try:
+            os.chdir(tmp_dir)
+            assert hash_index.lookup('foo.pkg.tar.xz', 'md5', file_stat) == 'def'
+        finally:
+            os.chdir(old_cwd)
+
+        assert os.path.exists(os.path.join(tmp_dir, 'index', hash_index.INDEX_NAME))
+        close_indexes()
+
+
+def test_changed_file():
+    """ Hashes of a file that has changed are not used """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        use_index_dir(tmp_dir)
+        path = os.path.join(tmp_dir, 'foo.pkg.tar.xz')
+        with open(path, 'wb') as pkg_file:
+            pkg_file.write(b'package contents')
+        file_stat = hash_index.get_stat(path)
+        hash_index.store(path, {'sha256': 'abc'}, file_stat)
+
+        with open(path, 'ab') as pkg_file:
+            pkg_file.write(b' changed')
+        new_stat = hash_index.get_stat(path)
+        assert hash_index.lookup(path, 'sha256', new_stat) is None
+
+        # File changed while it was being hashed, nothing is stored
+        hash_index.store(path, {'sha256': 'old'}, file_stat)
+        assert hash_index.lookup(path, 'sha256', file_stat) == 'abc'
+        assert hash_index.lookup(path, 'sha256', new_stat) is None
+        close_indexes()
+
+
+def test_missing_file():
+    """ Missing files have no stat and no hashes """
+    assert hash_index.get_stat('/nonexistent/foo.pkg.tar.xz') is None
+    assert hash_index.lookup('/nonexistent/foo.pkg.tar.xz', 'sha256', None) is None
+
+
+def test_cache_dir_index():
+    """ Files in cache dirs are indexed by name in the cache dir itself,
+        so the index can be used again from another mount point """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        use_index_dir(os.path.join(tmp_dir, 'session'))
+        cache_dir = os.path.join(tmp_dir, 'usb')
+        os.makedirs(cache_dir)
+        hash_index.add_cache_dirs([cache_dir])
+        path = os.path.join(cache_dir, 'foo.pkg.tar.xz')
+        with open(path, 'wb') as pkg_file:
+            pkg_file.write(b'package contents')
+        file_stat = hash_index.get_stat(path)
+        hash_index.store(path, {'sha256': 'abc'}, file_stat)
+
+        assert os.path.exists(os.path.join(cache_dir, hash_index.CACHE_INDEX_NAME))
+        assert not os.path.exists(os.path.join(tmp_dir, 'session', hash_index.INDEX_NAME))
+
+        # Reboot and mount the cache somewhere else
+        close_indexes()
+        new_cache_dir = os.path.join(tmp_dir, 'mnt')
+        os.rename(cache_dir, new_cache_dir)
+        hash_index.add_cache_dirs([new_cache_dir])
+        new_path = os.path.join(new_cache_dir, 'foo.pkg.tar.xz')
+        new_stat = hash_index.get_stat(new_path)
+        assert hash_index.lookup(new_path, 'sha256', new_stat) == 'abc'
+        close_indexes()
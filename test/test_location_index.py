@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_location_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests that the timezone map location grid finds the same locations
+    as checking all of them """
+
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from misc.location_index import LocationIndex
+
+WIDTH = 800
+HEIGHT = 400
+CELL = LocationIndex.CELL_SIZE
+
+
+def longitude_to_x(longitude, width=WIDTH):
+    """ Same projection the timezone map uses (x can be out of the map) """
+    return width * (0.5 + (longitude / 360.0) + (-6.0 / 180.0))
+
+
+def linear_nearest(points, my_x, my_y):
+    """ Nearest location, checking all of them (first one wins on ties) """
+    nearest = None
+    small_dist = -1
+    for point_x, point_y, location in points:
+        diff_x = point_x - my_x
+        diff_y = point_y - my_y
+        dist = diff_x * diff_x + diff_y * diff_y
+        if small_dist == -1 or dist < small_dist:
+            nearest = location
+            small_dist = dist
+    return nearest
+
+
+def check(points, queries):
+    """ Grid and linear search must give the same location """
+    index = LocationIndex(points)
+    for my_x, my_y in queries:
+        assert index.get_nearest(my_x, my_y) == linear_nearest(points, my_x, my_y), (my_x, my_y)
+
+
+def test_empty():
+    """ An empty grid has no nearest location """
+    index = LocationIndex([])
+    assert index.get_nearest(0, 0) is None
+    assert index.get_nearest(WIDTH / 2, HEIGHT / 2) is None
+
+
+def test_random_points():
+    """ Random locations and random clicks """
+    rand = random.Random(1)
+    points = [(rand.uniform(0, WIDTH), rand.uniform(0, HEIGHT), index) for index in range(400)]
+    queries = [(rand.uniform(0, WIDTH), rand.uniform(0, HEIGHT)) for _index in range(2000)]
+    check(points, queries)
+
+
+def test_sparse_points():
+    """ A few locations far from each other (many empty rings) """
+    rand = random.Random(2)
+    points = [(rand.uniform(0, WIDTH), rand.uniform(0, HEIGHT), index) for index in range(3)]
+    queries = [(rand.uniform(-50, WIDTH + 50), rand.uniform(-50, HEIGHT + 50))
+               for _index in range(500)]
+    check(points, queries)
+
+
+def test_cell_edges():
+    """ Locations and clicks on (and next to) cell borders """
+    points = []
+    for column in range(0, WIDTH // CELL, 3):
+        for row in range(0, HEIGHT // CELL, 5):
+            edge_x = column * CELL
+            edge_y = row * CELL
+            points.append((edge_x, edge_y, (column, row, 0)))
+            points.append((edge_x - 0.001, edge_y + CELL / 2, (column, row, 1)))
+            points.append((edge_x + CELL - 0.001, edge_y + CELL - 0.001, (column, row, 2)))
+    queries = []
+    for column in range(WIDTH // CELL):
+        for delta in (-0.5, -0.001, 0, 0.001, 0.5):
+            queries.append((column * CELL + delta, (column * 7) % HEIGHT + delta))
+            queries.append((column * CELL + delta, column * CELL % HEIGHT))
+    check(points, queries)
+
+
+def test_antimeridian():
+    """ Locations at both sides of the antimeridian are projected to both
+        sides of the map (some of them out of it) """
+    rand = random.Random(3)
+    points = []
+    for index in range(100):
+        longitude = rand.choice([-1, 1]) * rand.uniform(170, 180)
+        points.append((longitude_to_x(longitude), rand.uniform(0, HEIGHT), index))
+    queries = []
+    for _index in range(500):
+        queries.append((rand.uniform(-10, 10), rand.uniform(0, HEIGHT)))
+        queries.append((rand.uniform(WIDTH - 10, WIDTH + 10), rand.uniform(0, HEIGHT)))
+        queries.append((rand.uniform(0, WIDTH), rand.uniform(0, HEIGHT)))
+    check(points, queries)
+
+
+def test_ties():
+    """ Locations at the same distance: the first one wins """
+    points = [
+        (CELL * 2, CELL * 2, 'first'),
+        (CELL * 2, CELL * 2, 'second'),
+        (CELL * 3, CELL * 2, 'right'),
+        (CELL * 1, CELL * 2, 'left')]
+    index = LocationIndex(points)
+    assert index.get_nearest(CELL * 2, CELL * 2) == 'first'
+    # Same distance to both, 'right' was given first
+    points = [(CELL * 3, 0, 'right'), (CELL * 1, 0, 'left')]
+    assert LocationIndex(points).get_nearest(CELL * 2, 0) == 'right'
+    assert linear_nearest(points, CELL * 2, 0) == 'right'
+
+
+def test_map_locations():
+    """ Projected world locations, clicks all over the map """
+    rand = random.Random(4)
+    points = []
+    for index in range(300):
+        longitude = rand.uniform(-180, 180)
+        latitude = rand.uniform(-59, 81)
+        point_y = HEIGHT * (81 - latitude) / 140
+        points.append((longitude_to_x(longitude), point_y, index))
+    queries = [(my_x, my_y) for my_x in range(0, WIDTH, 7) for my_y in range(0, HEIGHT, 11)]
+    check(points, queries)
+    assert math.isclose(longitude_to_x(180) - longitude_to_x(-180), WIDTH)
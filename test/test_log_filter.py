@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_log_filter.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests the log excerpts sent with bug reports """
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from logging_utils import ContextFilter
+
+
+def get_log(size, marks):
+    """ Returns size log lines. Lines in marks are warnings """
+    log = []
+    for index in range(size):
+        if index in marks:
+            log.append("{0} [WARNING] something\n".format(index))
+        else:
+            log.append("{0} [DEBUG] something\n".format(index))
+    return log
+
+
+def get_numbers(lines):
+    """ Returns line numbers of lines """
+    return [int(line.split()[0]) for line in lines]
+
+
+def test_context():
+    """ Lines around warnings and errors are kept """
+    log = get_log(100, [50])
+    lines = ContextFilter.filter_log_lines(iter(log), context=3)
+    assert get_numbers(lines) == list(range(47, 54))
+
+
+def test_merged_windows():
+    """ Overlapping windows are merged, without repeating lines """
+    log = get_log(100, [10, 14, 90])
+    log[14] = log[14].replace('[WARNING]', '[ERROR]')
+    lines = ContextFilter.filter_log_lines(iter(log), context=3)
+    assert get_numbers(lines) == list(range(7, 18)) + list(range(87, 94))
+
+
+def test_edges():
+    """ Windows at the start and end of the log are cut """
+    log = get_log(10, [0, 9])
+    lines = ContextFilter.filter_log_lines(iter(log), context=3)
+    assert get_numbers(lines) == [0, 1, 2, 3, 6, 7, 8, 9]
+    assert ContextFilter.filter_log_lines(iter(get_log(10, []))) == []
+
+
+def test_max_lines():
+    """ Only the last max_lines lines are kept """
+    log = get_log(1000, range(0, 1000, 5))
+    lines = ContextFilter.filter_log_lines(iter(log), context=2, max_lines=20)
+    # Lines after the last window (998, 999) are not kept
+    assert get_numbers(lines) == list(range(978, 998))
+
+
+def test_read_log_tail():
+    """ Only the last (complete) lines of a big log are read """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'pacman.log')
+        with open(path, 'w') as log:
+            log.writelines(get_log(1000, []))
+        lines = ContextFilter.read_log_tail(path, max_bytes=100)
+        assert lines
+        assert len(lines) < 10
+        assert lines[-1] == "999 [DEBUG] something"
+        assert all(line.endswith("[DEBUG] something") for line in lines)
+
+        # Small files are read whole
+        assert len(ContextFilter.read_log_tail(path)) == 1000
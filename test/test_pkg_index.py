@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_pkg_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests the package index (name, group and provides lookups) """
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import pacman.pkg_index as pkg_index
+
+
+class StubPkg():
+    """ Minimal alpm package """
+    def __init__(self, name, db_name, provides=None, groups=None):
+        self.name = name
+        self.db_name = db_name
+        self.provides = provides or []
+        self.groups = groups or []
+
+    def __repr__(self):
+        return "{0}/{1}".format(self.db_name, self.name)
+
+
+class StubDb():
+    """ Minimal alpm database """
+    def __init__(self, name, pkgcache):
+        self.name = name
+        self.pkgcache = pkgcache
+
+
+class StubAlpm():
+    """ Replaces pyalpm (versions are ignored) """
+    @staticmethod
+    def find_satisfier(pkgs, dep):
+        dep_name = pkg_index.get_dep_name(dep)
+        for pkg in pkgs:
+            provides = [pkg_index.get_dep_name(provide) for provide in pkg.provides]
+            if pkg.name == dep_name or dep_name in provides:
+                return pkg
+        return None
+
+
+pkg_index.pyalpm = StubAlpm
+
+
+def get_index():
+    """ Builds an index of two repositories (antergos has priority) """
+    antergos = StubDb('antergos', [
+        StubPkg('cnchi', 'antergos'),
+        StubPkg('numix-icon-theme', 'antergos', groups=['antergos-theme']),
+        StubPkg('lightdm', 'antergos', groups=['antergos-theme'])])
+    core = StubDb('core', [
+        StubPkg('lightdm', 'core'),
+        StubPkg('netctl', 'core', provides=['netctl-helpers=1.0'], groups=['base']),
+        StubPkg('openresolv', 'core', provides=['resolvconf'], groups=['base']),
+        StubPkg('bash', 'core', provides=['sh'], groups=['base']),
+        StubPkg('antergos-theme', 'core'),
+        StubPkg('connman', 'core', provides=['resolvconf'])])
+    return pkg_index.PackageIndex([antergos, core])
+
+
+def test_get_dep_name():
+    """ Dependency strings lose their version """
+    assert pkg_index.get_dep_name('foo>=1.0') == 'foo'
+    assert pkg_index.get_dep_name('foo=1.0') == 'foo'
+    assert pkg_index.get_dep_name('foo') == 'foo'
+
+
+def test_first_repo_wins():
+    """ Packages in several repositories are taken from the first one """
+    index = get_index()
+    assert index.get_pkg('lightdm').db_name == 'antergos'
+    assert index.get_pkg('lightdm', 'core').db_name == 'core'
+    assert index.get_pkg('missing') is None
+
+    result = index.resolve(['lightdm', 'bash'])
+    assert [pkg.db_name for pkg in result.pkgs.values()] == ['antergos', 'core']
+
+
+def test_resolve_groups():
+    """ Group names are expanded, keeping the order of the packages """
+    index = get_index()
+    result = index.resolve(['base', 'cnchi', 'unknown', 'base'])
+    assert list(result.pkgs) == ['netctl', 'openresolv', 'bash', 'cnchi']
+    assert result.groups == {'base'}
+    assert result.not_found == ['unknown']
+    assert result.conflicts == []
+
+
+def test_package_before_group():
+    """ A package wins over a group with the same name """
+    index = get_index()
+    result = index.resolve(['antergos-theme'])
+    assert list(result.pkgs) == ['antergos-theme']
+    assert result.pkgs['antergos-theme'].db_name == 'core'
+    assert result.groups == set()
+
+
+def test_repo_only_names():
+    """ Names in repo_only_names are only searched in the given repo """
+    index = get_index()
+    result = index.resolve(
+        ['lightdm', 'antergos-theme', 'bash'],
+        repo_only_names={'lightdm', 'antergos-theme', 'bash'},
+        repo='antergos')
+    assert list(result.pkgs) == ['lightdm', 'numix-icon-theme']
+    assert result.pkgs['lightdm'].db_name == 'antergos'
+    assert result.groups == {'antergos-theme'}
+    assert result.not_found == ['bash']
+
+    result = index.resolve(['lightdm'], repo_only_names={'lightdm'}, repo='core')
+    assert result.pkgs['lightdm'].db_name == 'core'
+
+
+def test_conflicts_in_groups():
+    """ Conflicting packages are skipped, even inside a group """
+    index = get_index()
+    result = index.resolve(['base', 'connman'], conflicts=['openresolv'])
+    assert list(result.pkgs) == ['netctl', 'bash', 'connman']
+    assert result.conflicts == ['openresolv']
+
+
+def test_group_pkg_names():
+    """ Package names of groups are taken from the given repo """
+    index = get_index()
+    assert index.get_group_pkg_names('core', ['base']) == {'netctl', 'openresolv', 'bash'}
+    assert index.get_group_pkg_names('antergos', ['base']) == set()
+
+
+def test_find_satisfier():
+    """ Dependencies are satisfied by name or by provides """
+    index = get_index()
+    assert index.find_satisfier('bash').name == 'bash'
+    assert index.find_satisfier('sh').name == 'bash'
+    assert index.find_satisfier('netctl-helpers>=1.0').name == 'netctl'
+    # Several providers, the first one (in repository order) wins
+    assert index.find_satisfier('resolvconf').name == 'openresolv'
+    assert index.find_satisfier('lightdm').db_name == 'antergos'
+    assert index.find_satisfier('missing') is None
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_speed_meter.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Tests the download speed meter """
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from misc.speed_meter import SpeedMeter, Progress, format_speed, format_progress
+
+
+def test_progress():
+    """ Progress is reported with fraction, speed and remaining time """
+    meter = SpeedMeter(total=1000, max_updates=1000)
+    assert meter.get_progress() == Progress(0, 1000, 0.0, 0.0, None)
+
+    time.sleep(0.01)
+    progress = meter.add(250)
+    assert progress is not None
+    assert progress.done == 250
+    assert progress.fraction == 0.25
+    assert progress.bps > 0
+    assert progress.eta is not None and progress.eta > 0
+
+    meter.update(2000)
+    progress = meter.get_progress()
+    assert progress.fraction == 1.0
+    assert progress.eta == 0
+
+
+def test_rate_limit():
+    """ Progress is not reported more than max_updates times per second """
+    meter = SpeedMeter(total=1000, max_updates=1)
+    assert meter.add(100) is None
+    assert meter.add(100) is None
+    assert meter.get_progress().done == 200
+
+
+def test_totals():
+    """ Total can be changed, but it is never negative """
+    meter = SpeedMeter()
+    assert meter.get_progress().fraction == 0.0
+    meter.set_total(100)
+    meter.add_total(50)
+    assert meter.total == 150
+    meter.add_total(-500)
+    assert meter.total == 0
+    meter.set_total(-1)
+    assert meter.total == 0
+
+
+def test_ewma():
+    """ Bandwidth is a weighted average of the samples """
+    meter = SpeedMeter(total=0, max_updates=1000, alpha=0.5)
+    time.sleep(0.01)
+    first = meter.add(1000).bps
+    time.sleep(0.01)
+    second = meter.add(0).bps
+    # An empty sample halves the average
+    assert 0 < second < first
+    assert abs(second - first * 0.5) < first * 0.01
+
+
+def test_format():
+    """ Speeds and progress are formatted for the user """
+    assert format_speed(512) == "512.00 B/s"
+    assert format_speed(2048) == "2.00 KiB/s"
+    assert format_speed(3 * 1048576) == "3.00 MiB/s"
+    assert format_progress(Progress(50, 100, 0.5, 1024, 75)) == "50%   1.00 KiB/s   1:15 left"
+    assert format_progress((50, 100, 0.5, 1024, 3725)) == "50%   1.00 KiB/s   1:02:05 left"
+    assert format_progress(Progress(0, 0, 0.0, 0, None)) == "0%   0.00 B/s"